@@ -0,0 +1,332 @@
+import numpy as np
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+# Use the sigqc package of this repository when it is not installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sigqc import sigqc_synthetic
+
+#########################################################################################################################
+# bench_sigqc.py
+#
+# Benchmark harness of the SigQC parsers, PCA and reporting. Synthetic SigQC exports are
+# generated once per scale (see sigqc_synthetic) into a data folder, and every benchmark runs
+# in its own Python process, so the peak resident memory reported is that of the benchmark
+# alone. Each benchmark reports the median wall time of its repeats, its throughput in units
+# per second (and megabytes per second for the parsers) and the peak RSS of its process.
+#
+# Benchmarks:
+#  ascii_read           SigQCAsciiTestCaseFile.read() of a test file
+#  ascii_alltestcases   SigQCAsciiTestCaseFile.getAllTestCases() of a parsed test file
+#  unit_read            SigQCUnitDataFile.Read() of a unit data file with missing values
+#  covariance           sigqc_pca.getCovariance() of the test dataset
+#  eigen                sigqc_pca.getEigen() of its covariance matrix
+#  implementpca         implementPCA() of the test file against a stored reference (no report)
+#  report               SigQCReport with PC score plots and boxplot of the test units, written to disk
+#  pcscores             sigqc_pca.getPCScores() of the test dataset for 10 PCs
+#  group_matching       SigQCTestCaseGroup.FindMatchingIDsOf() and MakeUniqueGroup() of the feature identifiers
+#
+# Example Usage:
+#  python benchmarks/bench_sigqc.py
+#  python benchmarks/bench_sigqc.py --scales small,medium,large --repeat 5 --json results.json
+#  python benchmarks/bench_sigqc.py --benchmarks ascii_read,unit_read --data-dir C:\temp\sigqcbench
+#
+#########################################################################################################################
+
+# Sizes of the generated data: units of the test files, test cases and domain points per case.
+# Reference files hold a fifth of the units.
+SCALES = {"small":  {"units": 500,   "cases": 10, "points": 50},
+          "medium": {"units": 5000,  "cases": 20, "points": 100},
+          "large":  {"units": 20000, "cases": 20, "points": 100}}
+DEFAULT_SCALES = "small,medium"
+# Rate of missing values in the generated unit data files
+MISSING_RATE = 0.01
+
+def getDataFiles(i_datadir, i_scale):
+    '''
+    Returns a dictionary with the paths of the data files of a scale.
+    '''
+    params = SCALES[i_scale]
+    name = "{}x{}x{}".format(params["units"], params["cases"], params["points"])
+    return {"reference": os.path.join(i_datadir, "reference_"+name+".csv"),
+            "ascii": os.path.join(i_datadir, "ascii_"+name+".csv"),
+            "unit": os.path.join(i_datadir, "unit_"+name+".csv")}
+
+def generateData(i_datadir, i_scale):
+    '''
+    Writes the synthetic data files of a scale unless they already exist.
+    '''
+    params = SCALES[i_scale]
+    files = getDataFiles(i_datadir, i_scale)
+    product = sigqc_synthetic.SigQCSyntheticProduct(n_cases=params["cases"], n_points=params["points"], n_tests=2, seed=1)
+    n_reference = max(params["units"]//5, 100)
+    if not os.path.exists(files["reference"]):
+        product.writeAsciiTestCaseFile(files["reference"], n_reference)
+    if not os.path.exists(files["ascii"]):
+        product.writeAsciiTestCaseFile(files["ascii"], params["units"], first_unit=n_reference, defect_rate=0.01)
+    if not os.path.exists(files["unit"]):
+        product.writeUnitDataFile(files["unit"], params["units"], first_unit=n_reference, missing_rate=MISSING_RATE)
+    return files
+
+###################################
+# Benchmarks
+###################################
+# Each benchmark is a pair of functions: setup(files, workdir) returns the state passed to
+# run(state), and only run() is timed. The third entry names the file whose size gives the
+# megabytes per second of parsers, or None.
+
+def _setupFile(i_key):
+    return lambda files, workdir: files[i_key]
+
+def _runAsciiRead(i_filename):
+    from sigqc import sigqc_asciitestcase
+    sigqc_asciitestcase.SigQCAsciiTestCaseFile(i_filename)
+
+def _setupAllTestCases(files, workdir):
+    from sigqc import sigqc_asciitestcase
+    return sigqc_asciitestcase.SigQCAsciiTestCaseFile(files["ascii"])
+
+def _runAllTestCases(i_file):
+    i_file.getAllTestCases()
+
+def _runUnitRead(i_filename):
+    from sigqc import sigqc_unitdata
+    sigqc_unitdata.SigQCUnitDataFile(i_filename)
+
+def _setupDataset(files, workdir):
+    from sigqc import sigqc_referencemodel
+    return sigqc_referencemodel.readDataset(files["ascii"], "ascii")[2]
+
+def _runCovariance(i_dataset):
+    from sigqc import sigqc_pca
+    sigqc_pca.getCovariance(i_dataset)
+
+def _setupEigen(files, workdir):
+    from sigqc import sigqc_pca
+    return sigqc_pca.getCovariance(_setupDataset(files, workdir))
+
+def _runEigen(i_covariance):
+    from sigqc import sigqc_pca
+    sigqc_pca.getEigen(i_covariance)
+
+def _setupImplementPCA(files, workdir):
+    from sigqc import sigqc_implementpca
+    sigqc_implementpca.storeReferenceData(files["reference"], input_type="ascii", opath=workdir+os.sep, oname="Reference.csv")
+    return (os.path.join(workdir, "Reference.csv"), files["ascii"], os.path.join(workdir, "PCA_Results"))
+
+def _runImplementPCA(i_state):
+    from sigqc import sigqc_implementpca
+    reference, testfile, o_file = i_state
+    sigqc_implementpca.implementPCA(reference, testfile, input_type="ascii", o_file=o_file, generate_report=False, spc_pcs=5)
+
+def _setupReport(files, workdir):
+    from sigqc import sigqc_referencemodel
+    model = sigqc_referencemodel.SigQCReferenceModel()
+    serials, headers, dataset = sigqc_referencemodel.readDataset(files["ascii"], "ascii")
+    model.build(dataset)
+    return (serials, model.score(dataset, n_pcs=11), os.path.join(workdir, "Report.docx"))
+
+def _runReport(i_state):
+    from sigqc import sigqc_report, sigqc_render
+    serials, pcscores, o_filename = i_state
+    report = sigqc_report.SigQCReport()
+    figures = sigqc_render.renderPCScores(pcscores, "PC Scores", n_pcs=10, to_files=False, mode="auto")
+    figures.append(sigqc_render.renderPCBoxPlots(list(pcscores[:,:10].T)))
+    report.addSection("PC Scores", "Unit(s) Tested: "+" , ".join(serials), i_figures=figures)
+    report.writeReport(o_docname=o_filename)
+
+def _setupPCScores(files, workdir):
+    from sigqc import sigqc_pca
+    dataset = _setupDataset(files, workdir)
+    evals, evecs = sigqc_pca.getEigen(sigqc_pca.getCovariance(dataset))
+    return (dataset, evals, evecs)
+
+def _runPCScores(i_state):
+    from sigqc import sigqc_pca
+    dataset, evals, evecs = i_state
+    sigqc_pca.getPCScores(dataset, evals, evecs, n_pcs=10)
+
+def _setupGroupMatching(files, workdir):
+    from sigqc import sigqc_asciitestcase, sigqc_primitives
+    # One identifier per feature of the reference file, as named by getAllTestCases()
+    reference = sigqc_asciitestcase.SigQCAsciiTestCaseFile(files["reference"])
+    group = sigqc_primitives.SigQCTestCaseGroup()
+    for i in range(reference.getTestCaseCount()):
+        matrix = reference.getMatrixAt(i)
+        header = matrix.getHeader()
+        for x in matrix.getXValues():
+            group.AppendByNames(header.getProdName(), header.getTestName(), header.getCaseName()+" "+str(x))
+    patterns = sigqc_primitives.SigQCTestCaseGroup()
+    for name in ["Case00"+str(i) for i in range(10)]+["Test1", "20000"]:
+        patterns.AppendByNames("", "", name, False)
+    return (group, patterns)
+
+def _runGroupMatching(i_state):
+    group, patterns = i_state
+    group.FindMatchingIDsOf(patterns)
+    group.MakeUniqueGroup()
+
+BENCHMARKS = {"ascii_read": (_setupFile("ascii"), _runAsciiRead, "ascii"),
+              "ascii_alltestcases": (_setupAllTestCases, _runAllTestCases, None),
+              "unit_read": (_setupFile("unit"), _runUnitRead, "unit"),
+              "covariance": (_setupDataset, _runCovariance, None),
+              "eigen": (_setupEigen, _runEigen, None),
+              "implementpca": (_setupImplementPCA, _runImplementPCA, "ascii"),
+              "report": (_setupReport, _runReport, None),
+              "pcscores": (_setupPCScores, _runPCScores, None),
+              "group_matching": (_setupGroupMatching, _runGroupMatching, None)}
+
+###################################
+# Memory
+###################################
+def getPeakRSS():
+    '''
+    Returns the peak resident set size of the current process in megabytes, or None if it
+    cannot be determined on this platform.
+    '''
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak/(1024.0*1024.0) if (sys.platform == "darwin") else peak/1024.0
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)/(1024.0*1024.0)
+    except ImportError:
+        return None
+
+def getCurrentRSS():
+    '''
+    Returns the current resident set size of the current process in megabytes, or None if it
+    cannot be determined on this platform.
+    '''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")/(1024.0*1024.0)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss/(1024.0*1024.0)
+    except ImportError:
+        return None
+
+###################################
+# Running
+###################################
+def runBenchmarkInProcess(i_name, i_scale, i_datadir, repeat=3):
+    '''
+    Runs one benchmark in the current process and returns a dictionary with the wall time of
+    each repeat in seconds, the RSS after setup and the peak RSS in megabytes.
+    '''
+    setup, run, sizekey = BENCHMARKS[i_name]
+    files = getDataFiles(i_datadir, i_scale)
+    with tempfile.TemporaryDirectory(prefix="sigqcbench") as workdir:
+        state = setup(files, workdir)
+        gc.collect()
+        setuprss = getCurrentRSS()
+        times = []
+        for i in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            run(state)
+            times.append(time.perf_counter()-start)
+        return {"times": times, "setup_rss_mb": setuprss, "peak_rss_mb": getPeakRSS()}
+
+def runBenchmark(i_name, i_scale, i_datadir, repeat=3):
+    '''
+    Runs one benchmark in a new Python process and returns its results: the benchmark name and
+    scale, the wall time of each repeat and their median in seconds, the throughput in units
+    (and for parsers megabytes) per second, and the RSS after setup and peak RSS of the process
+    in megabytes.
+    '''
+    command = [sys.executable, os.path.abspath(__file__), "--child", i_name, "--scales", i_scale,
+               "--data-dir", i_datadir, "--repeat", str(repeat)]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    units = SCALES[i_scale]["units"]
+    median = float(np.median(result["times"]))
+    result.update({"benchmark": i_name, "scale": i_scale, "units": units, "median_s": median,
+                   "units_per_s": units/median if (median > 0) else None})
+    sizekey = BENCHMARKS[i_name][2]
+    if (sizekey is not None):
+        megabytes = os.path.getsize(getDataFiles(i_datadir, i_scale)[sizekey])/(1024.0*1024.0)
+        result["mb_per_s"] = megabytes/median if (median > 0) else None
+    return result
+
+def _formatNumber(i_value, i_format):
+    return "-" if (i_value is None) else i_format.format(i_value)
+
+def printResults(i_results):
+    '''
+    Prints benchmark results as a table.
+    '''
+    print("{:<20} {:<7} {:>10} {:>12} {:>9} {:>10} {:>10}".format("benchmark", "scale", "median s", "units/s", "MB/s", "setup MB", "peak MB"))
+    for result in i_results:
+        print("{:<20} {:<7} {:>10} {:>12} {:>9} {:>10} {:>10}".format(result["benchmark"], result["scale"],
+              _formatNumber(result["median_s"], "{:.4f}"), _formatNumber(result["units_per_s"], "{:.0f}"),
+              _formatNumber(result.get("mb_per_s"), "{:.1f}"), _formatNumber(result["setup_rss_mb"], "{:.0f}"),
+              _formatNumber(result["peak_rss_mb"], "{:.0f}")))
+
+def runBenchmarks(i_names=None, i_scales=DEFAULT_SCALES, i_datadir=None, repeat=3, verbose=True):
+    '''
+    Generates the data of the requested scales and runs the requested benchmarks at each of
+    them. Returns a list of the results of runBenchmark().
+    '''
+    names = list(BENCHMARKS) if (i_names is None) else list(i_names)
+    scales = i_scales.split(",") if isinstance(i_scales, str) else list(i_scales)
+    for name in names:
+        if (name not in BENCHMARKS):
+            raise Exception("Error: Unknown benchmark '{}'. Valid options include {}".format(name, ", ".join(BENCHMARKS)))
+    for scale in scales:
+        if (scale not in SCALES):
+            raise Exception("Error: Unknown scale '{}'. Valid options include {}".format(scale, ", ".join(SCALES)))
+    if (i_datadir is None):
+        i_datadir = os.path.join(tempfile.gettempdir(), "sigqc_benchmark_data")
+    os.makedirs(i_datadir, exist_ok=True)
+
+    results = []
+    for scale in scales:
+        if (verbose):
+            print("Generating {} data in {}".format(scale, i_datadir), file=sys.stderr)
+        generateData(i_datadir, scale)
+        for name in names:
+            if (verbose):
+                print("Running {} ({})".format(name, scale), file=sys.stderr)
+            results.append(runBenchmark(name, scale, i_datadir, repeat))
+    return results
+
+def getArgumentParser():
+    parser = argparse.ArgumentParser(description="Benchmarks of the sigqc parsers, PCA and reporting.")
+    parser.add_argument("--benchmarks", default=None, help="Comma separated benchmark names (default: all): "+", ".join(BENCHMARKS))
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="Comma separated scales: "+", ".join(SCALES))
+    parser.add_argument("--repeat", type=int, default=3, help="Timed repeats per benchmark")
+    parser.add_argument("--data-dir", default=None, help="Folder of the generated data (kept between runs)")
+    parser.add_argument("--json", default=None, help="Write the results to a JSON file")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    return parser
+
+def main(i_args=None):
+    args = getArgumentParser().parse_args(i_args)
+    if (args.child is not None):
+        print(json.dumps(runBenchmarkInProcess(args.child, args.scales, args.data_dir, args.repeat)))
+        return 0
+    names = None if (args.benchmarks is None) else args.benchmarks.split(",")
+    results = runBenchmarks(names, args.scales, args.data_dir, args.repeat)
+    printResults(results)
+    if (args.json is not None):
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import numpy as np
+import os
+import sys
+import argparse
+
+# Use the sigqc package of this repository when it is not installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sigqc import sigqc_synthetic
+from sigqc import sigqc_pca
+from sigqc import sigqc_spc
+from sigqc import sigqc_blockpca
+
+#########################################################################################################################
+# check_limits.py
+#
+# Calibration check of the T-squared and SPE control limits of sigqc_spc. Reference units of a
+# synthetic product (see sigqc_synthetic) are screened against the eigensystem of their own
+# dataset, once for all features and once for each test case, with the number of PCs that
+# explains a proportion of the variance. In-control units should pass each limit at a rate of
+# about 1-alpha, so a limit is reported as failed when its false alarm rate exceeds alpha by
+# more than three binomial standard errors plus a margin. The unit-level screening of a block
+# model (see sigqc_blockpca), fitted with one block per test case, is checked the same way.
+# Exits with status 1 if any limit failed.
+#
+# Example Usage:
+#  python benchmarks/check_limits.py
+#  python benchmarks/check_limits.py --units 1000 --alpha 0.01 --variance 0.95
+#
+#########################################################################################################################
+
+# Allowed excess of the false alarm rate over alpha, on top of three binomial standard errors
+MARGIN = 0.01
+
+def getAllowedRate(i_alpha, n_units, margin=MARGIN):
+    '''
+    Returns the largest false alarm rate of n_units in-control units accepted for a limit at
+    significance level i_alpha.
+    '''
+    return i_alpha + 3*np.sqrt(i_alpha*(1-i_alpha)/n_units) + margin
+
+def checkReferenceLimits(i_dataset, i_name, alpha=0.05, variance=0.9):
+    '''
+    Screens the units of a dataset against its own eigensystem and returns a list with one
+    result dictionary per limit (T-squared with the F limit, SPE with the Jackson-Mudholkar
+    and the chi-square limit).
+    '''
+    n_units = len(i_dataset)
+    evals, evecs = sigqc_pca.getEigenFromData(i_dataset)
+    n_pcs = min(sigqc_pca.SigQCVarianceProfile(evals).getPCCountFor(variance), n_units-1)
+    t2, spe = sigqc_spc.getT2AndSPE(i_dataset, np.mean(i_dataset, axis=0), evals, evecs, n_pcs)
+    limits = [("t2", t2, sigqc_spc.getT2Limit(n_units, n_pcs, alpha=alpha, method="f"))]
+    for method in ("jackson", "chi2"):
+        limits.append(("spe_"+method, spe, sigqc_spc.getSPELimit(evals, n_pcs, alpha=alpha, method=method)))
+
+    allowed = getAllowedRate(alpha, n_units)
+    results = []
+    for statistic, values, limit in limits:
+        rate = float(np.mean(values > limit))
+        results.append({"dataset": i_name, "n_pcs": n_pcs, "statistic": statistic, "limit": float(limit),
+                        "alarm_rate": rate, "ok": rate <= allowed})
+    return results
+
+def checkBlockModel(i_dataset, i_featurekeys, alpha=0.05, variance=0.9):
+    '''
+    Screens the units of a dataset against a block model of it with one block per test case
+    and returns a result dictionary of the unit-level pass/fail.
+    '''
+    blockmodel = sigqc_blockpca.SigQCBlockModel()
+    blockmodel.build(i_dataset, i_featurekeys, variance=variance, workers=1)
+    summary = blockmodel.score(i_dataset, i_featurekeys, alpha=alpha, workers=1)
+    rate = float(np.mean(~summary["pass"]))
+    return {"dataset": "blocks", "n_pcs": sum(blockmodel.getSPCCounts()), "statistic": "unit", "limit": float("nan"),
+            "alarm_rate": rate, "ok": rate <= getAllowedRate(alpha, len(i_dataset))}
+
+def printResults(i_results, i_alpha):
+    print("{:<16} {:>6} {:<12} {:>12} {:>10}  (alpha {})".format("dataset", "pcs", "statistic", "limit", "alarms", i_alpha))
+    for result in i_results:
+        print("{:<16} {:>6} {:<12} {:>12.4g} {:>10.3f}  {}".format(result["dataset"], result["n_pcs"], result["statistic"],
+              result["limit"], result["alarm_rate"], "ok" if result["ok"] else "FAILED"))
+
+def getArgumentParser():
+    parser = argparse.ArgumentParser(description="Calibration check of the sigqc T-squared and SPE control limits.")
+    parser.add_argument("--units", type=int, default=1000, help="Reference units generated")
+    parser.add_argument("--cases", type=int, default=10, help="Test cases of the synthetic product")
+    parser.add_argument("--points", type=int, default=50, help="Domain points per test case")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Significance level of the limits")
+    parser.add_argument("--variance", type=float, default=0.9, help="Proportion of variance explained by the retained PCs")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+def main(i_args=None):
+    args = getArgumentParser().parse_args(i_args)
+    product = sigqc_synthetic.SigQCSyntheticProduct(n_cases=args.cases, n_points=args.points, seed=args.seed)
+    serials, stamps, dataset = product.getUnits(args.units)
+
+    results = checkReferenceLimits(dataset, "all", args.alpha, args.variance)
+    for i in range(args.cases):
+        columns = slice(i*args.points, (i+1)*args.points)
+        results += checkReferenceLimits(dataset[:,columns], product.getCaseName(i), args.alpha, args.variance)
+    featurekeys = ["{}@{}".format(product.getCaseName(i), point) for i in range(args.cases) for point in range(args.points)]
+    results.append(checkBlockModel(dataset, featurekeys, args.alpha, args.variance))
+    printResults(results, args.alpha)
+    return 0 if all(result["ok"] for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import numpy as np
+import os
+import sys
+import json
+import socket
+import hashlib
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+
+import bench_sigqc
+
+#########################################################################################################################
+# regression.py
+#
+# Performance regression gate of the SigQC benchmarks (see bench_sigqc.py). "record" runs the
+# benchmarks and stores, for each benchmark and scale, the median and interquartile range of
+# its wall time and its peak memory in a JSON baseline together with a fingerprint of the
+# environment (Python, NumPy/SciPy versions, platform and CPU). "compare" runs the benchmarks
+# again and compares them against the baseline:
+#
+#  - time regression:   new median > baseline median * (1 + time tolerance) + iqr factor * baseline IQR
+#  - memory regression: new peak RSS > baseline peak RSS * (1 + memory tolerance) + memory slack
+#
+# and exits with status 1 if any benchmark regressed, so it can gate a build. A baseline
+# recorded in a different environment is reported and, with --strict-env, fails with status 2,
+# because timings from different machines are not comparable. A benchmark of the baseline that
+# was not run (dropped or renamed) also fails the gate with status 1; narrow the comparison
+# with --benchmarks and --scales to compare a subset.
+#
+# Example Usage:
+#  python benchmarks/regression.py record --baseline benchmarks/baseline.json --scales small,medium --repeat 7
+#  python benchmarks/regression.py compare --baseline benchmarks/baseline.json --time-tolerance 0.2 --tolerance eigen=0.5
+#
+#########################################################################################################################
+
+# Default tolerances of compare
+TIME_TOLERANCE = 0.15
+MEMORY_TOLERANCE = 0.10
+MEMORY_SLACK_MB = 8.0
+IQR_FACTOR = 1.0
+DEFAULT_REPEAT = 7
+
+def _getVersion(i_module):
+    try:
+        return __import__(i_module).__version__
+    except (ImportError, AttributeError):
+        return None
+
+def getEnvironment():
+    '''
+    Returns a dictionary describing the environment benchmarks run in, and its fingerprint:
+    a hash of the fields that affect timings (host name and git revision are informational).
+    '''
+    environment = {"python": platform.python_version(), "implementation": platform.python_implementation(),
+                   "system": platform.system(), "release": platform.release(), "machine": platform.machine(),
+                   "processor": platform.processor(), "cpu_count": os.cpu_count(),
+                   "numpy": _getVersion("numpy"), "scipy": _getVersion("scipy"),
+                   "matplotlib": _getVersion("matplotlib"), "docx": _getVersion("docx")}
+    fingerprint = hashlib.sha1(json.dumps(environment, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    environment["fingerprint"] = fingerprint
+    environment["host"] = socket.gethostname()
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        environment["revision"] = revision.stdout.strip() or None
+    except OSError:
+        environment["revision"] = None
+    return environment
+
+def getStatistics(i_result):
+    '''
+    Returns the statistics stored in a baseline for a result of bench_sigqc.runBenchmark():
+    the median, first and third quartiles, interquartile range and minimum of the wall times in
+    seconds, the number of repeats and the peak RSS in megabytes.
+    '''
+    times = np.array(i_result["times"])
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {"median_s": float(median), "q1_s": float(q1), "q3_s": float(q3), "iqr_s": float(q3-q1),
+            "min_s": float(np.min(times)), "repeats": len(times), "peak_rss_mb": i_result["peak_rss_mb"],
+            "units_per_s": i_result["units_per_s"]}
+
+def runStatistics(i_names, i_scales, i_datadir, repeat):
+    '''
+    Runs the benchmarks and returns a dictionary of their statistics keyed by "name@scale".
+    '''
+    results = bench_sigqc.runBenchmarks(i_names, i_scales, i_datadir, repeat)
+    return {"{}@{}".format(result["benchmark"], result["scale"]): getStatistics(result) for result in results}
+
+def writeBaseline(o_filename, i_statistics, i_environment):
+    '''
+    Writes a baseline JSON file.
+    '''
+    baseline = {"created": datetime.now().isoformat(timespec="seconds"), "environment": i_environment, "results": i_statistics}
+    with open(o_filename, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+
+def readBaseline(i_filename):
+    '''
+    Reads a baseline JSON file written by writeBaseline().
+    '''
+    with open(i_filename, 'r') as f:
+        return json.load(f)
+
+def compareStatistics(i_baseline, i_current, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE,
+                      memory_slack=MEMORY_SLACK_MB, iqr_factor=IQR_FACTOR, tolerances=None):
+    '''
+    Compares benchmark statistics against a baseline.
+
+    Inputs
+    ------
+        i_baseline - Dictionary of baseline statistics keyed by "name@scale".
+        i_current - Dictionary of current statistics keyed by "name@scale".
+        time_tolerance - (Optional) Allowed relative increase of the median wall time.
+        memory_tolerance - (Optional) Allowed relative increase of the peak RSS.
+        memory_slack - (Optional) Allowed absolute increase of the peak RSS in megabytes.
+        iqr_factor - (Optional) Multiple of the baseline IQR added to the allowed wall time, so
+            noisy benchmarks need a larger change to count as regressed.
+        tolerances - (Optional) Dictionary of time tolerances by benchmark name or "name@scale"
+            overriding time_tolerance.
+
+    Outputs
+    -------
+        Returns a list of dictionaries, one per benchmark of either set, holding the key, the
+        baseline and current median and peak RSS, the relative change of the median and the
+        status: "ok", "faster", "slower" (time regression), "memory" (memory regression),
+        "slower+memory", "new" (not in the baseline) or "missing" (not run).
+    '''
+    tolerances = {} if (tolerances is None) else tolerances
+    comparison = []
+    for key in sorted(set(i_baseline) | set(i_current)):
+        base, current = i_baseline.get(key), i_current.get(key)
+        entry = {"benchmark": key, "base_median_s": None if (base is None) else base["median_s"],
+                 "median_s": None if (current is None) else current["median_s"],
+                 "base_peak_rss_mb": None if (base is None) else base["peak_rss_mb"],
+                 "peak_rss_mb": None if (current is None) else current["peak_rss_mb"], "change": None}
+        if (base is None) or (current is None):
+            entry["status"] = "new" if (base is None) else "missing"
+            comparison.append(entry)
+            continue
+        tolerance = tolerances.get(key, tolerances.get(key.split("@")[0], time_tolerance))
+        entry["change"] = current["median_s"]/base["median_s"]-1.0 if (base["median_s"] > 0) else None
+        slower = current["median_s"] > base["median_s"]*(1.0+tolerance) + iqr_factor*base["iqr_s"]
+        faster = current["median_s"] < base["median_s"]*(1.0-tolerance) - iqr_factor*base["iqr_s"]
+        memory = (base["peak_rss_mb"] is not None) and (current["peak_rss_mb"] is not None) and \
+                 (current["peak_rss_mb"] > base["peak_rss_mb"]*(1.0+memory_tolerance) + memory_slack)
+        if (slower) and (memory):
+            entry["status"] = "slower+memory"
+        elif (slower):
+            entry["status"] = "slower"
+        elif (memory):
+            entry["status"] = "memory"
+        else:
+            entry["status"] = "faster" if (faster) else "ok"
+        comparison.append(entry)
+    return comparison
+
+def isRegression(i_comparison, fail_missing=True):
+    '''
+    Returns True if any benchmark of a comparison regressed in time or memory or, unless
+    fail_missing is False, if a benchmark of the baseline was not run (e.g. it was dropped or
+    renamed).
+    '''
+    failures = ("slower", "memory", "slower+memory", "missing") if (fail_missing) else ("slower", "memory", "slower+memory")
+    return any(entry["status"] in failures for entry in i_comparison)
+
+def printComparison(i_comparison):
+    '''
+    Prints a comparison as a table.
+    '''
+    def number(i_value, i_format):
+        return "-" if (i_value is None) else i_format.format(i_value)
+    print("{:<28} {:>10} {:>10} {:>8} {:>9} {:>9}  {}".format("benchmark", "base s", "now s", "change", "base MB", "now MB", "status"))
+    for entry in i_comparison:
+        print("{:<28} {:>10} {:>10} {:>8} {:>9} {:>9}  {}".format(entry["benchmark"], number(entry["base_median_s"], "{:.4f}"),
+              number(entry["median_s"], "{:.4f}"), number(entry["change"], "{:+.1%}"), number(entry["base_peak_rss_mb"], "{:.0f}"),
+              number(entry["peak_rss_mb"], "{:.0f}"), entry["status"].upper() if (entry["status"] not in ("ok", "faster", "new")) else entry["status"]))
+
+def _parseTolerances(i_items):
+    tolerances = {}
+    for item in (i_items or []):
+        name, _, value = item.partition("=")
+        if (value == ""):
+            raise Exception("Error: Tolerances must be given as NAME=FRACTION, e.g. eigen=0.5")
+        tolerances[name] = float(value)
+    return tolerances
+
+def getArgumentParser():
+    parser = argparse.ArgumentParser(description="Record or check a performance baseline of the sigqc benchmarks.")
+    parser.add_argument("command", choices=["record", "compare"])
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json"))
+    parser.add_argument("--benchmarks", default=None, help="Comma separated benchmark names (default: all)")
+    parser.add_argument("--scales", default=None, help="Comma separated scales (compare defaults to the scales of the baseline)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--data-dir", default=None)
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument("--memory-slack", type=float, default=MEMORY_SLACK_MB, help="Allowed peak RSS increase in MB")
+    parser.add_argument("--iqr-factor", type=float, default=IQR_FACTOR)
+    parser.add_argument("--tolerance", action="append", help="Time tolerance of one benchmark as NAME=FRACTION (repeatable)")
+    parser.add_argument("--strict-env", action="store_true", help="Fail if the baseline was recorded in another environment")
+    parser.add_argument("--json", default=None, help="Write the comparison to a JSON file")
+    return parser
+
+def main(i_args=None):
+    args = getArgumentParser().parse_args(i_args)
+    names = None if (args.benchmarks is None) else args.benchmarks.split(",")
+    environment = getEnvironment()
+
+    if (args.command == "record"):
+        scales = bench_sigqc.DEFAULT_SCALES if (args.scales is None) else args.scales
+        statistics = runStatistics(names, scales, args.data_dir, args.repeat)
+        writeBaseline(args.baseline, statistics, environment)
+        print("Baseline of {} benchmarks written to {}".format(len(statistics), args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("Error: Baseline {} not found. Run 'record' first.".format(args.baseline), file=sys.stderr)
+        return 2
+    baseline = readBaseline(args.baseline)
+    results = baseline["results"]
+    if (names is not None):
+        results = {key: value for key, value in results.items() if key.split("@")[0] in names}
+    scales = args.scales
+    if (scales is None):
+        scales = ",".join(scale for scale in bench_sigqc.SCALES if any(key.split("@")[1] == scale for key in results))
+    else:
+        results = {key: value for key, value in results.items() if key.split("@")[1] in scales.split(",")}
+    if (names is None):
+        # Benchmarks of the baseline that no longer exist are reported as missing
+        names = [name for name in bench_sigqc.BENCHMARKS if any(key.split("@")[0] == name for key in results)]
+
+    mismatch = (baseline["environment"].get("fingerprint") != environment["fingerprint"])
+    if (mismatch):
+        print("Warning: The baseline was recorded in a different environment ({} on {}, now {} on {})".format(
+              baseline["environment"].get("fingerprint"), baseline["environment"].get("host"),
+              environment["fingerprint"], environment["host"]), file=sys.stderr)
+        if (args.strict_env):
+            return 2
+
+    current = runStatistics(names, scales, args.data_dir, args.repeat)
+    comparison = compareStatistics(results, current, args.time_tolerance, args.memory_tolerance, args.memory_slack,
+                                   args.iqr_factor, _parseTolerances(args.tolerance))
+    printComparison(comparison)
+    if (args.json is not None):
+        with open(args.json, 'w') as f:
+            json.dump({"environment": environment, "baseline_environment": baseline["environment"],
+                       "comparison": comparison, "results": current}, f, indent=1)
+    return 1 if isRegression(comparison) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,5 +16,5 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     package_data={'sigqc': ['templates/SigQCReportTemplate.docx']},
-    install_requires=['python-docx']
+    install_requires=['python-docx', 'scipy']
     )
@@ -1 +1 @@
-__all__ = ["sigqc_primitives", "sigqc_unitdata", "sigqc_asciitestcase", "sigqc_report", "sigqc_pca", "sigqc_hmethod", "sigqc_implementpca"]
+__all__ = ["sigqc_primitives", "sigqc_unitdata", "sigqc_asciitestcase", "sigqc_report", "sigqc_pca", "sigqc_hmethod", "sigqc_implementpca", "sigqc_spc", "sigqc_referencemodel", "sigqc_cache", "sigqc_service", "sigqc_watcher", "sigqc_delta", "sigqc_blockpca", "sigqc_render", "sigqc_synthetic", "sigqc_instrument", "sigqc_memory"]
@@ -1,6 +1,9 @@
 import numpy as np
 import csv
+import os
 from sigqc import sigqc_primitives
+from sigqc import sigqc_instrument
+from sigqc import sigqc_memory
 
 ##############################################################################
 # sigqc_asciitestcase.py
@@ -191,11 +194,15 @@ class SigQCAsciiMatrix:
         if (i_reader != None):
             self.read()
     
-    def read(self, i_header, i_reader):
+    def read(self, i_header, i_reader, i_rowfilter=None):
         '''
         Read the content of a data section within a SigQC ASCII text export file using the
         CSV file reader given.  This method assumes the reader has reached a BEGINDATA line
         and the next line to be read is the metadata (column names) for the data section.
+        
+        Input:
+            i_rowfilter - (Optional) Function called as i_rowfilter(serialnumber, timestamp)
+                          for each unit.  Units for which it returns False are skipped.
         '''
         self._line = i_reader.line_num
         self._header = i_header
@@ -210,6 +217,9 @@ class SigQCAsciiMatrix:
         yvals = []
         row = next(i_reader)
         while("ENDDATA" not in row):
+            if (i_rowfilter is not None) and not i_rowfilter(row[0], row[1]):
+                row = next(i_reader)
+                continue
             self._serialnumbers.append(row[0])
             self._timestamps.append(row[1])
             yvals.append(row[2::])
@@ -274,6 +284,12 @@ class SigQCAsciiMatrix:
         '''
         return self._serialnumbers
     
+    def getTimestamps(self):
+        '''
+        Get the timestamps of the test case as strings, in the same order as the serial numbers.
+        '''
+        return self._timestamps
+    
 ##################################
 # SigQCAsciiLimits Class
 ##################################
@@ -362,7 +378,7 @@ class SigQCAsciiTestCaseFile:
         x.SetFilename("D:\MyData\MyAsciiTestCaseFile.csv" )
         x.Read()
     '''      
-    def __init__(self,i_filename=None,i_delimiter=","):
+    def __init__(self,i_filename=None,i_delimiter=",",i_rowfilter=None):
         '''
         Constructor for a SigQCAsciiTestCaseFile class to open and read the content of
         a specified test case data file.  If a filename is specified, then the file is
@@ -376,6 +392,10 @@ class SigQCAsciiTestCaseFile:
             i_delimiter- String that contains the delimiter character.  By default,
                          the delimiter is a comma.
                          
+            i_rowfilter- Optionally specify a function called as i_rowfilter(serialnumber,
+                         timestamp) for each unit of each data section.  Only units for
+                         which it returns True are kept (see setRowFilter()).
+                         
         Example:
             x = SigQCAsciiTestCaseFile("D:\MyData\MyAsciiTestCaseFile.csv", "\t")
             
@@ -390,6 +410,7 @@ class SigQCAsciiTestCaseFile:
         self._casedata = []
         self._headerlist = []
         self._limits = []
+        self._rowfilter = i_rowfilter
         self._dataread = False
         if (self._filename is not None):
             self.read()
@@ -418,6 +439,22 @@ class SigQCAsciiTestCaseFile:
         '''
         self._delimiter = i_delimiter
         
+    def setRowFilter(self,i_rowfilter):
+        '''
+        Set a function that selects the units to be read.  It is called as
+        i_rowfilter(serialnumber, timestamp) with the strings of each data row, and rows
+        for which it returns False are skipped while parsing.  None reads all units.  The
+        filter should give the same answer for a unit in every data section, even though
+        its timestamps differ between sections (see sigqc_delta.SigQCDeltaFilter).
+        
+        Example:
+            x = SigQCAsciiTestCaseFile()       
+            x.setFilename("D:\MyData\MyAsciiTestCaseFile.csv" )
+            x.setRowFilter(lambda serial, timestamp: serial.startswith("X15"))
+            x.read()
+        '''
+        self._rowfilter = i_rowfilter
+        
     def read(self):
         '''
         Read the content of the targeted SigQC ASCII test case data file.
@@ -437,23 +474,29 @@ class SigQCAsciiTestCaseFile:
         data = None
 
         # Read the test case file...
-        file = open(self._filename, 'r')
-        reader = csv.reader(file)
-        for row in reader:
-            if ( "BEGINHEADER" in row):
-                header = SigQCAsciiHeader()
-                header.read(reader)
-                self._headerlist.append(header)
-            elif ("BEGINDATA" in row):
-                data = SigQCAsciiMatrix()
-                data.read(header, reader)
-                self._casedata.append(data)
-            elif ("BEGINLIMITS" in row):
-                limits = SigQCAsciiLimits(reader)
-                if (limits is not None):
-                    self._limits.append(limits)
-                    
-        file.close()
+        with sigqc_instrument.span("ascii.read", file=os.path.basename(self._filename)) as span, open(self._filename, 'r') as file:
+            reader = csv.reader(file)
+            for row in reader:
+                if ( "BEGINHEADER" in row):
+                    header = SigQCAsciiHeader()
+                    header.read(reader)
+                    self._headerlist.append(header)
+                elif ("BEGINDATA" in row):
+                    data = SigQCAsciiMatrix()
+                    with sigqc_instrument.span("ascii.section", case=None if (header is None) else header.getCaseName()):
+                        data.read(header, reader, self._rowfilter)
+                    self._casedata.append(data)
+                elif ("BEGINLIMITS" in row):
+                    limits = SigQCAsciiLimits(reader)
+                    if (limits is not None):
+                        self._limits.append(limits)
+            if (sigqc_instrument.isEnabled()):
+                rows = sum(len(data.getSerialNumbers()) for data in self._casedata)
+                size = os.path.getsize(self._filename)
+                span.set(rows=rows, bytes=size, cases=len(self._casedata))
+                sigqc_instrument.count("rows", rows)
+                sigqc_instrument.count("bytes", size)
+                sigqc_instrument.count("cases", len(self._casedata))
         
     def getHeaders(self):
         '''
@@ -570,6 +613,35 @@ class SigQCAsciiTestCaseFile:
                 maxcount = count
         return mincount, maxcount
 
+    def getMemoryUsage(self):
+        '''
+        Get the memory held by the parsed file, broken down into numeric arrays, strings (the
+        test case values are held as text until converted by getMatrixDataAt()) and other
+        metadata.  See sigqc_memory.getMemoryUsage() for the keys of the dictionary returned.
+
+        Example:
+        x = SigQCAsciiTestCaseFile("D:\MyData\MyAsciiTestCaseFile.csv")
+        print(x.getMemoryUsage()["total_bytes"])
+        '''
+        return sigqc_memory.getMemoryUsage(self)
+
+    def getFeatureKeys(self):
+        '''
+        Get the feature keys of all test case features in the order in which getAllTestCases()
+        stacks them.  Each key is the "product.test.case@domain" string returned by
+        SigQCTestCaseID.GetFeatureKey() for one domain value of a test case.
+        
+        Return:
+            A list of strings with one key per column of the stacked data matrix.
+        '''
+        keys = []
+        for i in range(0,len(self._casedata)):
+            matrix = self._casedata[i]
+            testcase = matrix.getHeader()._testcase
+            for domain in matrix.getXValues():
+                keys.append(testcase.GetFeatureKey(domain))
+        return keys
+
     def getAllTestCases(self):
         '''
         Get a tuple containing the matrix of all test case features of each unit and associated metadata.
@@ -612,7 +684,7 @@ class SigQCAsciiTestCaseFile:
             else:
                 alldomainnames.append(str(header.getCaseName())+" "+str(matrix.getXValues()[0]))
             allcasedata = np.hstack((allcasedata, data))
-            if not (alllimits == None):
+            if (alllimits is not None):
                 limits = np.zeros((2,len(data[0,:])))
                 limits[0,:] = self.getLimitsAt(i).getLowerLimits()[0]
                 limits[1,:] = self.getLimitsAt(i).getUpperLimits()[0]
@@ -0,0 +1,339 @@
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from sigqc import sigqc_primitives
+from sigqc import sigqc_pca
+from sigqc import sigqc_spc
+from sigqc import sigqc_referencemodel
+from sigqc import sigqc_memory
+
+#########################################################################################################################
+# sigqc_blockpca.py
+#
+# Block PCA of SigQC data. Instead of stacking every test case into one wide feature matrix and
+# decomposing its full covariance matrix, an independent reference model is fitted to each
+# block of features, either each test case or each SigQCTestCaseGroup. The cost of fitting and
+# scoring falls from the square of the total width to the sum of the squares of the block
+# widths, and blocks are fitted in parallel worker processes. Units are scored against every
+# block, and the per-block Hotelling T-squared and SPE (Q) statistics are combined into a
+# unit-level summary of the worst block relative to its control limits.
+#
+# Example Usage:
+#  serials, headers, dataset, keys = sigqc_referencemodel.readDataset(reffile, "ascii", return_keys=True)
+#  blockmodel = SigQCBlockModel()
+#  blockmodel.build(dataset, keys, i_blocks="testcase", variance=0.9)
+#  blockmodel.write("[full path here]\\BlockReference.sqcref")
+#
+#  serials, headers, testdata, testkeys = sigqc_referencemodel.readDataset(testfile, "ascii", return_keys=True)
+#  summary = SigQCBlockModel("[full path here]\\BlockReference.sqcref").score(testdata, testkeys)
+#  print(summary["worstblock"], summary["pass"])
+#
+#########################################################################################################################
+
+def getTestCaseID(i_featurekey):
+    '''
+    Returns the "product.test.case" part of a feature key (see
+    sigqc_primitives.SigQCTestCaseID.GetFeatureKey()), i.e. the key without its domain value.
+    '''
+    return i_featurekey.rpartition("@")[0] if ("@" in i_featurekey) else i_featurekey
+
+def getTestCaseBlocks(i_featurekeys):
+    '''
+    Groups the features of a dataset into one block per test case.
+
+    Inputs
+    ------
+        i_featurekeys - List of the feature keys of the dataset columns.
+
+    Outputs
+    -------
+        Returns an ordered dictionary mapping each "product.test.case" name to a list of the
+        column indices of its features, in order of first appearance.
+    '''
+    blocks = OrderedDict()
+    for j, key in enumerate(i_featurekeys):
+        blocks.setdefault(getTestCaseID(key), []).append(j)
+    return blocks
+
+def getGroupBlocks(i_featurekeys, i_groups):
+    '''
+    Groups the features of a dataset into one block per test case group. A feature belongs to
+    the first group containing an identifier that matches its test case (see
+    sigqc_primitives.SigQCTestCaseID.IsMatch()), so inexact identifiers may select several
+    test cases. Features matched by no group are gathered in a block named "Other".
+
+    Inputs
+    ------
+        i_featurekeys - List of the feature keys of the dataset columns.
+        i_groups - Dictionary mapping block names to SigQCTestCaseGroup instances, or a list of
+            SigQCTestCaseGroup instances, which are named "Group1", "Group2", ...
+
+    Outputs
+    -------
+        Returns an ordered dictionary mapping block names to lists of column indices.
+    '''
+    if not isinstance(i_groups, dict):
+        i_groups = OrderedDict(("Group{}".format(i+1), group) for i, group in enumerate(i_groups))
+    blocks = OrderedDict((name, []) for name in i_groups)
+    blocks["Other"] = []
+    matches = {}
+    for j, key in enumerate(i_featurekeys):
+        caseid = getTestCaseID(key)
+        if (caseid not in matches):
+            testcase = sigqc_primitives.SigQCTestCaseID()
+            testcase.Parse(caseid)
+            matches[caseid] = "Other"
+            for name, group in i_groups.items():
+                if any(testcase.IsMatch(group[i]) for i in range(group.Count())):
+                    matches[caseid] = name
+                    break
+        blocks[matches[caseid]].append(j)
+    return OrderedDict((name, columns) for name, columns in blocks.items() if (len(columns) > 0))
+
+def _fitBlock(i_dataset, i_featurekeys, corr_matrix):
+    '''
+    Fits the reference model of one block in a worker process.
+    '''
+    model = sigqc_referencemodel.SigQCReferenceModel()
+    model.build(i_dataset, corr_matrix=corr_matrix, i_featurekeys=i_featurekeys)
+    return model
+
+###################################
+# SigQCBlockModel class
+###################################
+class SigQCBlockModel:
+    '''
+    The SigQCBlockModel class holds one SigQCReferenceModel per block of features together with
+    the number of principal components retained by each block for T-squared/SPE screening.
+    '''
+    def __init__(self, i_filename=None, mmap=False):
+        '''
+        Constructor for an instance of the SigQCBlockModel class.
+
+        Input:
+            i_filename - (Optional) Path to a block model file written by write().
+            mmap - (Optional) Boolean specifying whether the arrays of the file are memory-mapped.
+        '''
+        self._names = []
+        self._columns = []
+        self._models = []
+        self._spcpcs = []
+        if (i_filename is not None):
+            self.read(i_filename, mmap)
+
+    def __len__(self):
+        return len(self._models)
+
+    def getMemoryUsage(self):
+        '''
+        Returns the memory held by the reference models of all blocks (see
+        sigqc_memory.getMemoryUsage()).
+        '''
+        return sigqc_memory.getMemoryUsage(self)
+
+    def __str__(self):
+        widths = [model.getFeatureCount() for model in self._models]
+        return "Blocks={}: Features={}: Largest Block={}".format(len(self._models), sum(widths), max(widths) if widths else 0)
+
+    def build(self, i_dataset, i_featurekeys=None, i_blocks="testcase", corr_matrix=False, variance=0.9, workers=None):
+        '''
+        Fits an independent reference model to each block of features.
+
+        Input:
+            i_dataset - 2D array-like with units in rows and test case features in columns.
+            i_featurekeys - (Optional) List of the feature keys of the dataset columns. Needed
+                            to form blocks by test case or group, and stored so that test data
+                            is aligned by key.
+            i_blocks - (Optional) "testcase" (default) for one block per test case, a dictionary
+                       or list of SigQCTestCaseGroup instances (see getGroupBlocks()), or a
+                       dictionary mapping block names to lists of column indices.
+            corr_matrix - (Optional) Boolean specifying whether each block is decomposed from
+                          its correlation matrix instead of its covariance matrix.
+            variance - (Optional) Proportion of each block's variance that its retained PCs
+                       explain. Defaults to 0.9.
+            workers - (Optional) Number of worker processes fitting blocks. Defaults to the
+                      number of CPUs. If 1, blocks are fitted in the calling process.
+        '''
+        dataset = np.asarray(i_dataset, dtype=float)
+        if isinstance(i_blocks, str):
+            if (i_blocks.lower() != "testcase") or (i_featurekeys is None):
+                raise Exception("Error: Blocks by test case need the feature keys of the dataset")
+            blocks = getTestCaseBlocks(i_featurekeys)
+        elif isinstance(i_blocks, dict) and all(isinstance(columns, (list, tuple, np.ndarray)) for columns in i_blocks.values()):
+            blocks = OrderedDict((name, list(columns)) for name, columns in i_blocks.items())
+        else:
+            if (i_featurekeys is None):
+                raise Exception("Error: Blocks by test case group need the feature keys of the dataset")
+            blocks = getGroupBlocks(i_featurekeys, i_blocks)
+
+        names = list(blocks)
+        columns = [np.asarray(blocks[name], dtype=np.intp) for name in names]
+        keys = [None if (i_featurekeys is None) else [i_featurekeys[j] for j in cols] for cols in columns]
+        if (workers == 1):
+            models = [_fitBlock(dataset[:,cols], blockkeys, corr_matrix) for cols, blockkeys in zip(columns, keys)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Submit the widest blocks first so the pool finishes evenly
+                order = sorted(range(len(names)), key=lambda i: -len(columns[i]))
+                futures = {i: executor.submit(_fitBlock, dataset[:,columns[i]], keys[i], corr_matrix) for i in order}
+                models = [futures[i].result() for i in range(len(names))]
+
+        self._names = names
+        self._columns = columns
+        self._models = models
+        self._spcpcs = [self._getSPCCount(model, variance) for model in models]
+
+    def _getSPCCount(self, i_model, i_variance):
+        '''
+        Returns the number of PCs explaining i_variance of a block, limited to PCs with a
+        positive eigenvalue and to fewer PCs than reference units.
+        '''
+        evals = np.asarray(i_model.getEigenvalues())
+        count = sigqc_pca.SigQCVarianceProfile(evals).getPCCountFor(i_variance)
+        count = min(count, int(np.count_nonzero(evals > 0)))
+        if (i_model.getUnitCount() is not None):
+            count = min(count, i_model.getUnitCount()-1)
+        return max(count, 1)
+
+    def getBlockNames(self):
+        '''
+        Returns the list of block names.
+        '''
+        return list(self._names)
+
+    def getBlockModel(self, i_name):
+        '''
+        Returns the SigQCReferenceModel of a block.
+        '''
+        return self._models[self._names.index(i_name)]
+
+    def getBlockColumns(self, i_name):
+        '''
+        Returns the column indices of the reference dataset that form a block.
+        '''
+        return self._columns[self._names.index(i_name)]
+
+    def getSPCCounts(self):
+        '''
+        Returns the list of the number of PCs retained by each block for screening.
+        '''
+        return list(self._spcpcs)
+
+    def setSPCCounts(self, i_counts):
+        '''
+        Sets the number of PCs retained by each block for screening.
+        '''
+        if (len(i_counts) != len(self._models)):
+            raise Exception("Error: Please provide one PC count per block")
+        self._spcpcs = [int(count) for count in i_counts]
+
+    def _getBlockData(self, i_dataset, i_featurekeys, i_index):
+        model = self._models[i_index]
+        if (i_featurekeys is not None) and (model.getFeatureKeys() is not None):
+            return model.alignDataset(i_dataset, i_featurekeys, extra="ignore")
+        return np.asarray(i_dataset)[:,self._columns[i_index]]
+
+    def _scoreBlock(self, i_dataset, i_featurekeys, i_index):
+        blockdata = self._getBlockData(i_dataset, i_featurekeys, i_index)
+        return self._models[i_index].getT2AndSPE(blockdata, self._spcpcs[i_index])
+
+    def score(self, i_dataset, i_featurekeys=None, alpha=0.05, bonferroni=True, workers=None):
+        '''
+        Screens units against every block and combines the results per unit.
+
+        Input:
+            i_dataset - 2D array-like with units in rows and test case features in columns.
+            i_featurekeys - (Optional) List of the feature keys of the dataset columns. If given,
+                            the features of each block are gathered by key; otherwise the
+                            columns are assumed to be in reference order.
+            alpha - (Optional) Significance level of the unit-level screening. Defaults to 0.05.
+            bonferroni - (Optional) Boolean specifying whether alpha is divided among the
+                         T-squared and SPE tests of all blocks so that the false alarm rate of
+                         a unit, rather than of each test, is about alpha. Defaults to True.
+            workers - (Optional) Number of threads scoring blocks. Defaults to the number of
+                      CPUs. The projections release the interpreter lock, so threads suffice.
+
+        Return:
+            A dictionary with the entries:
+                blocks - The list of block names.
+                t2, spe - 2D numpy arrays of the T-squared and SPE statistics with units in rows
+                          and blocks in columns.
+                t2limits, spelimits - 1D numpy arrays of the control limits of the blocks.
+                t2ratio, speratio - The largest ratio of each unit's statistic to its limit.
+                worstblock - The name of the block with the largest ratio for each unit.
+                pass - Boolean array, True for units within the limits of every block.
+        '''
+        if (len(self._models) == 0):
+            raise Exception("Error: The block model has no blocks")
+        # Each block screens a unit with two tests, T-squared and SPE
+        blockalpha = alpha/(2*len(self._models)) if (bonferroni) else alpha
+        n_blocks = len(self._models)
+        if (workers == 1):
+            results = [self._scoreBlock(i_dataset, i_featurekeys, i) for i in range(n_blocks)]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda i: self._scoreBlock(i_dataset, i_featurekeys, i), range(n_blocks)))
+        t2 = np.column_stack([result[0] for result in results])
+        spe = np.column_stack([result[1] for result in results])
+
+        t2limits = np.empty(n_blocks)
+        spelimits = np.empty(n_blocks)
+        for i, model in enumerate(self._models):
+            n_units = model.getUnitCount()
+            method = "f" if (n_units is not None) else "chi2"
+            t2limits[i] = sigqc_spc.getT2Limit(n_units, self._spcpcs[i], alpha=blockalpha, method=method)
+            # Cutting blocks at a proportion of variance often leaves one dominant residual
+            # eigenvalue, so use Box's approximation rather than Jackson-Mudholkar
+            spelimits[i] = sigqc_spc.getSPELimit(model.getEigenvalues(), self._spcpcs[i], alpha=blockalpha, method="chi2")
+
+        t2ratios = t2/t2limits
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speratios = np.where(spelimits > 0, spe/np.where(spelimits > 0, spelimits, 1), 0.0)
+        ratios = np.maximum(t2ratios, speratios)
+        worst = np.argmax(ratios, axis=1)
+        return {"blocks": list(self._names), "t2": t2, "spe": spe, "t2limits": t2limits, "spelimits": spelimits,
+                "t2ratio": np.max(t2ratios, axis=1), "speratio": np.max(speratios, axis=1),
+                "worstblock": [self._names[i] for i in worst], "pass": np.all(ratios <= 1, axis=1)}
+
+    def write(self, o_filename, dtype=None):
+        '''
+        Writes all blocks to a single file in the binary format of sigqc_referencemodel.
+
+        Input:
+            o_filename - Path of the file to be written.
+            dtype - (Optional) Floating point type used to store the arrays, e.g. np.float32.
+        '''
+        arrays = []
+        blocks = []
+        for i, model in enumerate(self._models):
+            blockdtype = model.getEigenvectors().dtype if (dtype is None) else dtype
+            arrays += [("{}/avgvector".format(i), np.asarray(model.getAverageVector(), dtype=blockdtype)),
+                       ("{}/stddev".format(i), np.asarray(model.getStandardDeviations(), dtype=blockdtype)),
+                       ("{}/evals".format(i), np.asarray(model.getEigenvalues(), dtype=np.float64)),
+                       ("{}/evecs".format(i), np.asarray(model.getEigenvectors(), dtype=blockdtype)),
+                       ("{}/columns".format(i), np.asarray(self._columns[i], dtype=np.int64))]
+            blocks.append({"name": self._names[i], "spcpcs": self._spcpcs[i], "corrmatrix": bool(model.isCorrMatrix()),
+                           "nunits": None if (model.getUnitCount() is None) else int(model.getUnitCount()),
+                           "totalvariance": model.getTotalVariance(), "featurekeys": model.getFeatureKeys()})
+        sigqc_referencemodel.writeBinaryFile(o_filename, {"kind": "blockmodel", "blocks": blocks}, arrays)
+
+    def read(self, i_filename, mmap=False):
+        '''
+        Reads a block model file written by write().
+        '''
+        header, arrays = sigqc_referencemodel.readBinaryFile(i_filename, mmap)
+        if (header.get("kind") != "blockmodel"):
+            raise Exception("Error: {} does not contain a block model".format(i_filename))
+        self._names = []
+        self._columns = []
+        self._models = []
+        self._spcpcs = []
+        for i, block in enumerate(header["blocks"]):
+            model = sigqc_referencemodel.SigQCReferenceModel()
+            model.setReference(arrays["{}/avgvector".format(i)], arrays["{}/stddev".format(i)], arrays["{}/evals".format(i)],
+                               arrays["{}/evecs".format(i)], block["nunits"], block["corrmatrix"], block["totalvariance"],
+                               block["featurekeys"])
+            self._names.append(block["name"])
+            self._columns.append(np.asarray(arrays["{}/columns".format(i)], dtype=np.intp))
+            self._models.append(model)
+            self._spcpcs.append(block["spcpcs"])
@@ -0,0 +1,202 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from sigqc import sigqc_asciitestcase
+from sigqc import sigqc_unitdata
+from sigqc import sigqc_referencemodel
+from sigqc import sigqc_memory
+
+#########################################################################################################################
+# sigqc_cache.py
+#
+# In-process least recently used (LRU) cache of parsed SigQC files. Reference models
+# (SigQCReferenceModel), SigQC ASCII test case files (SigQCAsciiTestCaseFile) and unit data
+# files (SigQCUnitDataFile) are keyed by their absolute path plus a fingerprint of the file
+# content, so a file is only parsed again once it changes on disk. The cache holds objects up
+# to a memory budget and evicts the least recently used ones beyond it.
+#
+# Example Usage:
+#  model = getReferenceModel("[full path here]\\ReferenceData.csv")
+#  testfile = getAsciiTestCaseFile("[test file path]")
+#  print(getCache().getStats())
+#
+#  ### Use a larger budget and content hashes instead of size and modification time ###
+#  getCache().setBudget(4*1024**3)
+#  getCache().setUseHash(True)
+#
+#########################################################################################################################
+
+# Default memory budget of the module cache in bytes
+DEFAULT_BUDGET = 512*1024**2
+
+def estimateSize(i_object, i_seen=None):
+    '''
+    Estimates the memory held by an object in bytes (the "total_bytes" of
+    sigqc_memory.getMemoryUsage()). Memory-mapped arrays are backed by their file and are not
+    counted.
+    '''
+    return sigqc_memory.getMemoryUsage(i_object, i_seen)["total_bytes"]
+
+###################################
+# SigQCCache class
+###################################
+class SigQCCache:
+    '''
+    The SigQCCache class is a thread-safe LRU cache of parsed objects keyed by file fingerprint,
+    bounded by an approximate memory budget in bytes.
+    '''
+    def __init__(self, i_budget=DEFAULT_BUDGET, use_hash=False):
+        '''
+        Constructor for an instance of the SigQCCache class.
+
+        Input:
+            i_budget - (Optional) Memory budget of the cache in bytes. Defaults to DEFAULT_BUDGET.
+            use_hash - (Optional) Boolean specifying whether files are fingerprinted by a hash of
+                       their content instead of their size and modification time. Hashing reads
+                       the whole file on every lookup, but detects changes that keep both.
+        '''
+        self._budget = i_budget
+        self._usehash = use_hash
+        self._entries = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        stats = self.getStats()
+        return "Entries={}: Bytes={}/{}: Hits={}: Misses={}: Evictions={}".format(stats["entries"], stats["bytes"], stats["budget"], stats["hits"], stats["misses"], stats["evictions"])
+
+    def setBudget(self, i_budget):
+        '''
+        Sets the memory budget of the cache in bytes, evicting entries if it is exceeded.
+        '''
+        with self._lock:
+            self._budget = i_budget
+            self._evict()
+
+    def getBudget(self):
+        '''
+        Returns the memory budget of the cache in bytes.
+        '''
+        return self._budget
+
+    def setUseHash(self, i_usehash):
+        '''
+        Sets whether files are fingerprinted by a hash of their content.
+        '''
+        self._usehash = i_usehash
+
+    def getFingerprint(self, i_filename):
+        '''
+        Returns a hashable fingerprint of a file: its absolute path with either its size and
+        modification time or a SHA-1 hash of its content.
+        '''
+        path = os.path.abspath(i_filename)
+        if (self._usehash):
+            digest = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024*1024), b''):
+                    digest.update(block)
+            return (path, digest.hexdigest())
+        status = os.stat(path)
+        return (path, status.st_size, status.st_mtime_ns)
+
+    def get(self, i_filename, i_loader, i_kind="", i_options=()):
+        '''
+        Returns the cached object for a file, calling i_loader(i_filename) to parse it on a miss.
+
+        Input:
+            i_filename - Path to the file.
+            i_loader - Callable that takes the path and returns the parsed object.
+            i_kind - (Optional) String distinguishing objects parsed from the same file in
+                     different ways, e.g. "model" or "ascii".
+            i_options - (Optional) Hashable loader options that are part of the key.
+
+        Return:
+            The parsed object. Objects are shared between callers and must not be modified.
+        '''
+        key = (i_kind, self.getFingerprint(i_filename), i_options)
+        with self._lock:
+            if (key in self._entries):
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key][0]
+            self._misses += 1
+
+        value = i_loader(i_filename)
+        self.put(key, value)
+        return value
+
+    def put(self, i_key, i_value):
+        '''
+        Stores an object under a key, evicting least recently used entries to stay within the
+        budget. Objects larger than the whole budget are not stored.
+        '''
+        size = estimateSize(i_value)
+        with self._lock:
+            if (i_key in self._entries):
+                self._size -= self._entries.pop(i_key)[1]
+            if (size > self._budget):
+                return
+            self._entries[i_key] = (i_value, size)
+            self._size += size
+            self._evict()
+
+    def _evict(self):
+        while (self._size > self._budget) and (len(self._entries) > 0):
+            key, (value, size) = self._entries.popitem(last=False)
+            self._size -= size
+            self._evictions += 1
+
+    def clear(self):
+        '''
+        Removes all entries from the cache. The counters are kept.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def getStats(self):
+        '''
+        Returns a dictionary with the number of entries, bytes held, budget, hits, misses and
+        evictions of the cache.
+        '''
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "budget": self._budget,
+                    "hits": self._hits, "misses": self._misses, "evictions": self._evictions}
+
+# Cache shared by the module level functions below
+_cache = SigQCCache()
+
+def getCache():
+    '''
+    Returns the module level SigQCCache instance.
+    '''
+    return _cache
+
+def getReferenceModel(i_filename, mmap=False):
+    '''
+    Returns the SigQCReferenceModel of a reference data file from the module cache.
+    '''
+    loader = lambda filename: sigqc_referencemodel.SigQCReferenceModel(filename, mmap=mmap)
+    return _cache.get(i_filename, loader, "model", (mmap,))
+
+def getAsciiTestCaseFile(i_filename, i_delimiter=","):
+    '''
+    Returns the SigQCAsciiTestCaseFile of a SigQC ASCII test case file from the module cache.
+    '''
+    loader = lambda filename: sigqc_asciitestcase.SigQCAsciiTestCaseFile(filename, i_delimiter)
+    return _cache.get(i_filename, loader, "ascii", (i_delimiter,))
+
+def getUnitDataFile(i_filename, i_delimiter=","):
+    '''
+    Returns the SigQCUnitDataFile of a SigQC unit data file from the module cache.
+    '''
+    loader = lambda filename: sigqc_unitdata.SigQCUnitDataFile(filename, i_delimiter)
+    return _cache.get(i_filename, loader, "unit", (i_delimiter,))
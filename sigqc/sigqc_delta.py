@@ -0,0 +1,241 @@
+import numpy as np
+import os
+import csv
+import json
+import hashlib
+from datetime import datetime
+
+#########################################################################################################################
+# sigqc_delta.py
+#
+# Delta re-analysis of cumulative SigQC exports. Stations export every unit tested so far, so
+# each day's file repeats all earlier units. A high-water mark is kept per product and
+# reference model: the latest unit timestamp already scored plus the serial numbers tested at
+# exactly that time. The mark is turned into a row filter that the file parsers apply while
+# reading, so only units tested after the mark are converted, scored and appended to the
+# existing results (see sigqc_implementpca.implementPCA(delta_state=...)).
+#
+# Example Usage:
+#  marks = SigQCHighWaterMarks("[results path]\\HighWaterMarks.json")
+#  product = getProductName(testfile, "ascii")
+#  rowfilter = marks.getFilter(product, getModelID(model))
+#  serials, headers, dataset = sigqc_referencemodel.readDataset(testfile, "ascii", row_filter=rowfilter)
+#  ...score and append the new units...
+#  marks.setMark(product, getModelID(model), rowfilter)
+#  marks.write()
+#
+#########################################################################################################################
+
+# Timestamp formats tried in order when parsing SigQC export timestamps
+TIMESTAMP_FORMATS = ["%m/%d/%Y %I:%M:%S %p", "%m/%d/%Y %I:%M %p", "%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M",
+                     "%m/%d/%y %I:%M:%S %p", "%m/%d/%y %I:%M %p", "%m/%d/%y %H:%M:%S", "%m/%d/%y %H:%M",
+                     "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f",
+                     "%Y/%m/%d %H:%M:%S", "%d.%m.%Y %H:%M:%S"]
+
+def parseTimestamp(i_text, i_formats=None):
+    '''
+    Parses a SigQC export timestamp.
+
+    Inputs
+    ------
+        i_text - String of the timestamp, e.g. "3/14/2019 1:05:22 PM".
+        i_formats - (Optional) List of datetime.strptime formats tried in order. Defaults to
+            TIMESTAMP_FORMATS.
+
+    Outputs
+    -------
+        Returns a datetime object, or None if no format matches.
+    '''
+    text = " ".join(i_text.split())
+    for fmt in (TIMESTAMP_FORMATS if (i_formats is None) else i_formats):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+def getModelID(i_model):
+    '''
+    Returns a short identifier of a reference model derived from its average vector and
+    eigenvalues, so the same model gets the same identifier whichever file it was read from.
+    '''
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(i_model.getAverageVector(), dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(i_model.getEigenvalues(), dtype=np.float64).tobytes())
+    return digest.hexdigest()[:16]
+
+def getProductName(i_filename, input_type="ascii"):
+    '''
+    Returns the product name of a SigQC export file without parsing its data. ASCII test case
+    files name the product in the first header; unit data files do not, and "*" is returned.
+    '''
+    if (input_type.lower() != "ascii"):
+        return "*"
+    with open(i_filename, 'r') as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if ("BEGINHEADER" in row):
+                return ''.join(next(reader))
+    return "*"
+
+###################################
+# SigQCDeltaFilter class
+###################################
+class SigQCDeltaFilter:
+    '''
+    The SigQCDeltaFilter class is a row filter for the SigQC file parsers that accepts only units
+    tested after a high-water mark, and records the new mark implied by the units it accepted.
+    A unit is new if its timestamp is later than the mark, or equal to it and its serial number
+    is not among the serial numbers recorded at the mark.
+
+    The test cases of a unit are measured at different times, so ASCII test case files give it a
+    different timestamp in each data section. Newness is decided once per serial number, from
+    the first timestamp the filter sees for it (that of the first section), and every later
+    section gets the same answer, so all sections keep the same units. Use a new filter for
+    each file.
+    '''
+    def __init__(self, i_timestamp=None, i_serials=(), i_formats=None):
+        '''
+        Constructor for an instance of the SigQCDeltaFilter class.
+
+        Input:
+            i_timestamp - (Optional) datetime of the high-water mark. If None, all units are new.
+            i_serials - (Optional) Serial numbers already scored at exactly i_timestamp.
+            i_formats - (Optional) Timestamp formats (see parseTimestamp()).
+        '''
+        self._mark = i_timestamp
+        self._markserials = set(i_serials)
+        self._formats = list(TIMESTAMP_FORMATS if (i_formats is None) else i_formats)
+        self._newest = None
+        self._newestserials = set()
+        self._accepted = set()
+        self._decisions = {}
+        self._parsed = {}
+
+    def _parse(self, i_text):
+        if (i_text in self._parsed):
+            return self._parsed[i_text]
+        text = " ".join(i_text.split())
+        for fmt in self._formats:
+            try:
+                timestamp = datetime.strptime(text, fmt)
+            except ValueError:
+                continue
+            # Try the matching format first from now on
+            self._formats.remove(fmt)
+            self._formats.insert(0, fmt)
+            self._parsed[i_text] = timestamp
+            return timestamp
+        raise Exception("Error: Unrecognized timestamp '{}'. Please provide its format in i_formats".format(i_text))
+
+    def __call__(self, i_serial, i_timestamp):
+        if (i_serial in self._decisions):
+            return self._decisions[i_serial]
+        timestamp = self._parse(i_timestamp)
+        if (self._mark is not None):
+            if (timestamp < self._mark) or ((timestamp == self._mark) and (i_serial in self._markserials)):
+                self._decisions[i_serial] = False
+                return False
+        self._decisions[i_serial] = True
+        self._accepted.add(i_serial)
+        if (self._newest is None) or (timestamp > self._newest):
+            self._newest = timestamp
+            self._newestserials = {i_serial}
+        elif (timestamp == self._newest):
+            self._newestserials.add(i_serial)
+        return True
+
+    def getNewCount(self):
+        '''
+        Returns the number of distinct new units accepted by the filter.
+        '''
+        return len(self._accepted)
+
+    def getNewMark(self):
+        '''
+        Returns the high-water mark after the accepted units as a tuple of the datetime and the
+        set of serial numbers tested at that time.
+        '''
+        if (self._newest is None):
+            return self._mark, set(self._markserials)
+        if (self._mark is not None) and (self._newest == self._mark):
+            return self._mark, self._markserials | self._newestserials
+        return self._newest, set(self._newestserials)
+
+###################################
+# SigQCHighWaterMarks class
+###################################
+class SigQCHighWaterMarks:
+    '''
+    The SigQCHighWaterMarks class stores the high-water marks of delta re-analysis per product
+    and reference model in a JSON file.
+    '''
+    def __init__(self, i_filename=None):
+        '''
+        Constructor for an instance of the SigQCHighWaterMarks class. If i_filename names an
+        existing file, the marks are read from it.
+        '''
+        self._filename = i_filename
+        self._marks = {}
+        if (i_filename is not None) and os.path.exists(i_filename):
+            self.read(i_filename)
+
+    def _key(self, i_product, i_modelid):
+        return "{}|{}".format(i_product, i_modelid)
+
+    def read(self, i_filename):
+        '''
+        Reads the marks from a JSON file written by write().
+        '''
+        with open(i_filename, 'r') as f:
+            self._marks = json.load(f)
+        self._filename = i_filename
+
+    def write(self, o_filename=None):
+        '''
+        Writes the marks to a JSON file, by default the file they were read from. The file is
+        replaced atomically so an interrupted write leaves the previous marks intact.
+        '''
+        if (o_filename is None):
+            o_filename = self._filename
+        tmpname = o_filename + ".tmp"
+        with open(tmpname, 'w') as f:
+            json.dump(self._marks, f, indent=1, sort_keys=True)
+        os.replace(tmpname, o_filename)
+        self._filename = o_filename
+
+    def getMark(self, i_product, i_modelid):
+        '''
+        Returns the high-water mark of a product and model as a tuple of the datetime (None if
+        no units were scored yet), the set of serial numbers tested at that time and the
+        total number of units scored.
+        '''
+        entry = self._marks.get(self._key(i_product, i_modelid))
+        if (entry is None):
+            return None, set(), 0
+        return datetime.fromisoformat(entry["timestamp"]), set(entry["serials"]), entry["units"]
+
+    def getFilter(self, i_product, i_modelid, i_formats=None):
+        '''
+        Returns a SigQCDeltaFilter accepting the units of a product tested after its mark.
+        '''
+        timestamp, serials, units = self.getMark(i_product, i_modelid)
+        return SigQCDeltaFilter(timestamp, serials, i_formats)
+
+    def setMark(self, i_product, i_modelid, i_filter):
+        '''
+        Advances the mark of a product and model past the units accepted by a SigQCDeltaFilter.
+        '''
+        timestamp, serials = i_filter.getNewMark()
+        if (timestamp is None):
+            return
+        previous = self.getMark(i_product, i_modelid)[2]
+        self._marks[self._key(i_product, i_modelid)] = {"timestamp": timestamp.isoformat(), "serials": sorted(serials),
+                                                        "units": previous + i_filter.getNewCount(),
+                                                        "updated": datetime.now().isoformat(timespec="seconds")}
+
+    def clearMark(self, i_product, i_modelid):
+        '''
+        Removes the mark of a product and model, so the next run scores all of its units.
+        '''
+        self._marks.pop(self._key(i_product, i_modelid), None)
@@ -41,31 +41,36 @@ def hMethod(i_test_data, i_ref_data, angle_units="d"):
         Returns the angle between the two input total eigenvectors in the units specified with the
         angle_units parameter.
     '''
-    # Calculate covariance matrices for the test and reference feature vectors. In our case, the covariance matrix is simply
-    # the dot product of the transpose of the fest feature vector and itself. It will not be scaled by number of rows
+    # Calculate total eigenvectors for the test and reference feature vectors. In our case, the covariance matrix is simply
+    # the dot product of the transpose of the test feature vector and itself. It will not be scaled by number of rows
     # or centered around the mean (i.e. calculation is simply A.Transpose dot A)
-    test_data_cov = sigqc_pca.getCovariance(i_dataset=i_test_data, scale_by_nrows=False, center_around_mean=False)
-    ref_data_cov = sigqc_pca.getCovariance(i_dataset=i_ref_data, scale_by_nrows=False, center_around_mean=False)
-    
-    # Calculate eigenvectors from covariance matrices
-    test_evals, test_evecs = np.linalg.eigh(test_data_cov, UPLO='U')
-    ref_evals, ref_evecs = np.linalg.eigh(ref_data_cov, UPLO='U')
-    for i in range(len(test_evecs[0,:])):
-        test_evecs[:,i] = test_evecs[:,i]*test_evals[i]
-        ref_evecs[:,i] = ref_evecs[:,i]*ref_evals[i]
+    return SigQCHMethod(i_ref_data, angle_units=angle_units).getAngle(i_test_data)
+
+def getTotalEigenvector(i_data):
+    '''
+    Calculates the total eigenvector of the uncentered, unscaled covariance matrix (A.Transpose dot A)
+    of a 2D feature array. Each eigenvector is scaled by its eigenvalue and the components of each scaled
+    eigenvector are summed, giving one entry per eigenvalue in descending order of eigenvalue.
+    Eigenvectors are only defined up to their sign, so each one is oriented such that the sum of its
+    components is not negative, which makes every entry of the total eigenvector non-negative.
     
-    # Sum to get total eigenvector for each matrix of eigenvectors
-    total_test_evec = np.sum(test_evecs, axis=0)
-    total_ref_evec = np.sum(ref_evecs, axis=0)
+    The eigensystem is obtained through sigqc_pca.getEigenFromData(), so a feature array with fewer rows
+    than columns is decomposed through its small Gram matrix instead of the full covariance matrix. The
+    entries belonging to the zero eigenvalues of the covariance matrix are zero.
     
-    # Normalize eigenvectors
-    test_magnitude = calcMagnitude(total_test_evec)
-    ref_magnitude = calcMagnitude(total_ref_evec)
-    total_test_evec = total_test_evec/test_magnitude
-    total_ref_evec = total_ref_evec/ref_magnitude
+    Inputs
+    ------
+        i_data - A 2D numeric array-like containing the magnitudes of the feature vector(s). MUST be 2D.
     
-    # Calculate angle between eigenvectors
-    return angleEvecs(total_test_evec, total_ref_evec, angle_units=angle_units)
+    Outputs
+    -------
+        Returns the (unnormalized) total eigenvector as a 1D numpy array with one entry per feature.
+    '''
+    data = np.asarray(i_data, dtype=float)
+    evals, evecs = sigqc_pca.getEigenFromData(data, scale_by_nrows=False, center_around_mean=False)
+    total_evec = np.zeros(data.shape[1])
+    total_evec[:len(evals)] = np.abs(np.sum(evecs*evals, axis=0))
+    return total_evec
 
 def calcMagnitude(i_vector):
     '''
@@ -95,7 +100,7 @@ def angleEvecs(itot_test_eigenvec, itot_ref_eigenvec, angle_units="d"):
         in the units specified with the angle_units parameter.
     '''
     Q = np.dot(itot_ref_eigenvec.T, itot_test_eigenvec)
-    angle = np.math.acos(Q)
+    angle = float(np.arccos(np.clip(Q, -1.0, 1.0)))
     if (angle_units.lower() == "d"):
         angle = angle*(180/np.pi)
     elif (angle_units.lower() == "r"):
@@ -103,3 +108,143 @@ def angleEvecs(itot_test_eigenvec, itot_ref_eigenvec, angle_units="d"):
     else:
         raise Exception("Units Error: Please use either angle_units='d' or angle_units='r' to specify degrees or radians respectively")
     return angle
+
+def getTotalEigenvectors(i_groups):
+    '''
+    Calculates the total eigenvectors (see getTotalEigenvector()) of many feature arrays of the
+    same shape in batched calls.
+
+    A group with fewer rows than features is decomposed through its Gram matrix G = A dot
+    A.Transpose.  With the eigenpairs (l, u) of G, the eigenvectors of A.Transpose dot A are
+    A.Transpose dot u/sqrt(l), so the entry of the total eigenvector is sqrt(l)*(u dot s), where s
+    holds the row sums of A.  The Gram matrices of all groups are decomposed in one batched
+    eigh call and the eigenvectors of the features are never formed.  Groups with at least as
+    many rows as features are decomposed through their stacked covariance matrices instead.
+
+    Inputs
+    ------
+        i_groups - A 3D numeric array-like of shape (groups, rows, features).
+
+    Outputs
+    -------
+        Returns a 2D numpy array with the (unnormalized) total eigenvector of each group in rows.
+    '''
+    groups = np.asarray(i_groups, dtype=float)
+    n_groups, n_rows, n_features = groups.shape
+    total_evecs = np.zeros((n_groups, n_features))
+    if (n_rows == 1):
+        # A single unit has one nonzero eigenvalue |a|^2 with the eigenvector a/|a|
+        total_evecs[:,0] = np.sqrt(np.einsum('ij,ij->i', groups[:,0,:], groups[:,0,:]))*np.abs(np.sum(groups[:,0,:], axis=1))
+        return total_evecs
+    if (n_rows < n_features):
+        gram = np.matmul(groups, np.swapaxes(groups, 1, 2))
+        gvals, gvecs = np.linalg.eigh(gram)
+        gvals = gvals[:,::-1]
+        gvecs = gvecs[:,:,::-1]
+        rowsums = np.sum(groups, axis=2)
+        tol = gvals[:,:1]*max(n_rows, n_features)*np.finfo(float).eps
+        entries = np.sqrt(np.clip(gvals, 0, None))*np.abs(np.einsum('gik,gi->gk', gvecs, rowsums))
+        total_evecs[:,:n_rows] = np.where(gvals > tol, entries, 0.0)
+    else:
+        covariances = np.matmul(np.swapaxes(groups, 1, 2), groups)
+        evals, evecs = np.linalg.eigh(covariances)
+        total_evecs[:] = np.abs(np.sum(evecs*evals[:,np.newaxis,:], axis=1))[:,::-1]
+    return total_evecs
+
+###################################
+# SigQCHMethod class
+###################################
+class SigQCHMethod:
+    '''
+    The SigQCHMethod class holds the normalized total eigenvector of a reference dataset, which
+    is computed once, and measures the H Method angle of any number of test units or groups of
+    test units against it.
+
+    Example:
+        hm = SigQCHMethod(reference_data)
+        angles = hm.getAngles(production_lot)          # one angle per unit (row)
+        group_angles = hm.getAngles([lot_a, lot_b])    # one angle per 2D group
+    '''
+    def __init__(self, i_ref_data=None, angle_units="d"):
+        '''
+        Constructor for an instance of the SigQCHMethod class.
+
+        Input:
+            i_ref_data - (Optional) 2D numeric array-like of the reference feature vector(s).
+                         If given, the reference is decomposed on construction.
+            angle_units - (Optional) "d" (default) for degrees or "r" for radians.
+        '''
+        if (angle_units.lower() not in ("d", "r")):
+            raise Exception("Units Error: Please use either angle_units='d' or angle_units='r' to specify degrees or radians respectively")
+        self._angleunits = angle_units.lower()
+        self._reference = None
+        if (i_ref_data is not None):
+            self.setReference(i_ref_data)
+
+    def setReference(self, i_ref_data):
+        '''
+        Decomposes the reference feature array and stores its normalized total eigenvector.
+        '''
+        total_evec = getTotalEigenvector(i_ref_data)
+        self._reference = total_evec/calcMagnitude(total_evec)
+
+    def getReferenceEigenvector(self):
+        '''
+        Returns the normalized total eigenvector of the reference as a 1D numpy array.
+        '''
+        return self._reference
+
+    def _toAngles(self, i_total_evecs):
+        '''
+        Normalizes total eigenvectors (in rows) and returns their angles to the reference.
+        '''
+        if (self._reference is None):
+            raise Exception("Error: Please set the reference data first")
+        total_evecs = np.atleast_2d(i_total_evecs)
+        if (total_evecs.shape[1] != len(self._reference)):
+            raise Exception("Error: The test data has {} features but the reference has {}".format(total_evecs.shape[1], len(self._reference)))
+        magnitudes = np.sqrt(np.einsum('ij,ij->i', total_evecs, total_evecs))
+        cosines = np.dot(total_evecs, self._reference)/magnitudes
+        angles = np.arccos(np.clip(cosines, -1.0, 1.0))
+        if (self._angleunits == "d"):
+            angles = np.degrees(angles)
+        return angles
+
+    def getAngle(self, i_test_data):
+        '''
+        Returns the angle between the total eigenvector of a 2D test feature array and that of
+        the reference, as hMethod() does.
+        '''
+        return float(self._toAngles(getTotalEigenvector(i_test_data))[0])
+
+    def getAngles(self, i_test_data):
+        '''
+        Returns the angles of many tests against the reference in batched calls.
+
+        Input:
+            i_test_data - One of:
+                A 2D numeric array-like with one test unit per row; each row is treated as a
+                    single unit feature vector.
+                A 3D numeric array-like of shape (groups, rows, features).
+                A list of 2D numeric array-likes (groups), which may have different numbers of
+                    rows; groups with the same number of rows are batched together.
+
+        Return:
+            A 1D numpy array with one angle per unit or group.
+        '''
+        if isinstance(i_test_data, (list, tuple)) and (len(i_test_data) > 0) and (np.ndim(i_test_data[0]) == 2):
+            groups = [np.asarray(group, dtype=float) for group in i_test_data]
+            angles = np.empty(len(groups))
+            sizes = {}
+            for i, group in enumerate(groups):
+                sizes.setdefault(group.shape, []).append(i)
+            for shape, indices in sizes.items():
+                angles[indices] = self._toAngles(getTotalEigenvectors(np.stack([groups[i] for i in indices])))
+            return angles
+
+        data = np.asarray(i_test_data, dtype=float)
+        if (data.ndim == 2):
+            data = data[:,np.newaxis,:]
+        elif (data.ndim != 3):
+            raise Exception("Error: Please provide test units in rows of a 2D array, a 3D array or a list of 2D arrays")
+        return self._toAngles(getTotalEigenvectors(data))
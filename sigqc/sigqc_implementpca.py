@@ -1,11 +1,17 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
 import csv
-from sigqc import sigqc_asciitestcase
-from sigqc import sigqc_unitdata
+import os
+import itertools
+from datetime import datetime
 from sigqc import sigqc_pca
 from sigqc import sigqc_report
+from sigqc import sigqc_render
+from sigqc import sigqc_spc
+from sigqc import sigqc_referencemodel
+from sigqc import sigqc_cache
+from sigqc import sigqc_delta
+from sigqc import sigqc_blockpca
+from sigqc import sigqc_instrument
 
 #########################################################################################################################
 # ImplementPCA.py
@@ -24,7 +30,7 @@ from sigqc import sigqc_report
 #
 ##########################################################################################################################
 
-def implementPCA(i_referencefile, i_testfile, input_type="ascii", o_file="PCA_Results", generate_report=True, n_pcs=10):
+def implementPCA(i_referencefile, i_testfile, input_type="ascii", o_file="PCA_Results", generate_report=True, n_pcs=10, spc_pcs=None, alpha=0.05, use_cache=False, missing_features="error", extra_features="ignore", delta_state=None, scores_format="csv", plot_mode="auto", report_format="docx"):
     '''
     Use a reference set of eigenvectors to generate Principal Component
     Scores for each test unit within a user-specified file. 
@@ -33,7 +39,8 @@ def implementPCA(i_referencefile, i_testfile, input_type="ascii", o_file="PCA_Re
     ------
         i_referencefile - String containing path to output .csv file from storeReferenceData() method.
             Must contain the eigenvalues, eigenvectors, and average vector of the reference 
-            dataset.
+            dataset. An already loaded sigqc_referencemodel.SigQCReferenceModel may be given
+            instead to avoid parsing the file again.
         i_testfile - String containing path to test file containing units with test case 
             values to be tested. It is crucial that the units are consistent through
             each test case, as test case features will all be stacked into
@@ -52,6 +59,37 @@ def implementPCA(i_referencefile, i_testfile, input_type="ascii", o_file="PCA_Re
             SigQC report file 
         n_pcs - (Optional) Number of Principal Components to be plotted.
             Default is the first 10 PCs.
+        spc_pcs - (Optional) Number of Principal Components retained by the reference model
+            when screening units with Hotelling's T-squared and SPE (Q) statistics. If None
+            (default), no screening is performed.
+        alpha - (Optional) Significance level of the T-squared and SPE control limits.
+            Defaults to 0.05.
+        use_cache - (Optional) Boolean specifying whether the reference model and the parsed
+            test file are taken from the in-process cache of sigqc_cache, so repeated calls with
+            unchanged files skip parsing. Defaults to False.
+        missing_features - (Optional) Policy for reference features absent from the test file
+            when the reference stores feature keys: "error" (default) or "mean" to substitute
+            the reference mean (see SigQCReferenceModel.setAlignmentPolicy()).
+        extra_features - (Optional) Policy for test features absent from the reference:
+            "ignore" (default) or "error".
+        delta_state - (Optional) String containing the path of a JSON file of high-water marks
+            (see sigqc_delta.SigQCHighWaterMarks). If given, only the units of the test file
+            tested after the mark of its product and reference model are parsed and scored.
+            Their results are appended to the existing [o_file].csv, [o_file]_SPC.csv and
+            [o_file].docx, and the mark is advanced. Nothing is written if there are no new
+            units. Defaults to None, which scores every unit.
+        scores_format - (Optional) Format of the PC scores output. "csv" (default) writes
+            [o_file].csv and "npy" writes [o_file].npy with the serial numbers in
+            [o_file]_Serials.csv (see sigqc_referencemodel.writePCScores()).
+        plot_mode - (Optional) How the PC score plots of the report are drawn. "scatter" draws
+            every unit, "density" draws a 2D histogram with only the units outside the
+            T-squared contour of the reference eigenvalues as points, and "auto" (default)
+            switches to density plots for large numbers of units (see
+            sigqc_render.renderPCScores()).
+        report_format - (Optional) "docx" (default) writes the SigQC report as a Word document
+            [o_file].docx. "html" writes a self-contained [o_file].html, section by section,
+            which also holds tables of the PC scores and of the units failing the screening
+            (see sigqc_report.SigQCHTMLReport).
     
     Outputs
     -------
@@ -59,114 +97,160 @@ def implementPCA(i_referencefile, i_testfile, input_type="ascii", o_file="PCA_Re
             containing plots of the PC Scores and save it to the path specified in o_file.
         Spreadsheet containing PC Scores for each unit as a file named [o_file].csv
         and save it to the path specified in o_file.
+        If spc_pcs is given, spreadsheet containing the T-squared and SPE statistics, control
+        limits and pass/fail result of each unit as a file named [o_file]_SPC.csv.
         This method does not explicitly return anything.
     '''
-    ##################
-    # Assign dataset
-    ##################
-    if (input_type.lower() == "ascii"):
-        # Get test units...
-        dataobj = sigqc_asciitestcase.SigQCAsciiTestCaseFile(i_testfile)
-        headers = dataobj.getHeaders()
-        serialnumbers = dataobj.getMatrixAt(0).getSerialNumbers()
-        dataset = np.array(dataobj.getMatrixDataAt(0))
-        for i in range(1,dataobj.getTestCaseCount()):
-            dataset = np.hstack((dataset,dataobj.getMatrixDataAt(i)))  
-    elif (input_type.lower() == "unit"):
-        dataobj = sigqc_unitdata.SigQCUnitDataFile(i_testfile)
-        headers = dataobj.GetCaseNames()
-        serialnumbers = dataobj.GetSerialNumbers()
-        dataset = np.array(dataobj.GetCaseDataTable())
-    else:
-        raise Exception("Error: Please provide a valid input_type. Valid options include 'ascii' and 'unit'")
-    
+    with sigqc_instrument.span("implementpca", file=os.path.basename(str(i_testfile)), input_type=input_type, report=generate_report):
+        return _implementPCA(i_referencefile, i_testfile, input_type, o_file, generate_report, n_pcs, spc_pcs, alpha, use_cache,
+                             missing_features, extra_features, delta_state, scores_format, plot_mode, report_format)
+
+def _implementPCA(i_referencefile, i_testfile, input_type, o_file, generate_report, n_pcs, spc_pcs, alpha, use_cache, missing_features, extra_features, delta_state, scores_format, plot_mode, report_format):
+    '''
+    Body of implementPCA(), which runs it inside its instrumentation span.
+    '''
     #########################
     # Parse reference data
     #########################
-    avgvec = None
-    evals = None
-    evecs = []
-    with open(i_referencefile, 'r') as f:
-        for row in f:
-            if ("BEGINAVGVECTOR" in row):
-                row = next(f)
-                avgvec = np.array(row.split(','), dtype=float)
-                while ("ENDAVGVECTOR" not in row):
-                    row = next(f)
-            if ("BEGINSTANDDEV" in row):
-                row = next(f)
-                stddev = np.array(row.split(','), dtype=float)
-                while ("ENDSTANDDEV" not in row):
-                    row = next(f)
-            if ("ISCORRMATRIX" in row):
-                row = next(f)
-                corr_matrix = str(row)
-                while ("ENDCORRMATRIX" not in row):
-                    row = next(f)
-            if ("BEGINEVALS" in row):
-                row = next(f)
-                evals = np.array(row.split(','), dtype=float)
-                while ("ENDEVALS" not in row):
-                    row = next(f)
-            if ("BEGINEVECS" in row):
-                row = next(f)
-                while ("ENDEVECS" not in row):
-                    evecs.append(np.array(row.split(','),dtype=float))
-                    row = next(f)
+    if isinstance(i_referencefile, sigqc_referencemodel.SigQCReferenceModel):
+        model = i_referencefile
+    elif (use_cache):
+        model = sigqc_cache.getReferenceModel(i_referencefile)
+    else:
+        model = sigqc_referencemodel.SigQCReferenceModel(i_referencefile)
+    evals = model.getEigenvalues()
+    nunits = model.getUnitCount()
+
+    ##################
+    # Assign dataset
+    ##################
+    rowfilter = None
+    if (delta_state is not None):
+        # Only parse the units tested after the high-water mark of this product and model
+        marks = sigqc_delta.SigQCHighWaterMarks(delta_state)
+        product = sigqc_delta.getProductName(i_testfile, input_type)
+        modelid = sigqc_delta.getModelID(model)
+        rowfilter = marks.getFilter(product, modelid)
+    serialnumbers, headers, dataset, featurekeys = sigqc_referencemodel.readDataset(i_testfile, input_type, use_cache=use_cache, return_keys=True, row_filter=rowfilter)
+    if (rowfilter is not None) and (len(serialnumbers) == 0):
+        return
+    append = (rowfilter is not None)
+
+    # Gather the test columns in reference feature order by feature key
+    dataset = model.alignDataset(dataset, featurekeys, missing=missing_features, extra=extra_features)
                     
     ###################################
     # Run PCA and finish SigQC Report
     ###################################
-    pcscores = np.zeros((dataset.shape))
-    
     # Initialize list of PC scores for boxplots
     boxplotlist = []
             
     # Calculate PC Scores with reference dataset as eigenvectors
-    if ('True' in corr_matrix):
-        pcscores = np.dot((dataset-avgvec)/stddev, evecs)
-    else:
-        pcscores = np.dot((dataset-avgvec), evecs)
+    pcscores = model.score(dataset)
+
+    # Screen units with Hotelling's T-squared and SPE against the reference model
+    if (spc_pcs is not None):
+        t2, spe = model.getT2AndSPE(dataset, spc_pcs)
+        if (nunits is not None):
+            t2_limit = sigqc_spc.getT2Limit(nunits, spc_pcs, alpha=alpha, method="f")
+        else:
+            t2_limit = sigqc_spc.getT2Limit(nunits, spc_pcs, alpha=alpha, method="chi2")
+        spe_limit = sigqc_spc.getSPELimit(evals, spc_pcs, alpha=alpha)
+        passed = (t2 <= t2_limit) & (spe <= spe_limit)
             
+    # Plot pairs PC i+1 against PC i+2, so the last plot needs one more PC than n_pcs. Models
+    # with fewer units than features or stored with truncation hold fewer PCs.
+    n_pcs = min(n_pcs, np.shape(pcscores)[1]-1, len(evals)-1)
+
     if (generate_report):
-        report = sigqc_report.SigQCReport() # Initialize report
+        html = (report_format.lower() == "html")
+        reportname = _getReportName(o_file, report_format)
+        appendreport = append and os.path.exists(reportname)
+        if (html):
+            report = sigqc_report.SigQCHTMLReport(title=headers[0].getProdName()+" SigQC Report")
+            report.openReport(reportname, i_append=appendreport)
+        else:
+            report = sigqc_report.SigQCReport() # Initialize report
+            if (appendreport):
+                report.openReport(reportname)
         
-        # Create figures
-        oname = "PCScores"
+        # Create figures in memory
         header = headers[0].getProdName()+" PC Scores"
-        sigqc_pca.plotPCScores(pcscores, header, o_name=oname, n_pcs=n_pcs)
+        if (append):
+            header += " (New Units {})".format(datetime.now().strftime("%Y-%m-%d %H:%M"))
+        figs = sigqc_render.renderPCScores(pcscores, header, n_pcs=n_pcs, to_files=False, mode=plot_mode, i_evals=evals)
 
         # Add figures to a new section of SigQC Report
-        figs = []
         for j in range(n_pcs):
-            figs.append(oname+str(j)+"-"+str(j+1)+".png")
             boxplotlist.append(pcscores[:,j])
-        figs.append("Boxplot.png")
-        
-        sigqc_pca.plotPCBoxPlots(boxplotlist)
+        figs.append(sigqc_render.renderPCBoxPlots(boxplotlist))
 
         # Add serial numbers
         str_serials = " , "
         str_serials = str_serials.join(serialnumbers)
 
         report.addSection(header+": Principal Component Boxplot", "Unit(s) Tested: "+str_serials, i_figures=figs)
+        if (html):
+            # The score rows are formatted as the table is written
+            rows = ([serial]+["{:.6g}".format(value) for value in row[:n_pcs]] for serial, row in zip(serialnumbers, pcscores))
+            table = itertools.chain([["Serial"]+["PC"+str(j+1) for j in range(n_pcs)]], rows)
+            report.addSection(header+": Principal Component Scores", None, i_table=table)
+
+        if (spc_pcs is not None):
+            failed = [serialnumbers[i] for i in np.flatnonzero(~passed)]
+            description = "T-Squared Limit: {:.4g}, SPE Limit: {:.4g} ({} PCs, alpha={})\n".format(t2_limit, spe_limit, spc_pcs, alpha)
+            description += "Unit(s) Failed: "+(" , ".join(failed) if failed else "None")
+            table = None
+            if (html) and (len(failed) > 0):
+                table = [["Serial", "T-Squared", "SPE"]]
+                table += [[serialnumbers[i], "{:.4g}".format(t2[i]), "{:.4g}".format(spe[i])] for i in np.flatnonzero(~passed)]
+            report.addSection(header+": Hotelling T-Squared and SPE Screening", description, i_table=table)
 
-        report.writeReport(o_docname=o_file)
+        # Add the variance explained by the reference eigensystem (once per report)
+        if not (appendreport):
+            profile = sigqc_pca.SigQCVarianceProfile(evals)
+            n_var = min(n_pcs, len(profile))
+            figure = sigqc_render.renderCumPropVar(profile.getCumPropVar(n_var))
+            description = "The first {} PCs explain {:.1%} of the reference variance.".format(n_var, profile.getCumPropVar(n_var)[-1])
+            report.addSection(header+": Variance Explained", description, i_figures=figure)
+
+        if (appendreport) or (html):
+            report.writeReport()
+        else:
+            report.writeReport(o_docname=o_file)
     
     #######################################
     # Create .csv file with PC Scores
     #######################################
     
-    colnames = np.arange(1,len(pcscores[0,:])+1)
-    colnames = np.hstack(('Serial Number', colnames))
-    tmppcscores = np.hstack((np.array(serialnumbers).reshape(len(serialnumbers),1), pcscores))
-    finalpc = np.vstack((np.array(colnames).reshape(1,len(colnames)), tmppcscores))
-    with open(o_file+".csv", 'w', newline='') as f:
-        writer = csv.writer(f, delimiter=',')
-        writer.writerows(finalpc)
+    extension = ".npy" if (scores_format.lower() == "npy") else ".csv"
+    with sigqc_instrument.span("scores.write", rows=len(serialnumbers), format=scores_format):
+        sigqc_referencemodel.writePCScores(o_file+extension, serialnumbers, pcscores, append=append, o_format=scores_format)
+
+    if (spc_pcs is not None):
+        newfile = not (append and os.path.exists(o_file+"_SPC.csv"))
+        with open(o_file+"_SPC.csv", 'w' if (newfile) else 'a', newline='') as f:
+            writer = csv.writer(f, delimiter=',')
+            if (newfile):
+                writer.writerow(['Serial Number', 'T-Squared', 'SPE', 'T-Squared Limit', 'SPE Limit', 'Pass'])
+            for i in range(len(serialnumbers)):
+                writer.writerow([serialnumbers[i], t2[i], spe[i], t2_limit, spe_limit, bool(passed[i])])
+
+    # Advance the high-water mark once all results are written
+    if (rowfilter is not None):
+        marks.setMark(product, modelid, rowfilter)
+        marks.write()
     return
 
-def storeReferenceData(i_referencefile, input_type="ascii", opath="", oname="ReferenceData.csv", corr_matrix=False):
+def _getReportName(o_file, report_format="docx"):
+    '''
+    Returns the file name of the SigQC report written by implementPCA() for an output name.
+    '''
+    if (report_format.lower() == "html"):
+        return o_file if (".htm" in o_file) else o_file+".html"
+    return o_file if (".doc" in o_file) else o_file+".docx"
+
+def storeReferenceData(i_referencefile, input_type="ascii", opath="", oname="ReferenceData.csv", corr_matrix=False, o_format="csv", dtype=None, n_pcs=None):
     '''
     This method takes a file filled with reference (good) units, parses it according to the user
     specified input type, computes the eigenvalues and eigenvectors of the system, computes the
@@ -184,52 +268,145 @@ def storeReferenceData(i_referencefile, input_type="ascii", opath="", oname="Ref
         oname - (Optional) String describing the output file name. Defaults to "ReferenceData.csv".
         corr_matrix - (Optional) Boolean specifying whether to use correlation matrix in
             eigenvector calculation instead of the covariance matrix. Defaults to false.
+        o_format - (Optional) String selecting the output format. "csv" writes the text format
+            and "binary" writes the versioned, memory-mappable binary format of
+            sigqc_referencemodel. Both are read by implementPCA(). Defaults to "csv".
+        dtype - (Optional) Floating point type used to store the binary format, e.g. np.float32.
+        n_pcs - (Optional) Number of leading eigenvectors to store. Defaults to all eigenvectors.
         
     Outputs
     -------
-        Saves a .csv file containing the eigenvalues, eigenvectors, and mean vector of the system within
+        Saves a reference data file (.csv or binary) containing the eigenvalues, eigenvectors, mean vector, feature keys and number of units of the system within
         the reference file. Output will be saved using the conventions specified with the opath and oname
         parameters.
         This method does not explicitly return anything.
     '''
     # Parse according to file type
-    if (input_type.lower() == "ascii"):
-        dataobj = sigqc_asciitestcase.SigQCAsciiTestCaseFile(i_referencefile)
-        dataset = np.array(dataobj.getMatrixDataAt(0))
-        for i in range(1,dataobj.getTestCaseCount()):
-            dataset = np.hstack((dataset, dataobj.getMatrixDataAt(i)))
-        avgvector = np.mean(dataset, axis=0)
-        stddev = np.std(dataset, axis=0)
-    elif (input_type.lower() == "unit"):
-        dataobj = sigqc_unitdata.SigQCUnitDataFile(i_referencefile)
-        dataset = np.array(dataobj.GetCaseDataTable())
-        avgvector = np.mean(dataset, axis=0)
-        stddev = np.std(dataset, axis=0)
+    serialnumbers, headers, dataset, featurekeys = sigqc_referencemodel.readDataset(i_referencefile, input_type, return_keys=True)
+    
+    # Calculate eigenvalues and eigenvectors on covariance (or correlation) matrix, and
+    # store them with the average vector
+    model = sigqc_referencemodel.SigQCReferenceModel()
+    model.build(dataset, corr_matrix=corr_matrix, i_featurekeys=featurekeys)
+    model.write(opath+oname, o_format=o_format, dtype=dtype, n_pcs=n_pcs)
+    return
+
+def updateReferenceData(i_newfile, input_type="ascii", i_statefile=None, opath="", oname="ReferenceData.csv", statename="ReferenceState.sqcref", corr_matrix=False, rank=None, forgetting=1.0, o_format="csv", dtype=None, n_pcs=None):
+    '''
+    This method adds a file of new reference (good) units to the stored sufficient statistics of
+    the reference dataset and writes an updated reference data file, without reading any of the
+    earlier reference units again (see sigqc_referencemodel.SigQCIncrementalReference).
+    
+    Inputs
+    ------
+        i_newfile - String denoting the absolute path and name of the file of new reference units.
+        input_type - (Optional) String that describes the file's input type, "ascii" or "unit".
+            Defaults to "ascii".
+        i_statefile - (Optional) String denoting the path of the state file written by a previous
+            call. If None or if the file does not exist yet, a new state is started.
+        opath - (Optional) String describing the output file path. Defaults to the current directory.
+        oname - (Optional) String describing the output reference data file name.
+        statename - (Optional) String describing the output state file name.
+        corr_matrix - (Optional) Boolean specifying whether to use correlation matrix in
+            eigenvector calculation instead of the covariance matrix. Defaults to false.
+        rank - (Optional) Number of principal components kept by a new low-rank state. Defaults
+            to None, which keeps the full co-moment matrix.
+        forgetting - (Optional) Weight applied to all earlier units when the new units are added
+            to a new state. Defaults to 1.0 (no forgetting).
+        o_format, dtype, n_pcs - (Optional) Output format options, see storeReferenceData().
+        
+    Outputs
+    -------
+        Saves the updated state file and reference data file using the conventions specified with
+        the opath, oname and statename parameters.
+        This method does not explicitly return anything.
+    '''
+    if (i_statefile is not None) and (os.path.exists(i_statefile)):
+        state = sigqc_referencemodel.SigQCIncrementalReference(i_statefile)
     else:
-        raise Exception("Error: Please provide a valid input_type. Valid options include 'ascii' and 'unit'")
+        state = sigqc_referencemodel.SigQCIncrementalReference(rank=rank, forgetting=forgetting)
     
-    # Calculate eigenvalues and eigenvectors on covariance (or correlation) matrix
-    cov_matrix = sigqc_pca.getCovariance(dataset, center_around_mean=True, scale_by_nrows=True, corr_matrix=corr_matrix) 
-    evals, evecs = sigqc_pca.getEigen(cov_matrix)
+    serialnumbers, headers, dataset, featurekeys = sigqc_referencemodel.readDataset(i_newfile, input_type, return_keys=True)
+    state.update(dataset, featurekeys)
+    state.write(opath+statename)
     
-    # Store eigenvalues, eigenvectors, and average vector
-    with open(opath+oname, 'w', newline='') as f:
-        writer = csv.writer(f, delimiter=",")
-        writer.writerow(["BEGINAVGVECTOR"])
-        writer.writerow(avgvector)
-        writer.writerow(["ENDAVGVECTOR"])
-        writer.writerow(["BEGINSTANDDEV"])
-        writer.writerow(stddev)
-        writer.writerow(["ENDSTANDDEV"])
-        writer.writerow(["ISCORRMATRIX"])
-        writer.writerow([str(corr_matrix)])
-        writer.writerow(["ENDCORRMATRIX"])
-        writer.writerow(["BEGINEVALS"])
-        writer.writerow(evals)
-        writer.writerow(["ENDEVALS"])
-        writer.writerow(["BEGINEVECS"])
-        writer.writerows(evecs)
-        writer.writerow(["ENDEVECS"])
+    model = state.getModel(corr_matrix=corr_matrix)
+    model.write(opath+oname, o_format=o_format, dtype=dtype, n_pcs=n_pcs)
+    return
+
+def storeBlockReferenceData(i_referencefile, input_type="ascii", opath="", oname="BlockReferenceData.sqcref", blocks="testcase", corr_matrix=False, variance=0.9, workers=None, dtype=None):
+    '''
+    This method fits an independent reference model to each test case (or each test case group)
+    of a file of reference (good) units in parallel, and stores all blocks in one binary file
+    (see sigqc_blockpca.SigQCBlockModel).
+    
+    Inputs
+    ------
+        i_referencefile - String denoting the absolute path and name of the file filled with reference
+            units.
+        input_type - (Optional) String that describes the file's input type, "ascii" or "unit".
+            Defaults to "ascii".
+        opath - (Optional) String describing the output file path. Defaults to the current directory.
+        oname - (Optional) String describing the output file name. Defaults to "BlockReferenceData.sqcref".
+        blocks - (Optional) "testcase" (default) for one block per test case, or a dictionary or
+            list of sigqc_primitives.SigQCTestCaseGroup instances for one block per group.
+        corr_matrix - (Optional) Boolean specifying whether to use the correlation matrix of each
+            block instead of its covariance matrix. Defaults to false.
+        variance - (Optional) Proportion of each block's variance explained by the PCs it retains
+            for screening. Defaults to 0.9.
+        workers - (Optional) Number of worker processes. Defaults to the number of CPUs.
+        dtype - (Optional) Floating point type used to store the arrays, e.g. np.float32.
+        
+    Outputs
+    -------
+        Saves the block reference data file using the conventions specified with the opath and
+        oname parameters.
+        This method does not explicitly return anything.
+    '''
+    serialnumbers, headers, dataset, featurekeys = sigqc_referencemodel.readDataset(i_referencefile, input_type, return_keys=True)
+    blockmodel = sigqc_blockpca.SigQCBlockModel()
+    blockmodel.build(dataset, featurekeys, i_blocks=blocks, corr_matrix=corr_matrix, variance=variance, workers=workers)
+    blockmodel.write(opath+oname, dtype=dtype)
     return
 
+def implementBlockPCA(i_referencefile, i_testfile, input_type="ascii", o_file="BlockPCA_Results", alpha=0.05, bonferroni=True, workers=None):
+    '''
+    Screens each unit of a test file against every block of a block reference model and writes
+    the per-block T-squared and SPE statistics with a unit-level summary.
+    
+    Inputs
+    ------
+        i_referencefile - String containing the path to the file written by
+            storeBlockReferenceData(), or a sigqc_blockpca.SigQCBlockModel.
+        i_testfile - String containing the path to the test file.
+        input_type - (Optional) String specifying the file input type, "ascii" or "unit".
+            Defaults to "ascii".
+        o_file - (Optional) String specifying the full path and name of the output file.
+            Defaults to "BlockPCA_Results".
+        alpha - (Optional) Significance level of the screening. Defaults to 0.05.
+        bonferroni - (Optional) Boolean specifying whether alpha is divided among the T-squared
+            and SPE tests of the blocks. Defaults to True.
+        workers - (Optional) Number of threads scoring blocks. Defaults to the number of CPUs.
+    
+    Outputs
+    -------
+        Spreadsheet named [o_file].csv with one row per unit holding its serial number, pass/fail
+        result, worst block, largest T-squared and SPE ratios to the block limits, and the
+        T-squared and SPE statistics of every block.
+        Returns the summary dictionary of sigqc_blockpca.SigQCBlockModel.score().
+    '''
+    if isinstance(i_referencefile, sigqc_blockpca.SigQCBlockModel):
+        blockmodel = i_referencefile
+    else:
+        blockmodel = sigqc_blockpca.SigQCBlockModel(i_referencefile)
+    serialnumbers, headers, dataset, featurekeys = sigqc_referencemodel.readDataset(i_testfile, input_type, return_keys=True)
+    summary = blockmodel.score(dataset, featurekeys, alpha=alpha, bonferroni=bonferroni, workers=workers)
 
+    with open(o_file+".csv", 'w', newline='') as f:
+        writer = csv.writer(f, delimiter=',')
+        writer.writerow(['Serial Number', 'Pass', 'Worst Block', 'T-Squared Ratio', 'SPE Ratio'] +
+                        [name+" T-Squared" for name in summary["blocks"]] + [name+" SPE" for name in summary["blocks"]])
+        for i in range(len(serialnumbers)):
+            writer.writerow([serialnumbers[i], bool(summary["pass"][i]), summary["worstblock"][i], summary["t2ratio"][i],
+                             summary["speratio"][i]] + list(summary["t2"][i]) + list(summary["spe"][i]))
+    return summary
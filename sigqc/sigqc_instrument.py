@@ -0,0 +1,515 @@
+import os
+import glob
+import json
+import time
+import atexit
+import logging
+import threading
+import multiprocessing.util
+
+#########################################################################################################################
+# sigqc_instrument.py
+#
+# Lightweight instrumentation of the SigQC processing stages. The library marks its stages
+# (file parsing, dataset stacking, reference model parsing, projection, plotting, report
+# writing) with spans, and counts the rows, bytes, features and test cases they process.
+# Spans and counts are handed as events to pluggable sinks: log lines (SigQCLogSink), a JSON
+# lines file (SigQCJSONSink), an in-memory collector (SigQCMemorySink) or a Chrome trace
+# (SigQCTraceSink).
+#
+# Chrome traces (Trace Event Format) show the spans of every process and thread of a run on a
+# timeline in chrome://tracing or https://ui.perfetto.dev, e.g. to see how parsing, projection
+# and rendering overlap in worker pools. Worker processes write their events to part files next
+# to the trace, which the sink of the main process merges into the trace when it is closed.
+# JSON lines files of several processes or runs can also be converted with writeChromeTrace().
+#
+# Instrumentation is disabled by default. While disabled, span() returns a shared do-nothing
+# context manager and count() returns immediately, so instrumented code pays one function
+# call per stage. Setting the environment variable SIGQC_INSTRUMENT to "log",
+# "json:[file path]" or "trace:[file path]" enables instrumentation when the module is
+# imported, which also covers worker processes started by the library.
+#
+# Each event is a dictionary with the keys "type" ("span" or "count"), "name", "pid", "tid",
+# "start" (seconds since the epoch), "attrs" (attributes of the span or count) and, for spans,
+# "duration" (seconds) and "depth" (nesting level within the thread). Counts have a "value".
+#
+# Example Usage:
+#  collector = SigQCMemorySink()
+#  enable(collector)
+#  sigqc_implementpca.implementPCA(reference, testfile)
+#  disable()
+#  for name, stats in collector.getSummary()["spans"].items():
+#      print(name, stats["count"], stats["total_s"])
+#
+#  ### Chrome trace of a batch run ###
+#  enable(SigQCTraceSink("batch_trace.json"))
+#  results = list(model.scoreMany(testfiles, workers=8))   # scoreMany() is a generator
+#  disable()   # merges the events of the workers and writes batch_trace.json
+#
+#  ### Instrumenting code ###
+#  with span("ascii.read", file=filename) as s:
+#      ...parse...
+#      s.set(rows=n_rows, cases=n_cases)
+#  count("rows", n_rows)
+#
+#########################################################################################################################
+
+_enabled = False
+_sinks = []
+_lock = threading.Lock()
+_local = threading.local()
+# Offset turning perf_counter() values into seconds since the epoch
+_epochoffset = time.time() - time.perf_counter()
+
+def isEnabled():
+    '''
+    Returns True if instrumentation is enabled.
+    '''
+    return _enabled
+
+def enable(*i_sinks):
+    '''
+    Enables instrumentation and adds the given sinks. Events are only kept by sinks, so
+    enabling without any sink has no visible effect.
+    '''
+    global _enabled
+    with _lock:
+        for sink in i_sinks:
+            if (sink not in _sinks):
+                _sinks.append(sink)
+        _enabled = True
+
+def disable(close_sinks=True):
+    '''
+    Disables instrumentation and removes all sinks, closing them unless close_sinks is False.
+    '''
+    global _enabled
+    with _lock:
+        _enabled = False
+        sinks = list(_sinks)
+        del _sinks[:]
+    if (close_sinks):
+        for sink in sinks:
+            sink.close()
+
+def addSink(i_sink):
+    '''
+    Adds a sink without changing whether instrumentation is enabled.
+    '''
+    with _lock:
+        if (i_sink not in _sinks):
+            _sinks.append(i_sink)
+
+def removeSink(i_sink):
+    '''
+    Removes a sink. The sink is not closed.
+    '''
+    with _lock:
+        if (i_sink in _sinks):
+            _sinks.remove(i_sink)
+
+def getSinks():
+    '''
+    Returns a list of the current sinks.
+    '''
+    return list(_sinks)
+
+def _emit(i_event):
+    for sink in list(_sinks):
+        sink.emit(i_event)
+
+###################################
+# Spans and counts
+###################################
+class _NullSpan:
+    '''
+    Span returned while instrumentation is disabled. All of its methods do nothing.
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, i_type, i_value, i_traceback):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NULLSPAN = _NullSpan()
+
+class SigQCSpan:
+    '''
+    The SigQCSpan class measures the wall time of a stage from entering to leaving its context.
+    Attributes describing the stage (e.g. file name, rows processed) can be given when it is
+    created or added with set() while it runs. The event is emitted when the span ends.
+    '''
+    __slots__ = ("_name", "_attrs", "_start", "_depth")
+
+    def __init__(self, i_name, i_attrs):
+        self._name = i_name
+        self._attrs = i_attrs
+        self._start = None
+        self._depth = 0
+
+    def __enter__(self):
+        self._depth = getattr(_local, "depth", 0)
+        _local.depth = self._depth + 1
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, i_type, i_value, i_traceback):
+        end = time.perf_counter()
+        _local.depth = self._depth
+        if (i_type is not None):
+            self._attrs["error"] = i_type.__name__
+        _emit({"type": "span", "name": self._name, "pid": os.getpid(), "tid": threading.get_native_id(),
+               "start": _epochoffset + self._start, "duration": end - self._start, "depth": self._depth,
+               "attrs": self._attrs})
+        return False
+
+    def set(self, **attrs):
+        '''
+        Adds or replaces attributes of the span.
+        '''
+        self._attrs.update(attrs)
+
+def span(i_name, **attrs):
+    '''
+    Returns a context manager measuring a stage named i_name (e.g. "ascii.read") with the
+    given attributes, or a shared do-nothing context manager while instrumentation is disabled.
+    '''
+    if not (_enabled):
+        return _NULLSPAN
+    return SigQCSpan(i_name, attrs)
+
+def count(i_name, i_value=1, **attrs):
+    '''
+    Records that i_value items named i_name (e.g. "rows", "bytes", "features", "cases") were
+    processed. Does nothing while instrumentation is disabled.
+    '''
+    if not (_enabled):
+        return
+    _emit({"type": "count", "name": i_name, "value": i_value, "pid": os.getpid(), "tid": threading.get_native_id(),
+           "start": time.time(), "attrs": attrs})
+
+###################################
+# Sinks
+###################################
+class SigQCLogSink:
+    '''
+    The SigQCLogSink class writes each event as a log line, e.g.
+    "span ascii.read 152.3 ms file=Test.csv rows=5000".
+    '''
+    def __init__(self, i_logger=None, level=logging.INFO):
+        '''
+        Constructor for an instance of the SigQCLogSink class.
+
+        Input:
+            i_logger - (Optional) Logger or logger name. Defaults to the "sigqc.instrument" logger.
+            level - (Optional) Logging level of the lines. Defaults to INFO.
+        '''
+        if (i_logger is None) or isinstance(i_logger, str):
+            i_logger = logging.getLogger(i_logger or "sigqc.instrument")
+        self._logger = i_logger
+        self._level = level
+
+    def emit(self, i_event):
+        if not (self._logger.isEnabledFor(self._level)):
+            return
+        attrs = " ".join("{}={}".format(key, value) for key, value in i_event["attrs"].items())
+        if (i_event["type"] == "span"):
+            self._logger.log(self._level, "span %s%s %.1f ms %s", "  "*i_event["depth"], i_event["name"], 1000*i_event["duration"], attrs)
+        else:
+            self._logger.log(self._level, "count %s %s %s", i_event["name"], i_event["value"], attrs)
+
+    def close(self):
+        pass
+
+class SigQCJSONSink:
+    '''
+    The SigQCJSONSink class appends each event to a file as one line of JSON. Lines are written
+    whole, so several processes may append to the same file.
+    '''
+    def __init__(self, o_filename, flush_events=100):
+        '''
+        Constructor for an instance of the SigQCJSONSink class.
+
+        Input:
+            o_filename - Path of the JSON lines file. Events are appended to it.
+            flush_events - (Optional) Number of buffered events written at a time.
+        '''
+        self._filename = o_filename
+        self._flushevents = flush_events
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def getFilename(self):
+        return self._filename
+
+    def emit(self, i_event):
+        line = json.dumps(i_event, default=str)+"\n"
+        with self._lock:
+            if (os.getpid() != self._pid):
+                # Forked into a worker process: the buffered events are written by the parent
+                self._pid = os.getpid()
+                self._buffer = []
+                _closeAtExit(self)
+            self._buffer.append(line)
+            if (len(self._buffer) >= self._flushevents):
+                self._flush()
+
+    def _flush(self):
+        if (len(self._buffer) > 0):
+            with open(self._filename, 'a') as f:
+                f.write("".join(self._buffer))
+            self._buffer = []
+
+    def flush(self):
+        '''
+        Writes the buffered events to the file.
+        '''
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+def _closeAtExit(i_sink):
+    '''
+    Closes a sink when the process exits. Worker processes of multiprocessing end without
+    running atexit handlers, so the sink is also registered as a multiprocessing finalizer.
+    '''
+    atexit.register(i_sink.close)
+    multiprocessing.util.Finalize(i_sink, i_sink.close, exitpriority=10)
+
+def readEvents(i_filename):
+    '''
+    Returns the list of events stored in a JSON lines file by SigQCJSONSink.
+    '''
+    with open(i_filename, 'r') as f:
+        return [json.loads(line) for line in f if (line.strip() != "")]
+
+class SigQCMemorySink:
+    '''
+    The SigQCMemorySink class keeps the events in memory, e.g. for tests or to print a summary
+    at the end of a run.
+    '''
+    def __init__(self, max_events=None):
+        '''
+        Constructor for an instance of the SigQCMemorySink class. If max_events is given, only
+        the latest max_events events are kept, while the summary covers all of them.
+        '''
+        self._events = []
+        self._maxevents = max_events
+        self._spans = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def emit(self, i_event):
+        with self._lock:
+            self._events.append(i_event)
+            if (self._maxevents is not None) and (len(self._events) > self._maxevents):
+                del self._events[:len(self._events)-self._maxevents]
+            if (i_event["type"] == "span"):
+                stats = self._spans.setdefault(i_event["name"], {"count": 0, "total_s": 0.0, "max_s": 0.0})
+                stats["count"] += 1
+                stats["total_s"] += i_event["duration"]
+                stats["max_s"] = max(stats["max_s"], i_event["duration"])
+            else:
+                self._counts[i_event["name"]] = self._counts.get(i_event["name"], 0) + i_event["value"]
+
+    def getEvents(self, i_type=None, i_name=None):
+        '''
+        Returns the kept events, optionally only those of one type and/or name.
+        '''
+        with self._lock:
+            return [event for event in self._events if ((i_type is None) or (event["type"] == i_type))
+                    and ((i_name is None) or (event["name"] == i_name))]
+
+    def getSummary(self):
+        '''
+        Returns a dictionary with "spans", holding the number of spans, total and maximum
+        duration in seconds of each span name, and "counts", holding the total of each count.
+        '''
+        with self._lock:
+            spans = {name: dict(stats, mean_s=stats["total_s"]/stats["count"]) for name, stats in self._spans.items()}
+            return {"spans": spans, "counts": dict(self._counts)}
+
+    def clear(self):
+        '''
+        Discards the kept events and the summary.
+        '''
+        with self._lock:
+            self._events = []
+            self._spans = {}
+            self._counts = {}
+
+    def close(self):
+        pass
+
+###################################
+# Chrome traces
+###################################
+def getTraceEvents(i_events):
+    '''
+    Converts events to the Chrome Trace Event Format. Spans become complete ("X") events and
+    counts become counter ("C") events holding the running total of each count per process.
+    Timestamps are in microseconds from the earliest event, and each process is named after
+    its process ID, ordered by its first event.
+
+    Return:
+        A list of trace event dictionaries.
+    '''
+    events = sorted(i_events, key=lambda event: event["start"])
+    if (len(events) == 0):
+        return []
+    origin = events[0]["start"]
+    trace = []
+    totals = {}
+    pids = []
+    for event in events:
+        if (event["pid"] not in pids):
+            pids.append(event["pid"])
+        ts = round(1e6*(event["start"]-origin), 3)
+        if (event["type"] == "span"):
+            trace.append({"name": event["name"], "cat": event["name"].split(".")[0], "ph": "X", "ts": ts,
+                          "dur": round(1e6*event["duration"], 3), "pid": event["pid"], "tid": event["tid"], "args": event["attrs"]})
+        else:
+            key = (event["pid"], event["name"])
+            totals[key] = totals.get(key, 0) + event["value"]
+            trace.append({"name": event["name"], "cat": "count", "ph": "C", "ts": ts, "pid": event["pid"],
+                          "args": {event["name"]: totals[key]}})
+    for index, pid in enumerate(pids):
+        trace.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "sigqc {}".format(pid)}})
+        trace.append({"name": "process_sort_index", "ph": "M", "pid": pid, "args": {"sort_index": index}})
+    return trace
+
+def writeChromeTrace(o_filename, i_events):
+    '''
+    Writes events to a Chrome trace JSON file that can be opened in chrome://tracing or
+    https://ui.perfetto.dev.
+
+    Input:
+        o_filename - Path of the trace file.
+        i_events - List of events (e.g. SigQCMemorySink.getEvents()), or the path or list of
+                   paths of JSON lines files written by SigQCJSONSink, whose events are merged.
+    '''
+    if isinstance(i_events, str):
+        i_events = [i_events]
+    if (len(i_events) > 0) and isinstance(i_events[0], str):
+        i_events = [event for filename in i_events for event in readEvents(filename)]
+    with open(o_filename, 'w') as f:
+        json.dump({"traceEvents": getTraceEvents(i_events), "displayTimeUnit": "ms"}, f, default=str)
+
+class SigQCTraceSink:
+    '''
+    The SigQCTraceSink class collects the events of a run and writes them as a Chrome trace
+    when it is closed (see writeChromeTrace()).
+
+    The sink belongs to the process that created it. Worker processes forked from it, and
+    processes started with the environment variables it sets (SIGQC_INSTRUMENT and
+    SIGQC_TRACE_OWNER), append their events to part files "[trace file].[pid].part" when they
+    exit. Closing the sink in the owning process merges and removes the part files, so it
+    should be closed after the worker pools of the run have shut down.
+    '''
+    def __init__(self, o_filename):
+        '''
+        Constructor for an instance of the SigQCTraceSink class.
+
+        Input:
+            o_filename - Path of the Chrome trace file.
+        '''
+        self._filename = os.path.abspath(o_filename)
+        self._events = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._closed = False
+        self._environment = None
+        owner = os.environ.get("SIGQC_TRACE_OWNER", "")
+        self._owner = (owner == "") or (owner == str(self._pid))
+        if (self._owner):
+            # Processes started by this one (e.g. spawned workers) record to part files
+            self._environment = {name: os.environ.get(name) for name in ("SIGQC_INSTRUMENT", "SIGQC_TRACE_OWNER")}
+            os.environ["SIGQC_TRACE_OWNER"] = str(self._pid)
+            os.environ["SIGQC_INSTRUMENT"] = "trace:"+self._filename
+        else:
+            _closeAtExit(self)
+
+    def getFilename(self):
+        return self._filename
+
+    def isOwner(self):
+        '''
+        Returns True if the sink writes the trace, or False if it writes a part file.
+        '''
+        return self._owner
+
+    def emit(self, i_event):
+        with self._lock:
+            if (os.getpid() != self._pid):
+                # Forked into a worker process: the collected events belong to the parent
+                self._pid = os.getpid()
+                self._owner = False
+                self._closed = False
+                self._events = []
+                _closeAtExit(self)
+            if not (self._closed):
+                self._events.append(i_event)
+
+    def close(self):
+        '''
+        Writes the trace (or, in a worker process, the part file). Events emitted afterwards
+        are ignored.
+        '''
+        with self._lock:
+            if (self._closed):
+                return
+            self._closed = True
+            events, self._events = self._events, []
+        if not (self._owner):
+            if (len(events) > 0):
+                with open("{}.{}.part".format(self._filename, os.getpid()), 'a') as f:
+                    f.write("".join(json.dumps(event, default=str)+"\n" for event in events))
+            return
+        for partname in glob.glob(glob.escape(self._filename)+".*.part"):
+            events += readEvents(partname)
+            os.remove(partname)
+        writeChromeTrace(self._filename, events)
+        for name, value in self._environment.items():
+            if (value is None):
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def enableFromEnvironment(i_value=None):
+    '''
+    Enables instrumentation as specified by the value of the SIGQC_INSTRUMENT environment
+    variable (or i_value): "log" for a SigQCLogSink, "json:[file path]" for a SigQCJSONSink or
+    "trace:[file path]" for a SigQCTraceSink. File sinks are closed when the process exits.
+    Returns the sink added, or None. Raises an exception for an unknown value; when called at
+    import, the exception is logged as a warning and instrumentation stays disabled.
+    '''
+    value = os.environ.get("SIGQC_INSTRUMENT", "") if (i_value is None) else i_value
+    if (value == ""):
+        return None
+    if (value.lower() == "log"):
+        sink = SigQCLogSink()
+    elif (value.lower().startswith("json:")):
+        sink = SigQCJSONSink(value[5:])
+        atexit.register(sink.close)
+    elif (value.lower().startswith("trace:")):
+        sink = SigQCTraceSink(value[6:])
+        if (sink.isOwner()):
+            atexit.register(sink.close)
+    else:
+        raise Exception("Error: Unknown SIGQC_INSTRUMENT value '{}'. Valid options include 'log', 'json:[file path]' and 'trace:[file path]'".format(value))
+    enable(sink)
+    return sink
+
+# A bad SIGQC_INSTRUMENT value must not make the library unimportable, so it is only reported
+try:
+    enableFromEnvironment()
+except Exception as e:
+    logging.getLogger("sigqc.instrument").warning("Instrumentation left disabled: %s", e)
@@ -0,0 +1,427 @@
+import numpy as np
+import os
+import sys
+import mmap
+import types
+import functools
+
+#########################################################################################################################
+# sigqc_memory.py
+#
+# Memory accounting of SigQC objects and pre-flight estimates of the peak memory of the main
+# analysis steps.
+#
+# getMemoryUsage() walks an object (e.g. a SigQCAsciiTestCaseFile, SigQCUnitDataFile or
+# SigQCReferenceModel, which expose it as getMemoryUsage()/GetMemoryUsage()) and breaks its
+# footprint down into numeric numpy arrays, strings (Python strings and numpy string arrays,
+# e.g. unconverted test case values) and other Python object overhead. Arrays memory-mapped from
+# a file are reported separately, because the operating system pages them in and out.
+#
+# The estimators predict the peak memory of getAllTestCases(), storeReferenceData() and
+# implementPCA() before a file is parsed. They scan the files as raw lines to count the units,
+# test cases and domain points of every section and sample the width of the values, and then
+# model the memory held by each step of the analysis (parsed text, float matrices, covariance
+# or Gram matrix, eigensolver workspace, reference model, PC scores). Estimates cover the data
+# of the analysis, not the Python interpreter and imported libraries (typically 100-200 MB),
+# and err towards the high side so jobs can be routed to nodes with enough memory.
+#
+# Example Usage:
+#  usage = sigqc_asciitestcase.SigQCAsciiTestCaseFile("[test file path]").getMemoryUsage()
+#  print(usage["numeric_bytes"], usage["string_bytes"], usage["metadata_bytes"], usage["total_bytes"])
+#
+#  ### Route a job by its estimated peak memory ###
+#  estimate = estimateImplementPCA("[reference data path]", "[test file path]", n_pcs=10)
+#  if (estimate["peak_bytes"] > 8*1024**3):
+#      submitToLargeNode(...)
+#
+#########################################################################################################################
+
+# Number of data rows of each section sampled for the width of serial numbers, timestamps and values
+SAMPLE_ROWS = 200
+# Memory of an empty Python string and list and of a list entry
+_STRBYTES = sys.getsizeof("")
+_LISTBYTES = sys.getsizeof([])
+_POINTERBYTES = 8
+_FLOATBYTES = sys.getsizeof(1.0)
+# Mean characters of a PC score formatted by writePCScores(): repr() of a double, "%.9g" of a single
+_SCORECHARS = {8: 21, 4: 14}
+# Raster of one rendered figure (6.4 x 4.8 inches at 100 dpi, RGBA) and a typical PNG of it
+_CANVASBYTES = 640*480*4
+_PNGBYTES = 150*1024
+
+_SKIPTYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, functools.partial)
+
+###################################
+# Memory accounting
+###################################
+def getMemoryUsage(i_object, i_seen=None):
+    '''
+    Returns the memory held by an object and everything it references, broken down by kind.
+
+    Inputs
+    ------
+        i_object - Object to account, e.g. a parsed file or a reference model.
+        i_seen - (Optional) Set of the ids of objects already accounted, which are skipped.
+            Pass the same set to account several objects without counting shared data twice.
+
+    Outputs
+    -------
+        Returns a dictionary holding the bytes of:
+            "numeric_bytes" - numeric numpy arrays
+            "string_bytes" - Python strings and bytes and numpy string arrays
+            "metadata_bytes" - other Python objects (instances, lists, dictionaries, numbers)
+            "mapped_bytes" - arrays memory-mapped from a file, not included in the total
+            "total_bytes" - the sum of the numeric, string and metadata bytes
+        Views of an array count the array they view once. Functions, classes and modules
+        are not accounted.
+    '''
+    usage = {"numeric_bytes": 0, "string_bytes": 0, "metadata_bytes": 0, "mapped_bytes": 0}
+    _addUsage(i_object, usage, set() if (i_seen is None) else i_seen)
+    usage["total_bytes"] = usage["numeric_bytes"] + usage["string_bytes"] + usage["metadata_bytes"]
+    return usage
+
+def _addUsage(i_object, io_usage, io_seen):
+    if (id(i_object) in io_seen) or (i_object is None) or isinstance(i_object, _SKIPTYPES):
+        return
+    io_seen.add(id(i_object))
+
+    if isinstance(i_object, (str, bytes, bytearray)):
+        io_usage["string_bytes"] += sys.getsizeof(i_object)
+    elif isinstance(i_object, np.ndarray):
+        _addArrayUsage(i_object, io_usage, io_seen)
+    elif isinstance(i_object, (int, float, bool, complex, np.generic)):
+        io_usage["metadata_bytes"] += sys.getsizeof(i_object)
+    elif isinstance(i_object, dict):
+        io_usage["metadata_bytes"] += sys.getsizeof(i_object)
+        for key, value in i_object.items():
+            _addUsage(key, io_usage, io_seen)
+            _addUsage(value, io_usage, io_seen)
+    elif isinstance(i_object, (list, tuple, set, frozenset)):
+        io_usage["metadata_bytes"] += sys.getsizeof(i_object)
+        for value in i_object:
+            _addUsage(value, io_usage, io_seen)
+    else:
+        io_usage["metadata_bytes"] += sys.getsizeof(i_object)
+        if hasattr(i_object, "__dict__"):
+            _addUsage(vars(i_object), io_usage, io_seen)
+        for name in getattr(type(i_object), "__slots__", ()):
+            _addUsage(getattr(i_object, name, None), io_usage, io_seen)
+
+def _addArrayUsage(i_array, io_usage, io_seen):
+    # Account the array owning the data once, however many views of it are referenced
+    root = i_array
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if (isinstance(root.base, mmap.mmap)):
+        if (id(root) not in io_seen) or (root is i_array):
+            io_seen.add(id(root))
+            io_usage["mapped_bytes"] += root.nbytes
+        return
+    if (root is not i_array):
+        if (id(root) in io_seen):
+            return
+        io_seen.add(id(root))
+    io_usage["metadata_bytes"] += sys.getsizeof(np.empty(0))
+    if (root.dtype.kind in "biufcmM"):
+        io_usage["numeric_bytes"] += root.nbytes
+    elif (root.dtype.kind in "USV"):
+        io_usage["string_bytes"] += root.nbytes
+    else:
+        io_usage["metadata_bytes"] += root.nbytes
+        if (root.dtype == object):
+            for value in root.flat:
+                _addUsage(value, io_usage, io_seen)
+
+###################################
+# File scans
+###################################
+def scanAsciiTestCaseFile(i_filename, sample_rows=SAMPLE_ROWS):
+    '''
+    Scans a SigQC ASCII test case file as raw lines without converting any value.
+
+    Outputs
+    -------
+        Returns a list with a dictionary for each data section holding the number of domain
+        points ("elements") and units ("rows"), the length of the longest sampled value
+        ("value_len"), the mean length of the sampled values ("mean_value_len") and of the
+        serial numbers and timestamps ("serial_len", "timestamp_len"), and whether a limits
+        section follows it ("limits").
+    '''
+    sections = []
+    section = None
+    with open(i_filename, 'rb') as f:
+        for line in f:
+            if (section is None):
+                if (line.startswith(b"BEGINDATA")):
+                    section = {"elements": None, "rows": 0, "value_len": 1, "mean_value_len": 1.0,
+                               "serial_len": 0, "timestamp_len": 0, "limits": False}
+                    valuechars, values = 0, 0
+                elif (line.startswith(b"BEGINLIMITS")) and (len(sections) > 0):
+                    sections[-1]["limits"] = True
+            elif (section["elements"] is None):
+                section["elements"] = max(line.rstrip(b"\r\n").count(b",")-1, 0)
+            elif (line.startswith(b"ENDDATA")):
+                if (values > 0):
+                    section["mean_value_len"] = valuechars/values
+                sections.append(section)
+                section = None
+            else:
+                section["rows"] += 1
+                if (section["rows"] <= sample_rows):
+                    fields = line.rstrip(b"\r\n").split(b",")
+                    section["serial_len"] = max(section["serial_len"], len(fields[0]))
+                    section["timestamp_len"] = max(section["timestamp_len"], len(fields[1]) if (len(fields) > 1) else 0)
+                    lengths = [len(field) for field in fields[2:]]
+                    if (len(lengths) > 0):
+                        section["value_len"] = max(section["value_len"], max(lengths))
+                        valuechars += sum(lengths)
+                        values += len(lengths)
+    return sections
+
+def scanUnitDataFile(i_filename, i_delimiter=",", sample_rows=SAMPLE_ROWS):
+    '''
+    Scans a SigQC unit data file as raw lines without converting any value.
+
+    Outputs
+    -------
+        Returns a dictionary holding the number of units ("rows") and test case columns
+        ("columns"), the length of the longest sampled field ("value_len") and the mean length
+        of the sampled fields ("mean_value_len").
+    '''
+    delimiter = i_delimiter.encode()
+    rows, columns, longest, chars, fields = 0, 0, 1, 0, 0
+    with open(i_filename, 'rb') as f:
+        for number, line in enumerate(f):
+            if (number == 0):
+                columns = max(line.rstrip(b"\r\n").count(delimiter)-2, 0)
+            elif (number > 1):
+                rows += 1
+                if (rows <= sample_rows):
+                    lengths = [len(field) for field in line.rstrip(b"\r\n").split(delimiter)]
+                    longest = max(longest, max(lengths))
+                    chars += sum(lengths)
+                    fields += len(lengths)
+    return {"rows": rows, "columns": columns, "value_len": longest, "mean_value_len": chars/fields if (fields > 0) else 1.0}
+
+def scanReferenceFile(i_referencefile):
+    '''
+    Reads the shape of a reference data file (.csv or binary) without reading its arrays.
+
+    Outputs
+    -------
+        Returns a dictionary holding the number of features ("features") and stored principal
+        components ("pcs"), the bytes per value of the arrays ("itemsize"), the format
+        ("csv" or "binary"), the number of text lines of a .csv file ("lines") and the file
+        size in bytes ("bytes").
+    '''
+    # Imported here because sigqc_referencemodel accounts its models with this module
+    from sigqc import sigqc_referencemodel
+    size = os.path.getsize(i_referencefile)
+    if (sigqc_referencemodel.isBinaryModelFile(i_referencefile)):
+        header, arrays = sigqc_referencemodel.readBinaryFile(i_referencefile, mmap=True)
+        evecs = arrays["evecs"]
+        return {"features": evecs.shape[0], "pcs": evecs.shape[1], "itemsize": evecs.dtype.itemsize,
+                "format": "binary", "lines": 0, "bytes": size}
+    features, pcs, lines, name = 0, 0, 0, None
+    with open(i_referencefile, 'rb') as f:
+        for line in f:
+            lines += 1
+            row = line.strip()
+            if (name is None):
+                if (row.startswith(b"BEGIN")):
+                    name = row[len(b"BEGIN"):]
+            elif (row == b"END"+name):
+                name = None
+            elif (name == b"EVECS"):
+                features += 1
+                if (pcs == 0):
+                    pcs = row.count(b",")+1
+    return {"features": features, "pcs": pcs, "itemsize": 8, "format": "csv", "lines": lines, "bytes": size}
+
+###################################
+# Peak memory estimates
+###################################
+def _getStringBytes(i_count, i_length):
+    '''
+    Memory of i_count Python strings of i_length ASCII characters and the list holding them.
+    '''
+    return int(i_count*(_STRBYTES+i_length+_POINTERBYTES)) + _LISTBYTES
+
+def _estimateParse(i_filename, input_type="ascii"):
+    '''
+    Estimates the memory of parsing a SigQC export file into a SigQCAsciiTestCaseFile or
+    SigQCUnitDataFile. Returns a tuple of the number of units, the number of features, the
+    bytes per float value of the parsed data, the peak bytes while parsing and the bytes held
+    by the parsed object.
+    '''
+    if (input_type.lower() == "ascii"):
+        sections = scanAsciiTestCaseFile(i_filename)
+        if (len(sections) == 0):
+            raise Exception("Error: {} does not contain any test case data".format(i_filename))
+        held, peak = 0, 0
+        for section in sections:
+            rows, elements = section["rows"], section["elements"]
+            # Values are parsed into lists of strings, then converted to a numpy string array
+            rowlists = rows*(_LISTBYTES + _POINTERBYTES*(elements+2)) + _getStringBytes(rows*elements, section["mean_value_len"])
+            strings = rows*elements*4*section["value_len"]
+            labels = _getStringBytes(rows, section["serial_len"]) + _getStringBytes(rows, section["timestamp_len"])
+            peak = max(peak, held + rowlists + strings + labels)
+            held += strings + labels + 3*elements*8*(2 if (section["limits"]) else 1)
+        return sections[0]["rows"], sum(section["elements"] for section in sections), 8, peak, held
+    elif (input_type.lower() == "unit"):
+        scan = scanUnitDataFile(i_filename)
+        rows, columns = scan["rows"], scan["columns"]
+        cells = (rows+2)*(columns+3)
+        # The whole file is read as lines, split into lists (and tuples) of strings and
+        # converted to a numpy string array
+        lines = _getStringBytes(rows+2, (columns+3)*(scan["mean_value_len"]+1))
+        strings = cells*4*scan["value_len"]
+        peak = lines + _getStringBytes(cells, scan["mean_value_len"]) + 2*(rows+2)*(_LISTBYTES+_POINTERBYTES*(columns+3)) + strings
+        # Serial numbers, dates and times are kept as string arrays and the values as float32
+        held = 3*rows*4*scan["value_len"] + rows*columns*4
+        return rows, columns, 4, peak, held
+    raise Exception("Error: Please provide a valid input_type. Valid options include 'ascii' and 'unit'")
+
+def _estimateReadDataset(i_filename, input_type="ascii"):
+    '''
+    Estimates the memory of sigqc_referencemodel.readDataset(). Returns a dictionary with the
+    shape of the dataset, the peak bytes of parsing and stacking, and the bytes of the
+    resulting dataset.
+    '''
+    rows, features, itemsize, parsepeak, held = _estimateParse(i_filename, input_type)
+    dataset = rows*features*itemsize
+    # The float matrices of all test cases are stacked while the parsed file is still held
+    stackpeak = held + 2*dataset + _getStringBytes(features, 40)
+    return {"units": rows, "features": features, "itemsize": itemsize, "parse_bytes": parsepeak,
+            "parsed_bytes": held, "stack_bytes": stackpeak, "dataset_bytes": dataset}
+
+def _estimateEigen(i_rows, i_features, i_itemsize, corr_matrix=False):
+    '''
+    Estimates the memory of sigqc_pca.getEigenFromData() on top of the dataset and the memory
+    of its eigenvectors.
+    '''
+    if (i_rows < i_features):
+        # Centered (and scaled) copy, Gram matrix, eigensolver copy, eigenvectors and workspace
+        centered = i_rows*i_features*i_itemsize*(2 if (corr_matrix) else 1)
+        solve = 5*i_rows*i_rows*i_itemsize
+        evecs = i_features*i_rows*i_itemsize
+        return centered + max(solve, 2*evecs), evecs
+    # Imported here because sigqc_pca imports sigqc_primitives, which accounts its groups with this module
+    from sigqc import sigqc_pca
+    # Covariance matrix, eigensolver copy, eigenvectors and workspace (about 2 n^2), then sorting
+    chunk = min(i_rows, sigqc_pca.CHUNK_ROWS)*i_features*i_itemsize
+    return 5*i_features*i_features*i_itemsize + chunk, i_features*i_features*i_itemsize
+
+def estimateAllTestCases(i_filename):
+    '''
+    Estimates the peak memory of parsing a SigQC ASCII test case file and stacking its test
+    cases with SigQCAsciiTestCaseFile.getAllTestCases().
+
+    Outputs
+    -------
+        Returns a dictionary holding the number of units and features, the bytes held by the
+        parsed file ("parsed_bytes"), the peak bytes of parsing ("parse_bytes") and stacking
+        ("stack_bytes"), the bytes of the stacked matrix ("result_bytes") and the overall
+        peak ("peak_bytes").
+    '''
+    estimate = _estimateReadDataset(i_filename, "ascii")
+    return {"units": estimate["units"], "features": estimate["features"], "parsed_bytes": estimate["parsed_bytes"],
+            "parse_bytes": estimate["parse_bytes"], "stack_bytes": estimate["stack_bytes"],
+            "result_bytes": estimate["dataset_bytes"], "peak_bytes": max(estimate["parse_bytes"], estimate["stack_bytes"])}
+
+def estimateStoreReferenceData(i_referencefile, input_type="ascii", corr_matrix=False):
+    '''
+    Estimates the peak memory of sigqc_implementpca.storeReferenceData() for a reference file.
+
+    Outputs
+    -------
+        Returns a dictionary holding the number of units and features, the peak bytes of each
+        step ("parse_bytes", "stack_bytes", "build_bytes" for the mean and standard deviation
+        and "eigen_bytes" for the decomposition), the bytes of the reference model
+        ("model_bytes") and the overall peak ("peak_bytes").
+    '''
+    estimate = _estimateReadDataset(i_referencefile, input_type)
+    rows, features, itemsize, dataset = estimate["units"], estimate["features"], estimate["itemsize"], estimate["dataset_bytes"]
+    # np.std() holds a centered copy of the dataset
+    build = 2*dataset
+    eigen, evecs = _estimateEigen(rows, features, itemsize, corr_matrix)
+    eigen += dataset
+    model = evecs + 4*features*8 + _getStringBytes(features, 40)
+    return {"units": rows, "features": features, "parse_bytes": estimate["parse_bytes"], "stack_bytes": estimate["stack_bytes"],
+            "build_bytes": build, "eigen_bytes": eigen, "model_bytes": model,
+            "peak_bytes": max(estimate["parse_bytes"], estimate["stack_bytes"], build, eigen)}
+
+def _estimateWriteScores(i_rows, i_pcs, i_itemsize, scores_format="csv"):
+    '''
+    Estimates the memory of sigqc_referencemodel.writePCScores() on top of the PC scores.
+    '''
+    from sigqc import sigqc_pca
+    if (scores_format.lower() == "npy"):
+        return 0
+    # A chunk of rows is converted to lists of Python floats, each row is formatted as a string
+    # and the rows of the chunk are joined into one string before it is written
+    chunk = min(i_rows, sigqc_pca.CHUNK_ROWS)
+    chars = _SCORECHARS.get(i_itemsize, 21) + 1
+    return chunk*(_LISTBYTES + 3*_POINTERBYTES + 2*_STRBYTES + 40) + chunk*i_pcs*(_FLOATBYTES + _POINTERBYTES + 2*chars)
+
+def estimateImplementPCA(i_referencefile, i_testfile, input_type="ascii", generate_report=True, n_pcs=10, spc_pcs=None, mmap=False, scores_format="csv"):
+    '''
+    Estimates the peak memory of sigqc_implementpca.implementPCA().
+
+    Inputs
+    ------
+        i_referencefile - Path to the reference data file (.csv or binary).
+        i_testfile - Path to the SigQC export file of the units to test.
+        input_type, generate_report, n_pcs, spc_pcs, scores_format - (Optional) As for implementPCA().
+        mmap - (Optional) Boolean specifying whether a binary reference model is memory-mapped
+            (e.g. by sigqc_cache.getReferenceModel(..., mmap=True)).
+
+    Outputs
+    -------
+        Returns a dictionary holding the number of units, features and reference PCs, the bytes
+        of the reference model ("model_bytes") and the peak bytes of reading the reference
+        ("reference_bytes"), parsing and stacking the test file ("parse_bytes",
+        "stack_bytes"), aligning it to the reference features ("align_bytes", 0 if the
+        features match), scoring ("score_bytes"), the report ("report_bytes"), writing the PC
+        scores ("write_bytes") and overall ("peak_bytes"). All steps but reading the
+        reference include the reference model.
+    '''
+    from sigqc import sigqc_pca
+    reference = scanReferenceFile(i_referencefile)
+    features, pcs, itemsize = reference["features"], reference["pcs"], reference["itemsize"]
+    model = (features*pcs + 3*features + pcs)*itemsize + _getStringBytes(features, 40)
+    if (reference["format"] == "csv"):
+        # Section lines are collected as strings before the arrays are converted
+        readpeak = _getStringBytes(reference["lines"], reference["bytes"]/max(reference["lines"], 1)) + 2*model
+    elif (mmap):
+        model = _getStringBytes(features, 40)
+        readpeak = model
+    else:
+        readpeak = model
+
+    estimate = _estimateReadDataset(i_testfile, input_type)
+    rows, dataset = estimate["units"], estimate["dataset_bytes"]
+    # The dataset is held until implementPCA() returns. alignDataset() gathers the reference
+    # features into a new array when the test file has a different set of features, which
+    # replaces the stacked dataset once it is complete.
+    align = 0
+    if (estimate["features"] != features):
+        align = dataset + rows*features*estimate["itemsize"]
+        dataset = rows*features*estimate["itemsize"]
+    scores = rows*pcs*8
+    chunk = min(rows, sigqc_pca.CHUNK_ROWS)*features*8
+    score = dataset + scores + chunk
+    if (spc_pcs is not None):
+        score += 2*rows*8 + chunk
+    report = 0
+    if (generate_report):
+        # Figures are rendered one at a time and kept as PNG bytes; the boxplot holds the
+        # score columns
+        report = dataset + scores + 2*_CANVASBYTES + (n_pcs+2)*_PNGBYTES + rows*min(n_pcs, pcs)*8
+    write = dataset + scores + _estimateWriteScores(rows, pcs, itemsize, scores_format)
+    return {"units": rows, "features": features, "pcs": pcs, "model_bytes": model, "reference_bytes": readpeak,
+            "parse_bytes": model+estimate["parse_bytes"], "stack_bytes": model+estimate["stack_bytes"],
+            "score_bytes": model+score, "report_bytes": model+report if (generate_report) else 0,
+            "align_bytes": model+align, "write_bytes": model+write,
+            "peak_bytes": max(readpeak, model+estimate["parse_bytes"], model+estimate["stack_bytes"], model+align, model+score,
+                              model+report, model+write)}
@@ -1,10 +1,10 @@
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
 from sigqc import sigqc_primitives
+from sigqc import sigqc_render
+from sigqc import sigqc_instrument
 import os
 import csv
-import matplotlib.cm 
+from scipy.linalg import blas
 
 #####################################################################################################################################
 # sigqc_pca.py
@@ -30,7 +30,74 @@ import matplotlib.cm
 #
 #####################################################################################################################################
 
-def getCovariance(i_dataset, corr_matrix=False, scale_by_nrows=True, center_around_mean=True):
+# Number of dataset rows processed at a time by the centering, covariance and projection kernels.
+# Peak scratch memory of those kernels is CHUNK_ROWS times the number of features.
+CHUNK_ROWS = 4096
+
+def getComputeType(i_dataset, dtype=None):
+    '''
+    Returns the floating point type the kernels of this module compute with. Float32 datasets
+    (such as the data tables of SigQCUnitDataFile) are kept in single precision, anything else
+    is computed in double precision unless dtype is given.
+    '''
+    if (dtype is not None):
+        return np.dtype(dtype)
+    if (np.asarray(i_dataset).dtype == np.float32):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+def getCenteredChunks(i_dataset, i_means=None, i_stddev=None, chunk_rows=CHUNK_ROWS, dtype=None):
+    '''
+    Generator yielding consecutive row blocks of the dataset centered around the given means
+    (and divided by the given standard deviations). Every block is written into one reused
+    scratch buffer, so a yielded block is only valid until the next one is requested.
+
+    Inputs
+    ------
+        i_dataset - 2D array-like with units in rows and features in columns.
+        i_means - (Optional) 1D array-like of the means to subtract from each column. If None,
+            the dataset is not centered.
+        i_stddev - (Optional) 1D array-like of standard deviations to divide each column by.
+        chunk_rows - (Optional) Maximum number of rows per block. Defaults to CHUNK_ROWS.
+        dtype - (Optional) Floating point type of the blocks. Defaults to getComputeType().
+
+    Outputs
+    -------
+        Yields tuples of (first row, last row + 1, block) where the block is a 2D numpy array.
+    '''
+    dtype = getComputeType(i_dataset, dtype)
+    n_rows, n_cols = np.shape(i_dataset)
+    scratch = np.empty((min(chunk_rows, n_rows), n_cols), dtype=dtype)
+    for start in range(0, n_rows, chunk_rows):
+        stop = min(start+chunk_rows, n_rows)
+        block = scratch[:stop-start]
+        if (i_means is not None):
+            np.subtract(i_dataset[start:stop], i_means, out=block, casting='unsafe')
+        else:
+            block[...] = i_dataset[start:stop]
+        if (i_stddev is not None):
+            np.divide(block, i_stddev, out=block, casting='unsafe')
+        yield start, stop, block
+
+def getColumnStats(i_dataset, ddof=1, chunk_rows=CHUNK_ROWS, dtype=None):
+    '''
+    Calculates the mean and standard deviation of each column of the dataset in row blocks,
+    without allocating a centered copy of the dataset.
+
+    Outputs
+    -------
+        Returns a tuple containing the column means and standard deviations as 1D numpy arrays.
+    '''
+    dtype = getComputeType(i_dataset, dtype)
+    n_rows = np.shape(i_dataset)[0]
+    means = np.mean(i_dataset, axis=0, dtype=np.float64)
+    sumsq = np.zeros(len(means))
+    for start, stop, block in getCenteredChunks(i_dataset, means, None, chunk_rows, dtype):
+        sumsq += np.einsum('ij,ij->j', block, block)
+    std = np.sqrt(sumsq/(n_rows-ddof))
+    return means.astype(dtype), std.astype(dtype)
+
+def getCovariance(i_dataset, corr_matrix=False, scale_by_nrows=True, center_around_mean=True, out=None, chunk_rows=CHUNK_ROWS, dtype=None):
     ''' 
     Returns the covariance matrix (or correlation matrix if specified) of the dataset as a numpy array
         
@@ -46,6 +113,11 @@ def getCovariance(i_dataset, corr_matrix=False, scale_by_nrows=True, center_arou
         center_around_mean - (Optional) Boolean that tells the method
             whether to subtract the means from the dataset to standardize
             them. Defaults to true.
+        out - (Optional) Square 2D numpy array of the compute type to write the result into.
+            A Fortran ordered buffer is updated in place without any copy.
+        chunk_rows - (Optional) Number of rows accumulated at a time. Defaults to CHUNK_ROWS.
+        dtype - (Optional) Floating point type to compute with. Defaults to float32 for
+            float32 datasets and float64 otherwise.
 
     Outputs
     -------
@@ -53,26 +125,45 @@ def getCovariance(i_dataset, corr_matrix=False, scale_by_nrows=True, center_arou
         dataset. Unless changed with optional parameters, this matrix
         will be scaled by the number of rows and centered around the mean.
     '''    
+    dtype = getComputeType(i_dataset, dtype)
+    n_rows, n_cols = np.shape(i_dataset)
+    means = None
+    std = None
     if (center_around_mean):
-        means = np.array(np.mean(i_dataset,axis=0)).reshape((1,len(i_dataset[0,:])))
-        ones = np.ones((len(i_dataset[:,0]),1))
-        means_prime = np.dot(ones, means)
-        a = i_dataset - means_prime
+        means, std = getColumnStats(i_dataset, ddof=1, chunk_rows=chunk_rows, dtype=dtype)
 
         # If correlation matrix is preferred, divide by standard dev.
-        if (corr_matrix):
-            std = np.std(a ,axis=0, ddof=1)
-            a = a/std
-    else:
-        a = i_dataset
-        
-    dotresult = np.dot(a.T,a)
-    
-    if (scale_by_nrows):
-        cov_matrix = dotresult/(len(i_dataset[:,0])-1)
-    else:
-        cov_matrix = dotresult
-    return cov_matrix
+        if not (corr_matrix):
+            std = None
+
+    with sigqc_instrument.span("pca.covariance", rows=n_rows, features=n_cols, corr_matrix=corr_matrix):
+        if (out is None):
+            out = np.zeros((n_cols, n_cols), dtype=dtype, order='F')
+        else:
+            out[...] = 0
+        cov_matrix = out if (out.flags.f_contiguous) else np.asfortranarray(out)
+
+        # Accumulate the upper triangle of A.T A one block of rows at a time
+        syrk = blas.get_blas_funcs('syrk', dtype=dtype)
+        for start, stop, block in getCenteredChunks(i_dataset, means, std, chunk_rows, dtype):
+            cov_matrix = syrk(1.0, block.T, beta=1.0, c=cov_matrix, trans=0, lower=0, overwrite_c=1)
+
+        # Mirror the upper triangle into the lower triangle, a few columns at a time
+        step = 256
+        lower = np.tril_indices(step,-1)
+        for start in range(0, n_cols, step):
+            stop = min(start+step, n_cols)
+            cov_matrix[start:stop,:start] = cov_matrix[:start,start:stop].T
+            block = cov_matrix[start:stop,start:stop]
+            if (stop-start < step):
+                lower = np.tril_indices(stop-start,-1)
+            block[lower] = block.T[lower]
+
+        if (scale_by_nrows):
+            cov_matrix /= (n_rows-1)
+    if (cov_matrix is not out):
+        out[...] = cov_matrix
+    return out
 
 def getEigen(i_array):
     '''
@@ -91,11 +182,81 @@ def getEigen(i_array):
         the corresponding eigenvectors as a 2D numpy array. They are returned together
         respectively within a tuple.
     '''
-    evals, evecs = np.linalg.eigh(i_array, UPLO='U')
-    eigen = sortEigen(evals, evecs)
+    with sigqc_instrument.span("pca.eigensolve", method="covariance", size=len(i_array)):
+        evals, evecs = np.linalg.eigh(i_array, UPLO='U')
+        eigen = sortEigen(evals, evecs)
 
     return eigen
 
+def getEigenFromData(i_dataset, corr_matrix=False, scale_by_nrows=True, center_around_mean=True, method="auto"):
+    '''
+    Calculates the eigenvalues and eigenvectors of the covariance matrix (or correlation
+    matrix if specified) of the dataset without necessarily forming that matrix. When the
+    dataset has fewer units (rows) than features (columns), the covariance matrix has at most
+    as many nonzero eigenvalues as there are units, so the decomposition is carried out on
+    the much smaller units-by-units Gram matrix (or a thin SVD) instead.
+
+    Inputs
+    ------
+        i_dataset - Array type which contains the dataset.
+        corr_matrix - (Optional) Boolean specifying whether to use the correlation
+            matrix instead of the covariance matrix. Defaults to false.
+        scale_by_nrows - (Optional) Boolean that tells the method whether or not to
+            divide by the number of rows less one, exactly as in getCovariance().
+            Defaults to true.
+        center_around_mean - (Optional) Boolean that tells the method whether to
+            subtract the means from the dataset. Defaults to true.
+        method - (Optional) String selecting the decomposition. "covariance" forms the
+            features-by-features covariance matrix as getCovariance() and getEigen() do,
+            "gram" decomposes the units-by-units Gram matrix, and "svd" uses a thin
+            singular value decomposition of the dataset. Defaults to "auto", which uses
+            "gram" whenever there are fewer units than features and "covariance" otherwise.
+
+    Outputs
+    -------
+        Returns the sorted (in descending order) eigenvalues as a 1D numpy array and the
+        corresponding eigenvectors as the columns of a 2D numpy array, together within a
+        tuple. The "svd" method returns only the leading min(units, features) eigenpairs
+        and the "gram" method only those with a nonzero eigenvalue; all remaining
+        eigenvalues of the covariance matrix are zero.
+        Memory use of these methods is proportional to units times features.
+    '''
+    a = np.asarray(i_dataset)
+    if not np.issubdtype(a.dtype, np.floating):
+        a = a.astype(float)
+    n_rows, n_cols = a.shape
+
+    method = method.lower()
+    if (method == "auto"):
+        method = "gram" if (n_rows < n_cols) else "covariance"
+
+    if (method == "covariance"):
+        cov_matrix = getCovariance(a, corr_matrix=corr_matrix, scale_by_nrows=scale_by_nrows, center_around_mean=center_around_mean)
+        return getEigen(cov_matrix)
+    elif (method not in ("gram", "svd")):
+        raise Exception("Error: Please provide a valid method. Valid options include 'auto', 'covariance', 'gram' and 'svd'")
+
+    if (center_around_mean):
+        a = a - np.mean(a, axis=0)
+        if (corr_matrix):
+            a = a/np.std(a, axis=0, ddof=1)
+    scale = (n_rows-1) if (scale_by_nrows) else 1
+
+    with sigqc_instrument.span("pca.eigensolve", method=method, rows=n_rows, features=n_cols):
+        if (method == "svd"):
+            u, s, vt = np.linalg.svd(a, full_matrices=False)
+            evals = (s**2)/scale
+            evecs = vt.T
+        else:
+            # Eigenvectors of A.T A follow from those of A A.T as A.T u / sqrt(lambda).
+            gram = np.dot(a, a.T)
+            gvals, gvecs = sortEigen(*np.linalg.eigh(gram, UPLO='U'))
+            nonzero = gvals > gvals[0]*max(n_rows, n_cols)*np.finfo(a.dtype).eps
+            roots = np.sqrt(gvals[nonzero])
+            evecs = np.dot(a.T, gvecs[:,nonzero])/roots
+            evals = gvals[nonzero]/scale
+    return evals, evecs
+
 def sortEigen(i_evals, i_evects):
     '''
     Sorts eigenvalues and associated eigenvectors from highest to lowest.
@@ -111,7 +272,7 @@ def sortEigen(i_evals, i_evects):
     eigenvectors = i_evects[:,indeces] 
     return eigenvalues, eigenvectors
 
-def getPCScores(i_dataset, i_evals, i_evects, n_pcs=None):
+def getPCScores(i_dataset, i_evals, i_evects, n_pcs=None, i_means=None, i_stddev=None, out=None, chunk_rows=CHUNK_ROWS, dtype=None):
     '''
     Calculates and returns principal component scores for each unit in the 
     dataset as a 2D numpy array. 
@@ -123,6 +284,15 @@ def getPCScores(i_dataset, i_evals, i_evects, n_pcs=None):
         i_evects - Associated eigenvectors with i_evals
         n_pcs - (Optional) Number of principal components to be calculate PC Scores
             with. Will default to using all PCs in calculation.
+        i_means - (Optional) Means to center the dataset around, e.g. the average vector of a
+            reference dataset. Defaults to the column means of i_dataset.
+        i_stddev - (Optional) Standard deviations to scale the centered dataset by when the
+            eigenvectors come from a correlation matrix.
+        out - (Optional) 2D numpy array of the compute type with one row per unit and n_pcs
+            columns to write the scores into.
+        chunk_rows - (Optional) Number of rows projected at a time. Defaults to CHUNK_ROWS.
+        dtype - (Optional) Floating point type to compute with. Defaults to float32 for
+            float32 datasets and float64 otherwise.
 
     Outputs
     -------
@@ -130,20 +300,12 @@ def getPCScores(i_dataset, i_evals, i_evects, n_pcs=None):
         as a 2D numpy array. Rows denote indeces for dataset units. 
         Columns denote PC scores associated with those units.
     '''
-    # If unspecified, use all PCs.
-    if n_pcs == None:
-        n_pcs = len(i_evects[0,:])+1
-
-    pc_scores = np.zeros((n_pcs,len(i_dataset[:,0])))
-    means = np.array(np.mean(i_dataset,axis=0)).reshape((1,len(i_dataset[0,:])))
-    ones = np.ones((len(i_dataset[:,0]),1))
-    means_prime = np.dot(ones, means)
-    a = i_dataset - means_prime
-    pc_scores = np.dot(a,i_evects)
+    dtype = getComputeType(i_dataset, dtype)
+    if (i_means is None):
+        i_means = np.mean(i_dataset, axis=0, dtype=dtype)
+    return _project(i_dataset, i_evects, n_pcs, i_means, i_stddev, out, chunk_rows, dtype)
 
-    return pc_scores
-
-def getPCScoresCorr(i_centered_dataset, i_evals, i_evects, n_pcs=None):
+def getPCScoresCorr(i_centered_dataset, i_evals, i_evects, n_pcs=None, out=None, chunk_rows=CHUNK_ROWS, dtype=None):
     '''
     Calculates and returns principal component scores for each unit in the 
     dataset as a 2D numpy array using the correlation matrix of the dataset
@@ -156,20 +318,35 @@ def getPCScoresCorr(i_centered_dataset, i_evals, i_evects, n_pcs=None):
         i_evects - Associated eigenvectors with i_evals
         n_pcs - (Optional) Number of principal components to be calculate PC Scores
             with. Will default to using all PCs in calculation.
+        out - (Optional) 2D numpy array to write the scores into (see getPCScores()).
+        chunk_rows - (Optional) Number of rows projected at a time. Defaults to CHUNK_ROWS.
+        dtype - (Optional) Floating point type to compute with.
     Outputs
     -------
         Returns principal component scores for each unit in the dataset
         as a 2D numpy array. Rows denote indeces for dataset units. 
         Columns denote PC scores associated with those units.
     '''
+    dtype = getComputeType(i_centered_dataset, dtype)
+    return _project(i_centered_dataset, i_evects, n_pcs, None, None, out, chunk_rows, dtype)
+
+def _project(i_dataset, i_evects, n_pcs, i_means, i_stddev, out, chunk_rows, dtype):
+    '''
+    Projects the (centered) dataset onto the first n_pcs eigenvectors in blocks of rows.
+    '''
     # If unspecified, use all PCs.
+    evecs = np.asarray(i_evects)
     if n_pcs == None:
-        n_pcs = len(i_evects[0,:])+1
-
-    pc_scores = np.zeros((n_pcs,len(i_centered_dataset[:,0])))
-    pc_scores = np.dot(i_centered_dataset,i_evects)
+        n_pcs = len(evecs[0,:])
+    evecs = np.ascontiguousarray(evecs[:,:n_pcs], dtype=dtype)
 
-    return pc_scores
+    n_rows = np.shape(i_dataset)[0]
+    if (out is None):
+        out = np.empty((n_rows, n_pcs), dtype=dtype)
+    with sigqc_instrument.span("pca.project", rows=n_rows, n_pcs=n_pcs):
+        for start, stop, block in getCenteredChunks(i_dataset, i_means, i_stddev, chunk_rows, dtype):
+            np.dot(block, evecs, out=out[start:stop])
+    return out
 
 def getTotalVariance(i_array):
     '''
@@ -186,21 +363,13 @@ def getTotalVariance(i_array):
     -------
         Returns the total variance of a dataset as a float.
     '''
-    isCovMatrix = False
-    variance = None
-
-    if len(i_array[:,0]) == len(i_array[0,:]):
-        for i in range(len(i_array[:,0])):
-            for j in range(len(i_array[0,:])):
-                if i_array[i,j] != i_array[j,i]:
-                    break
-                else:
-                    isCovMatrix = True
+    a = np.asarray(i_array)
+    isCovMatrix = (a.shape[0] == a.shape[1]) and np.array_equal(a, a.T)
     if isCovMatrix:
-        variance = sum(i_array.diagonal())
+        variance = np.trace(a)
     else:
-        cov = getCovariance(i_array)
-        variance = sum(cov.diagonal())
+        # The trace of the covariance matrix is the sum of the column variances.
+        variance = np.sum(np.var(a, axis=0, ddof=1))
     return variance
 
 def getCumPropVar(i_dataset, i_evals, i_evects, n_pcs=None):
@@ -227,16 +396,80 @@ def getCumPropVar(i_dataset, i_evals, i_evects, n_pcs=None):
     if n_pcs == None:
         n_pcs = len(i_evects[0,:])
     tot_var = getTotalVariance(i_dataset)
-    cumu_prop = 0
-    for val in i_evals[:n_pcs]:
-        cumu_prop += val/tot_var
-    return cumu_prop
+    return np.sum(i_evals[:n_pcs])/tot_var
 
-def plotPCScores(i_pcscores, i_header=None, o_path="", o_name="PCScores", n_pcs=2):
+class SigQCVarianceProfile:
+    '''
+    The SigQCVarianceProfile class holds the proportion of variance explained by each principal
+    component, and the cumulative proportion explained by the first n principal components, for
+    a single eigensystem. Everything is computed once from the eigenvalues on construction, so
+    querying many PC counts costs nothing more than indexing an array.
+    
+    Example:
+        evals, evecs = getEigenFromData(dataset)
+        profile = SigQCVarianceProfile(evals, getTotalVariance(dataset))
+        cumulative = profile.getCumPropVar()
+        n_pcs = profile.getPCCountFor(0.95)
     '''
-    Plots matplotlib.pyplot objects (figures) depicting
-    the principal component scores for the number of principal
-    components specified.
+    def __init__(self, i_evals, i_totalvariance=None):
+        '''
+        Constructor for an instance of the SigQCVarianceProfile class.
+        
+        Input:
+            i_evals - 1D array-like of eigenvalues sorted in descending order (see getEigen()).
+            i_totalvariance - (Optional) Total variance of the dataset (see getTotalVariance()).
+                              Defaults to the sum of the eigenvalues, which is only correct when
+                              every nonzero eigenvalue of the system is given.
+        '''
+        self._evals = np.asarray(i_evals, dtype=float)
+        if (i_totalvariance is None):
+            i_totalvariance = np.sum(self._evals)
+        self._totalvariance = float(i_totalvariance)
+        self._proportion = self._evals/self._totalvariance
+        self._cumulative = np.cumsum(self._proportion)
+    
+    def __len__(self):
+        return len(self._evals)
+    
+    def getEigenvalues(self):
+        '''
+        Returns the eigenvalues of the profile as a 1D numpy array.
+        '''
+        return self._evals
+    
+    def getTotalVariance(self):
+        '''
+        Returns the total variance the proportions are relative to as a float.
+        '''
+        return self._totalvariance
+    
+    def getPropVar(self, n_pcs=None):
+        '''
+        Returns the proportion of variance explained by each of the first n_pcs principal
+        components as a 1D numpy array. Defaults to all principal components.
+        '''
+        return self._proportion[:n_pcs]
+    
+    def getCumPropVar(self, n_pcs=None):
+        '''
+        Returns the cumulative proportion of variance explained by the first 1, 2, ..., n_pcs
+        principal components as a 1D numpy array. Defaults to all principal components.
+        '''
+        return self._cumulative[:n_pcs]
+    
+    def getPCCountFor(self, i_proportion):
+        '''
+        Returns the smallest number of principal components whose cumulative proportion of
+        variance reaches i_proportion (e.g. 0.95). Returns the number of eigenvalues held
+        if the proportion is never reached.
+        '''
+        count = np.searchsorted(self._cumulative, i_proportion) + 1
+        return int(min(count, len(self._cumulative)))
+
+def plotPCScores(i_pcscores, i_header=None, o_path="", o_name="PCScores", n_pcs=2, workers=1, mode="scatter", i_evals=None):
+    '''
+    Plots figures depicting the principal component scores for the
+    number of principal components specified (see sigqc_render).
 
     Inputs
     ------
@@ -250,6 +483,13 @@ def plotPCScores(i_pcscores, i_header=None, o_path="", o_name="PCScores", n_pcs=
             as axes, and another figure displaying PC scores using
             PCs 2 and 3 as axes). If none specified, will plot the first
             two PCs as axes.
+        workers - (Optional) Number of worker processes rendering the
+            plots. Defaults to 1 (render in this process).
+        mode - (Optional) "scatter" (default), "density" or "auto". Density plots
+            bin the scores and only draw units outside a T-squared contour as points,
+            for large numbers of units (see sigqc_render.renderPCScores()).
+        i_evals - (Optional) Reference eigenvalues defining the T-squared contour
+            of density plots.
 
     Outputs
     -------
@@ -257,18 +497,10 @@ def plotPCScores(i_pcscores, i_header=None, o_path="", o_name="PCScores", n_pcs=
         to store all figures.
         Does not explicitly return anything.
     '''
-    for i in range(n_pcs):
-        plt.figure(i, figsize=(6,4))
-        plt.grid()
-        plt.scatter(i_pcscores[:,i],i_pcscores[:,i+1], edgecolor="black", alpha=0.6)
-        plt.xlabel("PC"+str(i+1))
-        plt.ylabel("PC"+str(i+2))
-        plt.title(i_header)
-        plt.legend()
-        plt.savefig(o_path+o_name+str(i)+"-"+str(i+1))
+    sigqc_render.renderPCScores(i_pcscores, i_header, n_pcs, o_path, o_name, workers=workers, mode=mode, i_evals=i_evals)
     return
 
-def plotCumPropVar(i_dataset, i_evals, i_evects, o_path="", o_name="VarianceExplained", n_pcs=2, col="green"):
+def plotCumPropVar(i_dataset, i_evals, i_evects, o_path="", o_name="VarianceExplained", n_pcs=2, col="green", i_profile=None):
     '''
     Calculates and plots the cumulative proportion of variance explained
     by the first n principal components.
@@ -284,6 +516,8 @@ def plotCumPropVar(i_dataset, i_evals, i_evects, o_path="", o_name="VarianceExpl
             calculation. If none specified, all PCs are included.
         col - (Optional) String denoting the bar graph color. Will be green
             if none specified.
+        i_profile - (Optional) A SigQCVarianceProfile to plot. When given, i_dataset,
+            i_evals and i_evects are not used and may be None.
 
     Outputs
     -------
@@ -291,22 +525,12 @@ def plotCumPropVar(i_dataset, i_evals, i_evects, o_path="", o_name="VarianceExpl
         the first n_pcs using o_path as the file path and o_name as the file name.
         Does not explicitly return anything.
     '''
-
-    pc_prop = np.zeros((n_pcs))
-    for j in range(1,n_pcs+1):
-        pc_prop[j-1] = getCumPropVar(i_dataset,i_evals,i_evects,n_pcs=j)
-
-    xlabs = []
-    for i in range(1,n_pcs+1):
-        xlabs.append('PC'+str(i))
-    
-    plt.figure(1)
-    plt.bar(list(range(1,n_pcs+1)),pc_prop,color=col)
-    plt.xticks(range(1,n_pcs+1,1),xlabs,size=8.0)
-    plt.yticks(size=8.0)
-    plt.ylabel("Proportion of Total Variance",size=8.0)
-    plt.title("Cumulative Proportion of Variance Explained by Principal Components",size=10)
-    plt.savefig(o_path+o_name)
+    if (i_profile is None):
+        i_profile = SigQCVarianceProfile(i_evals, getTotalVariance(i_dataset))
+    if (n_pcs == None):
+        n_pcs = len(i_profile)
+    pc_prop = i_profile.getCumPropVar(n_pcs)
+    sigqc_render.renderCumPropVar(pc_prop, o_path+o_name, col)
     return
 
 def plotPCBoxPlots(i_pcscores_T, o_path="", o_name="Boxplot"):
@@ -326,11 +550,5 @@ def plotPCBoxPlots(i_pcscores_T, o_path="", o_name="Boxplot"):
         Saves the boxplot of Principal Components in 'o_path' saved as 'o_name'.
         Does not return anything explicitly.
     '''
-    fig = plt.figure()
-    plt.grid()
-    plt.boxplot(i_pcscores_T, 0, 'bD', 0)
-    plt.ylabel("PC")
-    plt.xlabel("PC Score")
-    plt.title("Boxplot of PC Scores")
-    plt.savefig(o_path+o_name)
+    sigqc_render.renderPCBoxPlots(i_pcscores_T, o_path+o_name)
     return
@@ -1,4 +1,5 @@
 import numpy as np
+from sigqc import sigqc_memory
 
 class SigQCTestCaseID(object):
     '''
@@ -50,6 +51,25 @@ class SigQCTestCaseID(object):
         '''
         return SigQCTestCaseID(self._productname, self._testname, self._casename, self._exact)
     
+    def GetFeatureKey(self, i_domain=None):
+        '''
+        Returns a string that uniquely identifies one feature (column) of analysis data derived
+        from the test case.  The key is the "product.test.case" path of the identifier, followed
+        by an "@" and the domain value when the test case has one value per domain point.
+        
+        Input:
+            i_domain - (Optional) Domain value (x-value) of the feature.  If None, the key
+                       identifies the single value of the test case.
+        
+        Example:
+            x = SigQCTestCaseID("X15", "PHASE1", "RL Start Click")
+            key = x.GetFeatureKey("1000.0")    # "X15.PHASE1.RL Start Click@1000.0"
+        '''
+        key = SigQCTestCaseID(self._productname, self._testname, self._casename, True).__str__()
+        if (i_domain is not None):
+            key = key + "@" + str(i_domain).strip()
+        return key
+
     def GetCaseName(self):
         '''
         Return the string representing the targeted test case name.
@@ -330,6 +350,13 @@ class SigQCTestCaseGroup(object):
     
     def __getitem__(self, i_index):
         return self._identifiers[i_index]
+
+    def GetMemoryUsage(self):
+        '''
+        Get the memory held by the group and its test case identifiers (see
+        sigqc_memory.getMemoryUsage()).
+        '''
+        return sigqc_memory.getMemoryUsage(self)
     
     def __setitem__(self, i_index, i_value):
         if (i_index < self.Count()):
@@ -0,0 +1,1080 @@
+import numpy as np
+import csv
+import os
+import io
+import json
+import struct
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from sigqc import sigqc_asciitestcase
+from sigqc import sigqc_unitdata
+from sigqc import sigqc_pca
+from sigqc import sigqc_spc
+from sigqc import sigqc_instrument
+from sigqc import sigqc_memory
+
+#########################################################################################################################
+# sigqc_referencemodel.py
+#
+# This module encompasses the SigQCReferenceModel class, which holds the average vector,
+# standard deviations, eigenvalues and eigenvectors of a reference (good unit) dataset as
+# written by sigqc_implementpca.storeReferenceData(). A model is loaded once and can then
+# score any number of SigQC export files, optionally across a pool of worker processes.
+#
+# Besides the .csv reference data format, models can be written in a versioned binary format
+# (see write()): an 8 byte magic string, a 4 byte little-endian format version, a 4 byte
+# header length and a JSON header describing each array, followed by the raw arrays aligned
+# to 64 bytes. Binary models can be memory-mapped, so every process scoring against the same
+# model file shares one physical copy of its eigenvectors.
+#
+# Example Usage:
+#  model = SigQCReferenceModel("[full path here]\\ReferenceData.csv")
+#  model.write("[full path here]\\ReferenceData.sqcref", o_format="binary", dtype=np.float32, n_pcs=50)
+#  model = SigQCReferenceModel("[full path here]\\ReferenceData.sqcref", mmap=True)
+#
+#  ### Score a single file ###
+#  serialnumbers, headers, pcscores = model.scoreFile("[test file path]", input_type="ascii")
+#
+#  ### Score a full day of exports on four worker processes ###
+#  for filename, serialnumbers, pcscores in model.scoreMany(testfiles, workers=4, o_path="[output path]"):
+#      print(filename, len(serialnumbers))
+#
+#########################################################################################################################
+
+# Identification of the binary reference model format
+BINARY_MAGIC = b"SIGQCREF"
+BINARY_VERSION = 1
+BINARY_ALIGNMENT = 64
+
+def isBinaryModelFile(i_filename):
+    '''
+    Returns True if the file starts with the magic string of the binary reference model format.
+    '''
+    with open(i_filename, 'rb') as f:
+        return (f.read(len(BINARY_MAGIC)) == BINARY_MAGIC)
+
+def readBinaryFile(i_filename, mmap=False):
+    '''
+    Reads the header and arrays of a file in the binary format described in the module header.
+
+    Inputs
+    ------
+        i_filename - Path to the binary file.
+        mmap - (Optional) Boolean specifying whether the arrays are memory-mapped (read-only)
+            instead of read into memory. Defaults to False.
+
+    Outputs
+    -------
+        Returns a tuple containing the header as a dictionary and a dictionary of the named arrays.
+    '''
+    with open(i_filename, 'rb') as f:
+        prefix = f.read(len(BINARY_MAGIC)+8)
+        if not (prefix.startswith(BINARY_MAGIC)):
+            raise Exception("Error: {} is not a binary SigQC reference file".format(i_filename))
+        version, headerlength = struct.unpack('<II', prefix[len(BINARY_MAGIC):])
+        if (version > BINARY_VERSION):
+            raise Exception("Error: Reference model file version {} is newer than the supported version {}".format(version, BINARY_VERSION))
+        header = json.loads(f.read(headerlength).decode('utf-8'))
+        arrays = {}
+        for name, info in header["arrays"].items():
+            dtype = np.dtype(info["dtype"])
+            shape = tuple(info["shape"])
+            if (mmap):
+                arrays[name] = np.memmap(i_filename, dtype=dtype, mode='r', offset=info["offset"], shape=shape)
+            else:
+                f.seek(info["offset"])
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return header, arrays
+
+def writeBinaryFile(o_filename, i_header, i_arrays):
+    '''
+    Writes a file in the binary format described in the module header.
+
+    Inputs
+    ------
+        o_filename - Path of the file to be written.
+        i_header - Dictionary of JSON serializable metadata. The format version and the array
+            layout are added to it.
+        i_arrays - List of (name, numpy array) tuples to be stored in that order.
+    '''
+    header = dict(i_header)
+    header["version"] = BINARY_VERSION
+    header["arrays"] = {}
+    arrays = [(name, np.ascontiguousarray(array)) for name, array in i_arrays]
+
+    # Array offsets depend on the header length, which depends on the offsets, so grow the
+    # space reserved for the header until the header fits in it.
+    prefixlength = len(BINARY_MAGIC)+8
+    headerlength = BINARY_ALIGNMENT*8
+    while True:
+        offset = prefixlength + headerlength
+        for name, array in arrays:
+            offset = -(-offset//BINARY_ALIGNMENT)*BINARY_ALIGNMENT
+            header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += array.nbytes
+        headerbytes = json.dumps(header).encode('utf-8')
+        if (len(headerbytes) <= headerlength):
+            break
+        headerlength *= 2
+    headerbytes = headerbytes.ljust(headerlength)
+
+    with open(o_filename, 'wb') as f:
+        f.write(BINARY_MAGIC)
+        f.write(struct.pack('<II', BINARY_VERSION, headerlength))
+        f.write(headerbytes)
+        for name, array in arrays:
+            f.seek(header["arrays"][name]["offset"])
+            array.tofile(f)
+
+def readDataset(i_filename, input_type="ascii", use_cache=False, return_keys=False, row_filter=None):
+    '''
+    Parses a SigQC export file and stacks all of its test case features into a single dataset.
+
+    Inputs
+    ------
+        i_filename - String containing the path to the file to be parsed.
+        input_type - (Optional) String specifying the file input type. Currently, the SigQC
+            ASCII Test Case Files and SigQC Unit Data files are supported as "ascii" and "unit"
+            respectively. The type defaults to "ascii".
+        use_cache - (Optional) Boolean specifying whether the parsed file is taken from (and
+            stored in) the module cache of sigqc_cache. Defaults to False.
+        return_keys - (Optional) Boolean specifying whether the feature keys of the dataset
+            columns are returned as a fourth item. Defaults to False.
+        row_filter - (Optional) Function called as row_filter(serialnumber, timestamp) for each
+            unit while the file is parsed; units for which it returns False are skipped. Files
+            parsed with a row filter are not cached.
+
+    Outputs
+    -------
+        Returns a tuple containing:
+        1) The serial numbers of the units corresponding to the rows of the dataset
+        2) The SigQCAsciiHeader objects (for "ascii") or the case names (for "unit") of the file
+        3) A 2-D numpy array with units in rows and test case features in columns
+        4) If return_keys is True, a list of the feature keys of the columns (see
+           sigqc_primitives.SigQCTestCaseID.GetFeatureKey())
+    '''
+    if (row_filter is not None):
+        use_cache = False
+    if (use_cache):
+        # Imported here because sigqc_cache itself builds on this module
+        from sigqc import sigqc_cache
+    if (input_type.lower() == "ascii"):
+        if (use_cache):
+            dataobj = sigqc_cache.getAsciiTestCaseFile(i_filename)
+        else:
+            dataobj = sigqc_asciitestcase.SigQCAsciiTestCaseFile(i_filename, i_rowfilter=row_filter)
+        headers = dataobj.getHeaders()
+        serialnumbers = dataobj.getMatrixAt(0).getSerialNumbers()
+        # The test cases are stacked side by side, so every section must hold the same units
+        for i in range(1, dataobj.getTestCaseCount()):
+            if (dataobj.getMatrixAt(i).getSerialNumbers() != serialnumbers):
+                raise Exception("Error: Test case {} of {} does not hold the same units as the first test case".format(i+1, i_filename))
+        if (len(serialnumbers) == 0):
+            # Every unit was filtered out
+            matrices = [np.zeros((0,len(dataobj.getMatrixAt(i).getXValues()))) for i in range(dataobj.getTestCaseCount())]
+        else:
+            matrices = [dataobj.getMatrixDataAt(i) for i in range(dataobj.getTestCaseCount())]
+        with sigqc_instrument.span("dataset.hstack", cases=len(matrices)) as span:
+            dataset = np.hstack(matrices) if (len(matrices) > 1) else matrices[0]
+            span.set(rows=dataset.shape[0], features=dataset.shape[1])
+        sigqc_instrument.count("features", dataset.shape[1])
+        if (return_keys):
+            keys = dataobj.getFeatureKeys()
+    elif (input_type.lower() == "unit"):
+        if (use_cache):
+            dataobj = sigqc_cache.getUnitDataFile(i_filename)
+        else:
+            dataobj = sigqc_unitdata.SigQCUnitDataFile(i_filename, i_rowfilter=row_filter)
+        headers = dataobj.GetCaseNames()
+        serialnumbers = dataobj.GetSerialNumbers()
+        dataset = np.array(dataobj.GetCaseDataTable())
+        if (return_keys):
+            keys = dataobj.GetFeatureKeys()
+    else:
+        raise Exception("Error: Please provide a valid input_type. Valid options include 'ascii' and 'unit'")
+    if (return_keys):
+        return serialnumbers, headers, dataset, keys
+    return serialnumbers, headers, dataset
+
+def getFeatureIndex(i_refkeys, i_datakeys):
+    '''
+    Maps the feature keys of a reference onto the columns of a dataset.
+
+    Inputs
+    ------
+        i_refkeys - List of the feature keys of the reference, in reference column order.
+        i_datakeys - List of the feature keys of the dataset columns.
+
+    Outputs
+    -------
+        Returns a tuple containing:
+        1) A 1D numpy array of integers holding, for each reference feature, the index of the
+           dataset column with the same key, or -1 if the dataset lacks the feature
+        2) A list of the dataset keys that are not part of the reference
+    '''
+    columns = {}
+    for j, key in enumerate(i_datakeys):
+        columns.setdefault(key, j)
+    index = np.array([columns.get(key, -1) for key in i_refkeys], dtype=np.intp)
+    refset = set(i_refkeys)
+    extra = [key for key in i_datakeys if key not in refset]
+    return index, extra
+
+def alignFeatures(i_dataset, i_index, i_fill=None):
+    '''
+    Gathers and reorders the columns of a dataset into reference order with a single fancy
+    indexing pass (see getFeatureIndex()). Missing features (index -1) are set to i_fill.
+
+    Inputs
+    ------
+        i_dataset - 2D array-like with units in rows.
+        i_index - Column index of each reference feature as returned by getFeatureIndex().
+        i_fill - (Optional) 1D array-like of values, one per reference feature, used for the
+            missing features. Defaults to NaN.
+
+    Outputs
+    -------
+        Returns a 2D numpy array with units in rows and the reference features in columns.
+    '''
+    dataset = np.asarray(i_dataset)
+    missing = (i_index < 0)
+    aligned = np.take(dataset, np.where(missing, 0, i_index), axis=1)
+    if (np.any(missing)):
+        if not np.issubdtype(aligned.dtype, np.floating):
+            aligned = aligned.astype(float)
+        aligned[:,missing] = np.nan if (i_fill is None) else np.asarray(i_fill)[missing]
+    return aligned
+
+def _quoteSerial(i_serial):
+    '''
+    Quotes a serial number for a CSV field if it contains a delimiter, quote or line break.
+    '''
+    text = str(i_serial)
+    if any(c in text for c in ',"\r\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+def getScoresFilenames(o_filename):
+    '''
+    Returns the names of the files written by writePCScores() with o_format="npy": the .npy
+    file of the scores and the .csv sidecar file of the serial numbers.
+    '''
+    base = os.path.splitext(o_filename)[0]
+    return base+".npy", base+"_Serials.csv"
+
+def writePCScores(o_filename, i_serialnumbers, i_pcscores, append=False, o_format="csv", precision=None, chunk_rows=sigqc_pca.CHUNK_ROWS):
+    '''
+    Writes a spreadsheet containing the PC scores of each unit with its serial number. Rows are
+    formatted and written in chunks, so memory use does not grow with the number of units.
+
+    Inputs
+    ------
+        o_filename - String containing the full path and name of the .csv file to be written.
+        i_serialnumbers - List of serial numbers corresponding to the rows of i_pcscores.
+        i_pcscores - 2D array-like of PC scores with units in rows.
+        append - (Optional) Boolean specifying whether the rows are appended to an existing
+            file, in which case no column header is written. Defaults to False.
+        o_format - (Optional) "csv" (default) writes a spreadsheet. "npy" writes the scores as
+            a numpy .npy file and the serial numbers to a one column .csv sidecar file, named
+            as returned by getScoresFilenames().
+        precision - (Optional) Number of significant digits of the scores in the .csv file.
+            Defaults to the shortest representation that reads back exactly (9 digits for
+            single precision scores).
+        chunk_rows - (Optional) Number of rows formatted at a time.
+    '''
+    pcscores = np.asarray(i_pcscores)
+    if (pcscores.ndim == 1):
+        pcscores = pcscores.reshape((len(pcscores), 1))
+    if (len(i_serialnumbers) != len(pcscores)):
+        raise Exception("Error: The number of serial numbers does not match the number of rows of PC scores")
+    if (o_format.lower() == "npy"):
+        _writeScoresNpy(o_filename, i_serialnumbers, pcscores, append)
+        return
+    elif (o_format.lower() != "csv"):
+        raise Exception("Error: Please provide a valid o_format. Valid options include 'csv' and 'npy'")
+
+    n_cols = np.shape(pcscores)[1]
+    if (precision is None):
+        precision = 9 if (pcscores.dtype == np.float32) else None
+    field = "%r" if (precision is None) else "%.{}g".format(int(precision))
+    rowformat = "%s" + ("," + field)*n_cols + "\n"
+
+    append = append and os.path.exists(o_filename)
+    with open(o_filename, 'a' if (append) else 'w', newline='') as f:
+        if not (append):
+            f.write(",".join(["Serial Number"] + [str(j) for j in range(1, n_cols+1)]) + "\n")
+        for start in range(0, len(pcscores), chunk_rows):
+            stop = min(start+chunk_rows, len(pcscores))
+            serials = [_quoteSerial(serial) for serial in i_serialnumbers[start:stop]]
+            rows = pcscores[start:stop].tolist()
+            f.write("".join([rowformat % (serial, *row) for serial, row in zip(serials, rows)]))
+
+def _writeScoresNpy(o_filename, i_serialnumbers, i_pcscores, append):
+    '''
+    Writes (or appends) PC scores to a .npy file and their serial numbers to a sidecar file.
+    '''
+    npyname, serialname = getScoresFilenames(o_filename)
+    pcscores = np.ascontiguousarray(i_pcscores)
+    if (append) and os.path.exists(npyname):
+        with open(npyname, 'r+b') as f:
+            version = np.lib.format.read_magic(f)
+            if (version == (1,0)):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            datastart = f.tell()
+            if (fortran) or (dtype != pcscores.dtype) or (shape[1:] != pcscores.shape[1:]):
+                raise Exception("Error: The PC scores do not match the layout of '{}'".format(npyname))
+
+            # Rewrite the header with the new row count in place; the header is padded, so
+            # its length does not change
+            header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False,
+                      "shape": (shape[0]+len(pcscores),) + tuple(shape[1:])}
+            buffer = io.BytesIO()
+            if (version == (1,0)):
+                np.lib.format.write_array_header_1_0(buffer, header)
+            else:
+                np.lib.format.write_array_header_2_0(buffer, header)
+            if (buffer.tell() != datastart):
+                raise Exception("Error: Cannot append to '{}' in place".format(npyname))
+            f.seek(0)
+            f.write(buffer.getvalue())
+            f.seek(0, os.SEEK_END)
+            pcscores.tofile(f)
+    else:
+        append = False
+        np.save(npyname, pcscores)
+
+    append = append and os.path.exists(serialname)
+    with open(serialname, 'a' if (append) else 'w', newline='') as f:
+        if not (append):
+            f.write("Serial Number\n")
+        f.write("".join([_quoteSerial(serial)+"\n" for serial in i_serialnumbers]))
+
+def readPCScores(i_filename):
+    '''
+    Reads PC scores written by writePCScores() in either format.
+
+    Outputs
+    -------
+        Returns a tuple containing the list of serial numbers and a 2D numpy array of the
+        PC scores with units in rows.
+    '''
+    npyname, serialname = getScoresFilenames(i_filename)
+    if (i_filename.lower().endswith(".npy")):
+        pcscores = np.load(npyname)
+        with open(serialname, 'r', newline='') as f:
+            serials = [row[0] for row in csv.reader(f)][1:]
+        return serials, pcscores
+    with open(i_filename, 'r', newline='') as f:
+        rows = list(csv.reader(f))[1:]
+    serials = [row[0] for row in rows]
+    pcscores = np.array([row[1:] for row in rows], dtype=float)
+    return serials, pcscores
+
+###################################
+# SigQCReferenceModel class
+###################################
+class SigQCReferenceModel:
+    '''
+    The SigQCReferenceModel class encapsulates the eigensystem of a reference dataset of known
+    good units along with the average vector and standard deviations needed to center (and
+    scale) test units before they are projected onto the reference eigenvectors.
+    '''
+    def __init__(self, i_filename=None, mmap=False):
+        '''
+        Constructor for an instance of the SigQCReferenceModel class. If a filename is
+        specified, the reference data file is read within this constructor.
+
+        Input:
+            i_filename - (Optional) Path to a reference data file written by
+                         sigqc_implementpca.storeReferenceData() or write().
+            mmap - (Optional) Boolean specifying whether the arrays of a binary model
+                   file are memory-mapped instead of read. Defaults to False.
+        '''
+        self._filename = i_filename
+        self._mmap = False
+        self._totalvariance = None
+        self._avgvector = None
+        self._stddev = None
+        self._corrmatrix = False
+        self._nunits = None
+        self._evals = None
+        self._evecs = None
+        self._featurekeys = None
+        self._missing = "error"
+        self._extra = "ignore"
+        self._indexcache = {}
+        if (self._filename is not None):
+            self.read(self._filename, mmap)
+
+    def __getstate__(self):
+        # A memory-mapped model is sent to worker processes by file name, so each of them
+        # maps the same file instead of receiving a copy of its arrays.
+        if (self._mmap):
+            return {"_filename": self._filename, "_mmap": True, "_missing": self._missing, "_extra": self._extra}
+        return self.__dict__.copy()
+
+    def __setstate__(self, i_state):
+        if (i_state.get("_mmap")):
+            self.__init__(i_state["_filename"], mmap=True)
+            self.setAlignmentPolicy(i_state["_missing"], i_state["_extra"])
+        else:
+            self.__dict__.update(i_state)
+
+    def __str__(self):
+        if (self._evecs is None):
+            return "<Empty Reference Model>"
+        return "Features={}: PCs={}: Units={}: Correlation={}".format(self.getFeatureCount(), self.getPCCount(), self._nunits, self._corrmatrix)
+
+    def build(self, i_dataset, corr_matrix=False, i_featurekeys=None):
+        '''
+        Computes the reference model from a dataset of good units.
+
+        Input:
+            i_dataset - 2D array-like with units in rows and test case features in columns.
+            corr_matrix - (Optional) Boolean specifying whether to use the correlation matrix in
+                          the eigenvector calculation instead of the covariance matrix.
+            i_featurekeys - (Optional) List of the feature keys of the dataset columns (see
+                            readDataset()). When stored, test data is aligned to the reference
+                            by key instead of by column position.
+        '''
+        dataset = np.asarray(i_dataset)
+        self._avgvector = np.mean(dataset, axis=0)
+        self._stddev = np.std(dataset, axis=0)
+        self._corrmatrix = bool(corr_matrix)
+        self._nunits = len(dataset[:,0])
+        self._mmap = False
+        self._setFeatureKeys(i_featurekeys)
+
+        # Wide reference sets (fewer units than features) are decomposed through the Gram matrix.
+        with sigqc_instrument.span("reference.build", rows=dataset.shape[0], features=dataset.shape[1], corr_matrix=self._corrmatrix):
+            self._evals, self._evecs = sigqc_pca.getEigenFromData(dataset, center_around_mean=True, scale_by_nrows=True, corr_matrix=corr_matrix)
+        self._totalvariance = float(np.sum(self._evals))
+
+    def setReference(self, i_avgvector, i_stddev, i_evals, i_evecs, i_nunits=None, corr_matrix=False, i_totalvariance=None, i_featurekeys=None):
+        '''
+        Sets the content of the reference model from precomputed arrays.
+
+        Input:
+            i_avgvector - Mean of each feature of the reference dataset.
+            i_stddev - Standard deviation of each feature of the reference dataset.
+            i_evals - Eigenvalues of the reference eigensystem in descending order.
+            i_evecs - Eigenvectors of the reference eigensystem as columns.
+            i_nunits - (Optional) Number of units in the reference dataset.
+            corr_matrix - (Optional) Boolean specifying whether the eigensystem is that of the
+                          correlation matrix.
+            i_totalvariance - (Optional) Total variance of the reference dataset. Defaults to the
+                              sum of the eigenvalues.
+            i_featurekeys - (Optional) List of the feature keys of the reference features.
+        '''
+        self._avgvector = np.asarray(i_avgvector)
+        self._stddev = np.asarray(i_stddev)
+        self._evals = np.asarray(i_evals)
+        self._evecs = np.asarray(i_evecs)
+        self._nunits = i_nunits
+        self._corrmatrix = bool(corr_matrix)
+        self._totalvariance = None if (i_totalvariance is None) else float(i_totalvariance)
+        self._mmap = False
+        self._setFeatureKeys(i_featurekeys)
+
+    def _setFeatureKeys(self, i_featurekeys):
+        self._featurekeys = None if (i_featurekeys is None) else list(i_featurekeys)
+        self._indexcache = {}
+
+    def read(self, i_filename, mmap=False):
+        '''
+        Reads a reference data file written by sigqc_implementpca.storeReferenceData() or
+        write(). The format (.csv or binary) is detected from the content of the file.
+
+        Input:
+            i_filename - Path to the reference data file.
+            mmap - (Optional) Boolean specifying whether the arrays of a binary model file
+                   are memory-mapped (read-only) instead of read into memory.
+        '''
+        self._filename = i_filename
+        self._mmap = False
+        with sigqc_instrument.span("reference.read", file=os.path.basename(i_filename)) as span:
+            if (isBinaryModelFile(i_filename)):
+                span.set(format="binary", mmap=mmap)
+                self._readBinary(i_filename, mmap)
+            else:
+                span.set(format="csv")
+                self._readCSV(i_filename)
+            if (sigqc_instrument.isEnabled()):
+                span.set(bytes=os.path.getsize(i_filename), features=len(self._avgvector))
+
+    def _readCSV(self, i_filename):
+        '''
+        Reads a .csv reference data file. Each section of the file between its BEGIN and END
+        markers is collected and converted to a numpy array in a single pass.
+        '''
+        sections = {}
+        name = None
+        with open(i_filename, 'r') as f:
+            for row in f:
+                row = row.strip()
+                if (name is None):
+                    if (row == "ISCORRMATRIX"):
+                        name = "CORRMATRIX"
+                        lines = []
+                    elif (row.startswith("BEGIN")):
+                        name = row[len("BEGIN"):]
+                        lines = []
+                elif (row == "END"+name):
+                    sections[name] = lines
+                    name = None
+                else:
+                    lines.append(row)
+
+        with sigqc_instrument.span("reference.decode", sections=len(sections), rows=len(sections.get("EVECS", ()))):
+            self._avgvector = np.loadtxt(sections["AVGVECTOR"], delimiter=',', ndmin=1)
+            self._stddev = np.loadtxt(sections["STANDDEV"], delimiter=',', ndmin=1)
+            self._corrmatrix = ('True' in sections["CORRMATRIX"][0])
+            self._nunits = int(sections["NUNITS"][0]) if ("NUNITS" in sections) else None
+            if ("FEATUREKEYS" in sections):
+                self._setFeatureKeys(next(csv.reader(sections["FEATUREKEYS"])))
+            else:
+                self._setFeatureKeys(None)
+            self._evals = np.loadtxt(sections["EVALS"], delimiter=',', ndmin=1)
+            self._evecs = np.loadtxt(sections["EVECS"], delimiter=',', ndmin=2)
+            self._totalvariance = float(np.sum(self._evals))
+
+    def _readBinary(self, i_filename, mmap):
+        '''
+        Reads (or memory-maps) a binary reference model file.
+        '''
+        header, arrays = readBinaryFile(i_filename, mmap)
+        if (header.get("kind", "model") != "model"):
+            raise Exception("Error: {} does not contain a reference model".format(i_filename))
+        self._mmap = bool(mmap)
+        self._corrmatrix = header["corrmatrix"]
+        self._nunits = header["nunits"]
+        self._totalvariance = header["totalvariance"]
+        self._avgvector = arrays["avgvector"]
+        self._stddev = arrays["stddev"]
+        self._evals = arrays["evals"]
+        self._evecs = arrays["evecs"]
+        self._setFeatureKeys(header.get("featurekeys"))
+
+    def write(self, o_filename, o_format="csv", dtype=None, n_pcs=None):
+        '''
+        Writes the reference model to a reference data file that can be read back with read()
+        or by sigqc_implementpca.implementPCA().
+
+        Input:
+            o_filename - Path of the file to be written.
+            o_format - (Optional) "csv" for the text reference data format or "binary" for
+                       the memory-mappable binary format. Defaults to "csv".
+            dtype - (Optional) Floating point type used to store the average vector, standard
+                    deviations and eigenvectors in the binary format, e.g. np.float32 to halve
+                    the file size. Defaults to the type they are held in. Eigenvalues are always
+                    stored in double precision.
+            n_pcs - (Optional) Number of leading eigenvectors to store. All eigenvalues are
+                    stored regardless so that SPE limits and variance proportions stay exact.
+                    Defaults to all eigenvectors.
+        '''
+        evecs = self._evecs[:,:n_pcs]
+        if (o_format.lower() == "csv"):
+            self._writeCSV(o_filename, evecs)
+        elif (o_format.lower() == "binary"):
+            self._writeBinary(o_filename, evecs, dtype)
+        else:
+            raise Exception("Error: Please provide a valid o_format. Valid options include 'csv' and 'binary'")
+
+    def _writeBinary(self, o_filename, i_evecs, dtype):
+        '''
+        Writes the binary reference model file described in the module header.
+        '''
+        if (dtype is None):
+            dtype = self._evecs.dtype
+        arrays = [("avgvector", np.ascontiguousarray(self._avgvector, dtype=dtype)),
+                  ("stddev", np.ascontiguousarray(self._stddev, dtype=dtype)),
+                  ("evals", np.ascontiguousarray(self._evals, dtype=np.float64)),
+                  ("evecs", np.ascontiguousarray(i_evecs, dtype=dtype))]
+        header = {"kind": "model", "corrmatrix": bool(self._corrmatrix),
+                  "nunits": None if (self._nunits is None) else int(self._nunits),
+                  "totalvariance": self.getTotalVariance(), "featurekeys": self._featurekeys}
+        writeBinaryFile(o_filename, header, arrays)
+
+    def _writeCSV(self, o_filename, i_evecs):
+        '''
+        Writes the .csv reference data file format.
+        '''
+        with open(o_filename, 'w', newline='') as f:
+            writer = csv.writer(f, delimiter=",")
+            writer.writerow(["BEGINAVGVECTOR"])
+            writer.writerow(self._avgvector)
+            writer.writerow(["ENDAVGVECTOR"])
+            writer.writerow(["BEGINSTANDDEV"])
+            writer.writerow(self._stddev)
+            writer.writerow(["ENDSTANDDEV"])
+            writer.writerow(["ISCORRMATRIX"])
+            writer.writerow([str(self._corrmatrix)])
+            writer.writerow(["ENDCORRMATRIX"])
+            writer.writerow(["BEGINNUNITS"])
+            writer.writerow([self._nunits])
+            writer.writerow(["ENDNUNITS"])
+            if (self._featurekeys is not None):
+                writer.writerow(["BEGINFEATUREKEYS"])
+                writer.writerow(self._featurekeys)
+                writer.writerow(["ENDFEATUREKEYS"])
+            writer.writerow(["BEGINEVALS"])
+            writer.writerow(self._evals)
+            writer.writerow(["ENDEVALS"])
+            writer.writerow(["BEGINEVECS"])
+            writer.writerows(i_evecs)
+            writer.writerow(["ENDEVECS"])
+
+    def getFilename(self):
+        '''
+        Returns the path of the reference data file the model was read from, if any.
+        '''
+        return self._filename
+
+    def getAverageVector(self):
+        '''
+        Returns the mean of each feature of the reference dataset as a 1D numpy array.
+        '''
+        return self._avgvector
+
+    def getStandardDeviations(self):
+        '''
+        Returns the standard deviation of each feature of the reference dataset as a 1D numpy array.
+        '''
+        return self._stddev
+
+    def getEigenvalues(self):
+        '''
+        Returns the eigenvalues of the reference eigensystem in descending order as a 1D numpy array.
+        '''
+        return self._evals
+
+    def getEigenvectors(self):
+        '''
+        Returns the eigenvectors of the reference eigensystem as the columns of a 2D numpy array.
+        '''
+        return self._evecs
+
+    def getTotalVariance(self):
+        '''
+        Returns the total variance of the reference dataset (the sum of all of its eigenvalues).
+        '''
+        if (self._totalvariance is None):
+            return float(np.sum(self._evals))
+        return self._totalvariance
+
+    def isMemoryMapped(self):
+        '''
+        Returns True if the arrays of the model are memory-mapped from a binary model file.
+        '''
+        return self._mmap
+
+    def getUnitCount(self):
+        '''
+        Returns the number of units in the reference dataset, or None if it was not recorded.
+        '''
+        return self._nunits
+
+    def getMemoryUsage(self):
+        '''
+        Returns the memory held by the model, broken down into numeric arrays, strings (feature
+        keys) and other metadata (see sigqc_memory.getMemoryUsage()). The arrays of a
+        memory-mapped model are reported as "mapped_bytes".
+        '''
+        return sigqc_memory.getMemoryUsage(self)
+
+    def getFeatureCount(self):
+        '''
+        Returns the number of features of the reference dataset.
+        '''
+        return len(self._evecs[:,0])
+
+    def getPCCount(self):
+        '''
+        Returns the number of principal components held by the model.
+        '''
+        return len(self._evecs[0,:])
+
+    def isCorrMatrix(self):
+        '''
+        Returns True if the eigensystem was computed from the correlation matrix.
+        '''
+        return self._corrmatrix
+
+    def getFeatureKeys(self):
+        '''
+        Returns the list of the feature keys of the reference features, or None if the model
+        does not store them (e.g. reference data files written before keys were recorded).
+        '''
+        return self._featurekeys
+
+    def setAlignmentPolicy(self, missing="error", extra="ignore"):
+        '''
+        Sets how test data is aligned to the reference features by feature key.
+
+        Input:
+            missing - (Optional) Policy for reference features absent from the test data.
+                      "error" raises an exception and "mean" substitutes the reference mean of
+                      the feature, so it contributes nothing to the scores. Defaults to "error".
+            extra - (Optional) Policy for test features absent from the reference. "ignore"
+                    drops them and "error" raises an exception. Defaults to "ignore".
+        '''
+        if (missing not in ("error", "mean")) or (extra not in ("error", "ignore")):
+            raise Exception("Error: Valid missing policies are 'error' and 'mean', valid extra policies are 'error' and 'ignore'")
+        self._missing = missing
+        self._extra = extra
+
+    def alignDataset(self, i_dataset, i_featurekeys, missing=None, extra=None):
+        '''
+        Gathers and reorders the columns of a dataset into the feature order of the reference.
+        The column index for a given list of keys is computed once and reused.
+
+        Input:
+            i_dataset - 2D array-like with units in rows and features in columns.
+            i_featurekeys - List of the feature keys of the dataset columns.
+            missing, extra - (Optional) Override the policies set with setAlignmentPolicy().
+
+        Return:
+            A 2D numpy array with units in rows and the reference features in columns. The
+            dataset itself is returned when its keys already match the reference.
+        '''
+        if (self._featurekeys is None) or (i_featurekeys is None):
+            return i_dataset
+        missing = self._missing if (missing is None) else missing
+        extra = self._extra if (extra is None) else extra
+
+        cachekey = tuple(i_featurekeys)
+        if (cachekey not in self._indexcache):
+            if (len(self._indexcache) > 16):
+                self._indexcache.clear()
+            self._indexcache[cachekey] = getFeatureIndex(self._featurekeys, i_featurekeys)
+        index, extrakeys = self._indexcache[cachekey]
+
+        absent = [self._featurekeys[i] for i in np.flatnonzero(index < 0)]
+        if (len(absent) > 0) and (missing == "error"):
+            raise Exception("Error: {} reference feature(s) missing from the test data, e.g. {}".format(len(absent), absent[:5]))
+        if (len(extrakeys) > 0) and (extra == "error"):
+            raise Exception("Error: {} test feature(s) are not part of the reference, e.g. {}".format(len(extrakeys), extrakeys[:5]))
+        if (len(extrakeys) == 0) and (len(index) == np.shape(i_dataset)[1]) and np.array_equal(index, np.arange(len(index))):
+            return i_dataset
+        return alignFeatures(i_dataset, index, self._avgvector)
+
+    def score(self, i_dataset, n_pcs=None, i_featurekeys=None, missing=None, extra=None):
+        '''
+        Calculates the PC scores of each unit of a dataset against the reference eigensystem.
+
+        Input:
+            i_dataset - 2D array-like with units in rows and the reference features in columns.
+            n_pcs - (Optional) Number of principal components to score. Defaults to all PCs.
+            i_featurekeys - (Optional) List of the feature keys of the dataset columns. If given
+                            and the model stores feature keys, the columns are aligned by key
+                            (see alignDataset()); otherwise they are taken in reference order.
+            missing, extra - (Optional) Override the policies set with setAlignmentPolicy().
+
+        Return:
+            A 2D numpy array of PC scores with units in rows.
+        '''
+        with sigqc_instrument.span("reference.score", rows=len(i_dataset), n_pcs=n_pcs):
+            i_dataset = self.alignDataset(i_dataset, i_featurekeys, missing, extra)
+            stddev = self._stddev if (self._corrmatrix) else None
+            return sigqc_pca.getPCScores(i_dataset, self._evals, self._evecs, n_pcs=n_pcs, i_means=self._avgvector, i_stddev=stddev, dtype=self._getComputeType(i_dataset))
+
+    def getT2AndSPE(self, i_dataset, n_pcs, i_featurekeys=None, missing=None, extra=None):
+        '''
+        Calculates Hotelling's T-squared statistic and the squared prediction error of each unit
+        of a dataset against the reference model (see sigqc_spc.getT2AndSPE()). Columns are
+        aligned by feature key as in score().
+        '''
+        with sigqc_instrument.span("reference.t2spe", rows=len(i_dataset), n_pcs=n_pcs):
+            i_dataset = self.alignDataset(i_dataset, i_featurekeys, missing, extra)
+            stddev = self._stddev if (self._corrmatrix) else None
+            return sigqc_spc.getT2AndSPE(i_dataset, self._avgvector, self._evals, self._evecs, n_pcs=n_pcs, i_stddev=stddev, dtype=self._getComputeType(i_dataset))
+
+    def _getComputeType(self, i_dataset):
+        '''
+        Models stored in single precision are scored in single precision, so their
+        (possibly memory-mapped) eigenvectors are used without conversion.
+        '''
+        if (self._evecs.dtype == np.float32):
+            return np.dtype(np.float32)
+        return sigqc_pca.getComputeType(i_dataset)
+
+    def scoreFile(self, i_testfile, input_type="ascii", n_pcs=None):
+        '''
+        Parses a SigQC export file and scores its units against the reference model.
+
+        Return:
+            A tuple containing the serial numbers, the headers (see readDataset()) and the
+            PC scores of the units in the file.
+        '''
+        serialnumbers, headers, dataset, keys = readDataset(i_testfile, input_type, return_keys=True)
+        return serialnumbers, headers, self.score(dataset, n_pcs, i_featurekeys=keys)
+
+    def scoreMany(self, i_testfiles, input_type="ascii", workers=None, n_pcs=None, o_path=None):
+        '''
+        Scores many SigQC export files against the reference model. Parsing and projection of
+        each file run in a pool of worker processes that receive the model once at start up,
+        and results are yielded in the order of i_testfiles as soon as each one is available.
+
+        Input:
+            i_testfiles - List of paths to the files to be scored.
+            input_type - (Optional) File input type of all files, "ascii" or "unit".
+            workers - (Optional) Number of worker processes. Defaults to the number of CPUs.
+                      If 1, files are scored in the calling process.
+            n_pcs - (Optional) Number of principal components to score. Defaults to all PCs.
+            o_path - (Optional) Directory in which the workers write the PC scores of each
+                     file as [file name]_PCScores.csv. If None, no files are written. Files
+                     with the same name in different folders would write the same output
+                     file, so they are rejected when o_path is given.
+
+        Return:
+            A generator of tuples containing the path of the scored file, the serial numbers
+            of its units and their PC scores as a 2D numpy array.
+        '''
+        i_testfiles = list(i_testfiles)
+        if (o_path is not None):
+            names = Counter(_getScoresName(filename) for filename in i_testfiles)
+            duplicates = sorted(name for name, count in names.items() if (count > 1))
+            if (len(duplicates) > 0):
+                raise Exception("Error: Several test files would write the same PC scores file in o_path: {}".format(", ".join(duplicates)))
+        if (workers == 1):
+            for filename in i_testfiles:
+                yield _scoreFile(self, filename, input_type, n_pcs, o_path)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(self,)) as executor:
+            futures = [executor.submit(_scoreFileInWorker, filename, input_type, n_pcs, o_path) for filename in i_testfiles]
+            for future in futures:
+                yield future.result()
+
+# Reference model held by each worker process of SigQCReferenceModel.scoreMany()
+_workermodel = None
+
+def _initWorker(i_model):
+    global _workermodel
+    _workermodel = i_model
+
+def _scoreFileInWorker(i_testfile, input_type, n_pcs, o_path):
+    return _scoreFile(_workermodel, i_testfile, input_type, n_pcs, o_path)
+
+def _getScoresName(i_testfile):
+    return os.path.splitext(os.path.basename(i_testfile))[0]+"_PCScores.csv"
+
+def _scoreFile(i_model, i_testfile, input_type, n_pcs, o_path):
+    serialnumbers, headers, pcscores = i_model.scoreFile(i_testfile, input_type, n_pcs)
+    if (o_path is not None):
+        writePCScores(os.path.join(o_path, _getScoresName(i_testfile)), serialnumbers, pcscores)
+    return i_testfile, serialnumbers, pcscores
+
+###################################
+# SigQCIncrementalReference class
+###################################
+class SigQCIncrementalReference:
+    '''
+    The SigQCIncrementalReference class keeps the sufficient statistics of a growing reference
+    dataset so that a SigQCReferenceModel can be brought up to date with each new batch of good
+    units without revisiting earlier batches. Two kinds of state are supported:
+
+      Full (rank=None) - The unit count, the mean vector and the features-by-features co-moment
+                         matrix (sum of outer products of centered units). The model derived from
+                         it is identical to one built from all units at once.
+      Low-rank (rank=k) - The unit count, the mean vector, the per-feature sums of squares and
+                         the leading k singular values and right singular vectors of the centered
+                         data, updated by incremental PCA. Memory is proportional to k times the
+                         number of features, which suits wide datasets.
+
+    An optional forgetting factor between 0 and 1 down-weights all earlier units each time a
+    batch is added, so the model tracks slow drift in production.
+
+    Example:
+        state = SigQCIncrementalReference(rank=None, forgetting=1.0)
+        state.update(first_week_dataset)
+        state.update(second_week_dataset)
+        state.write("ReferenceState.sqcref")
+        state.getModel().write("ReferenceData.sqcref", o_format="binary")
+    '''
+    def __init__(self, i_filename=None, rank=None, forgetting=1.0):
+        '''
+        Constructor for an instance of the SigQCIncrementalReference class.
+
+        Input:
+            i_filename - (Optional) Path to a state file written by write(). If given, the
+                         state (including its rank and forgetting factor) is read from it.
+            rank - (Optional) Number of principal components kept by a low-rank state. If None
+                   (default), the full co-moment matrix is kept.
+            forgetting - (Optional) Weight applied to all earlier units each time a batch is
+                         added. Defaults to 1.0 (no forgetting).
+        '''
+        self._rank = rank
+        self._forgetting = forgetting
+        self._weight = 0.0
+        self._nunits = 0
+        self._updates = 0
+        self._mean = None
+        self._comoment = None
+        self._sumsquares = None
+        self._components = None
+        self._singularvalues = None
+        self._featurekeys = None
+        if (i_filename is not None):
+            self.read(i_filename)
+
+    def __str__(self):
+        kind = "Full" if (self._rank is None) else "Rank={}".format(self._rank)
+        return "{}: Units={}: Weight={:.6g}: Updates={}: Forgetting={}".format(kind, self._nunits, self._weight, self._updates, self._forgetting)
+
+    def update(self, i_dataset, i_featurekeys=None):
+        '''
+        Adds a batch of good units to the reference statistics. The cost depends on the size
+        of the batch and the number of features, not on the number of units seen before.
+
+        Input:
+            i_dataset - 2D array-like with units in rows and test case features in columns.
+            i_featurekeys - (Optional) List of the feature keys of the dataset columns. The keys
+                            of the first batch are stored, and later batches are aligned to them.
+        '''
+        if (self._featurekeys is None):
+            self._featurekeys = None if (i_featurekeys is None) else list(i_featurekeys)
+        elif (i_featurekeys is not None):
+            index, extrakeys = getFeatureIndex(self._featurekeys, i_featurekeys)
+            if np.any(index < 0):
+                raise Exception("Error: The batch lacks {} feature(s) of the reference".format(np.count_nonzero(index < 0)))
+            i_dataset = alignFeatures(i_dataset, index)
+        batch = np.asarray(i_dataset, dtype=float)
+        n_batch = len(batch[:,0])
+        batchmean, batchstd = sigqc_pca.getColumnStats(batch, ddof=0, dtype=np.float64)
+
+        if (self._mean is None):
+            self._mean = np.zeros(len(batchmean))
+            self._sumsquares = np.zeros(len(batchmean))
+            if (self._rank is None):
+                self._comoment = np.zeros((len(batchmean), len(batchmean)))
+
+        # Weight of the earlier units after forgetting, and the combined weight
+        weight = self._weight*self._forgetting
+        total = weight + n_batch
+        delta = batchmean - self._mean
+        correction = weight*n_batch/total
+
+        if (self._rank is None):
+            batchcomoment = sigqc_pca.getCovariance(batch, scale_by_nrows=False, dtype=np.float64)
+            self._comoment *= self._forgetting
+            self._comoment += batchcomoment
+            self._comoment += correction*np.outer(delta, delta)
+        else:
+            centered = batch - batchmean
+            stack = [centered, np.sqrt(correction)*delta.reshape((1,len(delta)))]
+            if (self._components is not None):
+                stack.insert(0, np.sqrt(self._forgetting)*self._singularvalues.reshape((-1,1))*self._components)
+            u, sv, vt = np.linalg.svd(np.vstack(stack), full_matrices=False)
+            self._singularvalues = sv[:self._rank]
+            self._components = vt[:self._rank]
+
+        self._sumsquares = self._sumsquares*self._forgetting + n_batch*batchstd**2 + correction*delta**2
+        self._mean = self._mean + delta*n_batch/total
+        self._weight = total
+        self._nunits += n_batch
+        self._updates += 1
+
+    def getUnitCount(self):
+        '''
+        Returns the total number of units added to the statistics.
+        '''
+        return self._nunits
+
+    def getEffectiveUnitCount(self):
+        '''
+        Returns the effective number of units after forgetting (equal to getUnitCount() when
+        the forgetting factor is 1.0).
+        '''
+        return self._weight
+
+    def getUpdateCount(self):
+        '''
+        Returns the number of batches added to the statistics.
+        '''
+        return self._updates
+
+    def getMean(self):
+        '''
+        Returns the (weighted) mean of each feature as a 1D numpy array.
+        '''
+        return self._mean
+
+    def getMemoryUsage(self):
+        '''
+        Returns the memory held by the statistics (see sigqc_memory.getMemoryUsage()).
+        '''
+        return sigqc_memory.getMemoryUsage(self)
+
+    def getModel(self, corr_matrix=False, n_pcs=None):
+        '''
+        Derives a SigQCReferenceModel from the current statistics.
+
+        Input:
+            corr_matrix - (Optional) Boolean specifying whether to use the correlation matrix
+                          instead of the covariance matrix. Only supported by full states.
+            n_pcs - (Optional) Number of leading eigenvectors to keep. Defaults to all.
+
+        Return:
+            An instance of the SigQCReferenceModel class. For low-rank states only the leading
+            rank eigenvalues are known, so SPE limits computed from the model are approximate;
+            the total variance of the model is exact.
+        '''
+        if (self._mean is None) or (self._weight < 2):
+            raise Exception("Error: At least two units are needed to derive a reference model")
+        scale = self._weight - 1
+        stddev = np.sqrt(self._sumsquares/self._weight)
+
+        if (self._rank is None):
+            cov_matrix = self._comoment/scale
+            if (corr_matrix):
+                sample_std = np.sqrt(np.diag(cov_matrix))
+                cov_matrix = cov_matrix/np.outer(sample_std, sample_std)
+            evals, evecs = sigqc_pca.getEigen(cov_matrix)
+        elif (corr_matrix):
+            raise Exception("Error: Low-rank incremental references only support the covariance matrix")
+        else:
+            evals = self._singularvalues**2/scale
+            evecs = self._components.T
+        totalvariance = len(self._mean) if (corr_matrix) else np.sum(self._sumsquares)/scale
+
+        model = SigQCReferenceModel()
+        model.setReference(self._mean, stddev, evals, evecs[:,:n_pcs], self._nunits, corr_matrix, totalvariance, self._featurekeys)
+        return model
+
+    def write(self, o_filename):
+        '''
+        Writes the statistics to a binary state file (see the module header) from which the
+        next batch can be added without the earlier units.
+        '''
+        header = {"kind": "incremental", "rank": self._rank, "forgetting": self._forgetting,
+                  "weight": self._weight, "nunits": self._nunits, "updates": self._updates,
+                  "featurekeys": self._featurekeys}
+        arrays = [("mean", self._mean), ("sumsquares", self._sumsquares)]
+        if (self._rank is None):
+            arrays.append(("comoment", self._comoment))
+        else:
+            arrays.append(("singularvalues", self._singularvalues))
+            arrays.append(("components", self._components))
+        writeBinaryFile(o_filename, header, arrays)
+
+    def read(self, i_filename):
+        '''
+        Reads the statistics from a binary state file written by write().
+        '''
+        header, arrays = readBinaryFile(i_filename)
+        if (header.get("kind") != "incremental"):
+            raise Exception("Error: {} does not contain incremental reference statistics".format(i_filename))
+        self._rank = header["rank"]
+        self._forgetting = header["forgetting"]
+        self._weight = header["weight"]
+        self._nunits = header["nunits"]
+        self._updates = header["updates"]
+        self._featurekeys = header.get("featurekeys")
+        self._mean = arrays["mean"]
+        self._sumsquares = arrays["sumsquares"]
+        self._comoment = arrays.get("comoment")
+        self._singularvalues = arrays.get("singularvalues")
+        self._components = arrays.get("components")
@@ -0,0 +1,326 @@
+import numpy as np
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.colors import LogNorm
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from sigqc import sigqc_instrument
+
+#########################################################################################################################
+# sigqc_render.py
+#
+# Headless rendering of SigQC analysis plots. Figures are explicit matplotlib Figure objects
+# drawn by the Agg canvas, so no pyplot state is created and nothing is left open. The PC
+# score renderer builds its figure and artists once and only updates the data, labels and
+# limits for each PC pair. PC pairs may be rendered by a pool of worker processes.
+#
+# For large numbers of units the PC score plots can be drawn in density mode: the scores are
+# binned into a fixed 2D histogram with NumPy and drawn as one image, and only the units
+# outside a T-squared contour of the PC pair are drawn as individual points. Render time and
+# image size then stay roughly constant as the number of units grows.
+#
+# Every render function writes to a target that is either a file name (".png" is added when
+# the name has no extension) or None, in which case the PNG image is returned as bytes.
+#
+# Example Usage:
+#  renderPCScores(pcscores, "X15 PC Scores", n_pcs=10, o_path="", o_name="PCScores", workers=4)
+#  renderPCScores(pcscores, "X15 PC Scores", n_pcs=10, mode="density", i_evals=evals, alpha=0.001)
+#  png = renderCumPropVar(profile.getCumPropVar(10))
+#
+#########################################################################################################################
+
+# Resolution of the rendered images in dots per inch
+DEFAULT_DPI = 100
+# Number of units above which renderPCScores(mode="auto") draws density plots
+DENSITY_THRESHOLD = 10000
+# Number of histogram bins along each axis of density plots
+DENSITY_BINS = 200
+# Maximum number of outliers drawn as points in density plots (those with the largest T-squared)
+MAX_OUTLIERS = 5000
+
+def newFigure(figsize=(6.4,4.8)):
+    '''
+    Returns a new matplotlib Figure attached to an Agg canvas. The figure is not registered
+    with pyplot and is freed as soon as it is no longer referenced.
+    '''
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure
+
+def saveFigure(i_figure, o_target=None, dpi=DEFAULT_DPI, o_format="png"):
+    '''
+    Renders a figure as PNG (or another image format supported by matplotlib).
+
+    Inputs
+    ------
+        i_figure - matplotlib Figure to render.
+        o_target - (Optional) File name to write to. The extension of o_format is added when
+            the name has no extension. If None (default), the image is returned as bytes.
+        dpi - (Optional) Resolution in dots per inch.
+        o_format - (Optional) Image format, e.g. "png" (default) or "svg".
+
+    Outputs
+    -------
+        Returns the name of the written file, or the image as bytes if o_target is None.
+    '''
+    with sigqc_instrument.span("render.save", format=o_format, dpi=dpi) as span:
+        if (o_target is None):
+            buffer = io.BytesIO()
+            i_figure.savefig(buffer, format=o_format, dpi=dpi)
+            span.set(bytes=buffer.tell())
+            return buffer.getvalue()
+        if (os.path.splitext(o_target)[1] == ""):
+            o_target = o_target + "." + o_format
+        i_figure.savefig(o_target, format=o_format, dpi=dpi)
+        return o_target
+
+###################################
+# SigQCPCScoreRenderer class
+###################################
+class SigQCPCScoreRenderer:
+    '''
+    The SigQCPCScoreRenderer class draws scatter plots of pairs of PC scores. The figure, axes
+    and scatter artist are created once, and each call of render() only replaces the plotted
+    data, labels and limits, so rendering many PC pairs costs one figure.
+    '''
+    def __init__(self, figsize=(6,4), dpi=DEFAULT_DPI):
+        '''
+        Constructor for an instance of the SigQCPCScoreRenderer class.
+
+        Input:
+            figsize - (Optional) Figure size in inches. Defaults to (6,4).
+            dpi - (Optional) Resolution in dots per inch.
+        '''
+        self._dpi = dpi
+        self._figure = newFigure(figsize)
+        self._axes = self._figure.add_subplot(1,1,1)
+        self._axes.grid(True)
+        self._axes.set_axisbelow(True)
+        self._scatter = self._axes.scatter([], [], edgecolor="black", alpha=0.6)
+        # Density mode artists, created on first use
+        self._image = None
+        self._contour = None
+
+    def getFigure(self):
+        '''
+        Returns the matplotlib Figure of the renderer.
+        '''
+        return self._figure
+
+    def update(self, i_x, i_y, i_xlabel="", i_ylabel="", i_title=None):
+        '''
+        Replaces the plotted scores, labels and title, and rescales the axes to the data.
+        '''
+        x = np.asarray(i_x, dtype=float)
+        y = np.asarray(i_y, dtype=float)
+        self._scatter.set_offsets(np.column_stack((x, y)))
+        self._setDensityVisible(False)
+        self._setAxes(x, y, i_xlabel, i_ylabel, i_title)
+
+    def updateDensity(self, i_x, i_y, i_xlabel="", i_ylabel="", i_title=None, i_variances=None, i_center=(0.0,0.0),
+                      t2_limit=None, alpha=0.01, bins=DENSITY_BINS, max_outliers=MAX_OUTLIERS):
+        '''
+        Replaces the plotted scores with a 2D histogram of their density, draws the T-squared
+        contour of the PC pair and draws the units outside of it as points.
+
+        Input:
+            i_x, i_y - Scores of the two PCs.
+            i_variances - (Optional) Variances of the two PCs (the reference eigenvalues). If
+                          None, the sample variances of the scores are used.
+            i_center - (Optional) Center of the contour. Defaults to the origin, the reference
+                       mean of PC scores. Ignored if i_variances is None, in which case the
+                       sample means are used.
+            t2_limit - (Optional) T-squared value of the contour. If None, the 1-alpha quantile
+                       of the chi-square distribution with 2 degrees of freedom is used.
+            alpha - (Optional) Significance level of the default contour. Defaults to 0.01.
+            bins - (Optional) Number of histogram bins along each axis.
+            max_outliers - (Optional) Maximum number of outliers drawn as points; those with
+                           the largest T-squared are kept.
+        '''
+        x = np.asarray(i_x, dtype=float)
+        y = np.asarray(i_y, dtype=float)
+        if (i_variances is None):
+            i_center = (float(np.nanmean(x)), float(np.nanmean(y))) if (len(x) > 0) else (0.0,0.0)
+            i_variances = (float(np.nanvar(x)), float(np.nanvar(y))) if (len(x) > 0) else (1.0,1.0)
+        if (t2_limit is None):
+            # The chi-square quantile with 2 degrees of freedom has a closed form
+            t2_limit = -2.0*np.log(alpha)
+        variances = np.maximum(np.asarray(i_variances, dtype=float), np.finfo(float).tiny)
+        t2 = (x-i_center[0])**2/variances[0] + (y-i_center[1])**2/variances[1]
+        outliers = np.flatnonzero(t2 > t2_limit)
+        if (len(outliers) > max_outliers):
+            outliers = outliers[np.argpartition(t2[outliers], -max_outliers)[-max_outliers:]]
+
+        xlim, ylim = _getLimits(x), _getLimits(y)
+        finite = np.isfinite(x) & np.isfinite(y)
+        counts = np.histogram2d(x[finite], y[finite], bins=bins, range=(xlim, ylim))[0]
+        counts = np.ma.masked_equal(counts.T, 0)
+        if (self._image is None):
+            self._image = self._axes.imshow(counts, origin="lower", aspect="auto", cmap="Blues", interpolation="nearest",
+                                            extent=xlim+ylim, zorder=1)
+            self._contour = self._axes.plot([], [], color="red", linewidth=1.0, zorder=2)[0]
+        else:
+            self._image.set_data(counts)
+            self._image.set_extent(xlim+ylim)
+        # Logarithmic shading keeps sparse regions visible next to the dense core
+        self._image.set_norm(LogNorm(vmin=1, vmax=max(int(counts.max()) if (counts.count() > 0) else 1, 2)))
+        angles = np.linspace(0, 2*np.pi, 181)
+        radius = np.sqrt(t2_limit*variances)
+        self._contour.set_data(i_center[0]+radius[0]*np.cos(angles), i_center[1]+radius[1]*np.sin(angles))
+        self._scatter.set_offsets(np.column_stack((x[outliers], y[outliers])))
+        self._scatter.set_zorder(3)
+        self._setDensityVisible(True)
+        self._setAxes(x, y, i_xlabel, i_ylabel, i_title)
+
+    def _setDensityVisible(self, i_visible):
+        if (self._image is not None):
+            self._image.set_visible(i_visible)
+            self._contour.set_visible(i_visible)
+
+    def _setAxes(self, i_x, i_y, i_xlabel, i_ylabel, i_title):
+        self._axes.set_xlabel(i_xlabel)
+        self._axes.set_ylabel(i_ylabel)
+        self._axes.set_title("" if (i_title is None) else i_title)
+        self._axes.set_xlim(_getLimits(i_x))
+        self._axes.set_ylim(_getLimits(i_y))
+
+    def render(self, i_x, i_y, i_xlabel="", i_ylabel="", i_title=None, o_target=None, mode="scatter", **kwargs):
+        '''
+        Draws one pair of PC scores and writes the image to o_target (see saveFigure()). mode
+        is "scatter" to draw every unit or "density" to draw a density plot, in which case the
+        keyword arguments are passed on to updateDensity().
+        '''
+        with sigqc_instrument.span("render.draw", mode=mode, rows=len(i_x)):
+            if (mode == "density"):
+                self.updateDensity(i_x, i_y, i_xlabel, i_ylabel, i_title, **kwargs)
+            else:
+                self.update(i_x, i_y, i_xlabel, i_ylabel, i_title)
+        return saveFigure(self._figure, o_target, self._dpi)
+
+def _getLimits(i_values, margin=0.05):
+    '''
+    Returns axis limits enclosing the finite values with a margin on both sides.
+    '''
+    values = i_values[np.isfinite(i_values)]
+    if (len(values) == 0):
+        return (-1.0, 1.0)
+    low, high = float(np.min(values)), float(np.max(values))
+    pad = (high-low)*margin if (high > low) else max(abs(low)*margin, 0.5)
+    return (low-pad, high+pad)
+
+def _renderPCPairs(i_pairs, i_header, dpi, mode="scatter", i_options=None):
+    '''
+    Renders a list of (x, y, pc, o_target, variances) PC pairs with one renderer, in a worker
+    process or in the calling process.
+    '''
+    renderer = SigQCPCScoreRenderer(dpi=dpi)
+    outputs = []
+    for x, y, pc, target, variances in i_pairs:
+        if (mode == "density"):
+            outputs.append(renderer.render(x, y, "PC"+str(pc+1), "PC"+str(pc+2), i_header, target, mode, i_variances=variances, **i_options))
+        else:
+            outputs.append(renderer.render(x, y, "PC"+str(pc+1), "PC"+str(pc+2), i_header, target))
+    return outputs
+
+def renderPCScores(i_pcscores, i_header=None, n_pcs=2, o_path="", o_name="PCScores", to_files=True, workers=1, dpi=DEFAULT_DPI,
+                   mode="scatter", i_evals=None, t2_limit=None, alpha=0.01, bins=DENSITY_BINS, max_outliers=MAX_OUTLIERS):
+    '''
+    Renders scatter plots of consecutive pairs of PC scores (PC1 against PC2, PC2 against PC3,
+    and so on).
+
+    Inputs
+    ------
+        i_pcscores - 2D array-like of PC scores with units in rows.
+        i_header - (Optional) Title of the plots.
+        n_pcs - (Optional) Number of plots. Plot i shows PC i+1 against PC i+2.
+        o_path, o_name - (Optional) Plot i is written to o_path+o_name+"[i]-[i+1].png".
+        to_files - (Optional) Boolean specifying whether the plots are written to files. If
+            False, the PNG images are returned as bytes. Defaults to True.
+        workers - (Optional) Number of worker processes sharing the plots. Defaults to 1,
+            which renders in the calling process. None uses one worker per CPU.
+        dpi - (Optional) Resolution in dots per inch.
+        mode - (Optional) "scatter" (default) draws every unit as a point. "density" draws a
+            2D histogram of the scores and only the units outside the T-squared contour of
+            each PC pair as points. "auto" uses density plots above DENSITY_THRESHOLD units.
+        i_evals - (Optional) Reference eigenvalues, the variances of the PCs defining the
+            T-squared contour of density plots. If None, the sample variances are used.
+        t2_limit, alpha, bins, max_outliers - (Optional) Contour and binning options of density
+            plots (see SigQCPCScoreRenderer.updateDensity()).
+
+    Outputs
+    -------
+        Returns a list with the file name or PNG bytes of each plot.
+    '''
+    pcscores = np.asarray(i_pcscores)
+    if (mode == "auto"):
+        mode = "density" if (len(pcscores) > DENSITY_THRESHOLD) else "scatter"
+    if (mode not in ("scatter", "density")):
+        raise Exception("Error: Please provide a valid mode. Valid options include 'scatter', 'density' and 'auto'")
+    n_available = np.shape(pcscores)[1] if (i_evals is None) else min(np.shape(pcscores)[1], len(i_evals))
+    if (n_pcs+1 > n_available):
+        raise Exception("Error: {} plots of consecutive PC pairs need {} PCs, but only {} are available".format(n_pcs, n_pcs+1, n_available))
+    options = {"t2_limit": t2_limit, "alpha": alpha, "bins": bins, "max_outliers": max_outliers}
+    pairs = []
+    for i in range(n_pcs):
+        target = o_path+o_name+str(i)+"-"+str(i+1) if (to_files) else None
+        variances = (i_evals[i], i_evals[i+1]) if (i_evals is not None) else None
+        pairs.append((pcscores[:,i], pcscores[:,i+1], i, target, variances))
+    n_workers = min(workers if (workers is not None) else (os.cpu_count() or 1), len(pairs))
+    with sigqc_instrument.span("render.pcscores", rows=len(pcscores), plots=len(pairs), mode=mode, workers=max(n_workers, 1)):
+        if (n_workers <= 1):
+            return _renderPCPairs(pairs, i_header, dpi, mode, options)
+        # Each worker renders every n_workers-th pair with its own renderer
+        chunks = [pairs[k::n_workers] for k in range(n_workers)]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_renderPCPairs, chunks, [i_header]*n_workers, [dpi]*n_workers, [mode]*n_workers, [options]*n_workers))
+        outputs = [None]*len(pairs)
+        for k, result in enumerate(results):
+            outputs[k::n_workers] = result
+        return outputs
+
+def renderCumPropVar(i_cumpropvar, o_target=None, col="green", dpi=DEFAULT_DPI):
+    '''
+    Renders a bar graph of the cumulative proportion of variance explained by the leading
+    principal components (see sigqc_pca.SigQCVarianceProfile.getCumPropVar()).
+
+    Outputs
+    -------
+        Returns the file name or PNG bytes of the graph (see saveFigure()).
+    '''
+    n_pcs = len(i_cumpropvar)
+    figure = newFigure()
+    axes = figure.add_subplot(1,1,1)
+    axes.bar(list(range(1,n_pcs+1)), i_cumpropvar, color=col)
+    axes.set_xticks(range(1,n_pcs+1,1))
+    axes.set_xticklabels(['PC'+str(i) for i in range(1,n_pcs+1)], size=8.0)
+    axes.tick_params(axis='y', labelsize=8.0)
+    axes.set_ylabel("Proportion of Total Variance", size=8.0)
+    axes.set_title("Cumulative Proportion of Variance Explained by Principal Components", size=10)
+    return saveFigure(figure, o_target, dpi)
+
+def renderPCBoxPlots(i_pcscores_T, o_target=None, dpi=DEFAULT_DPI):
+    '''
+    Renders horizontal boxplots of the PC scores of each PC.
+
+    Inputs
+    ------
+        i_pcscores_T - The transpose of the PC score data, or a list with the scores of each PC.
+        o_target - (Optional) File name, or None to return PNG bytes (see saveFigure()).
+
+    Outputs
+    -------
+        Returns the file name or PNG bytes of the boxplot.
+    '''
+    figure = newFigure()
+    axes = figure.add_subplot(1,1,1)
+    axes.grid(True)
+    try:
+        axes.boxplot(i_pcscores_T, notch=False, sym='bD', orientation='horizontal')
+    except TypeError:
+        # matplotlib before 3.10
+        axes.boxplot(i_pcscores_T, notch=False, sym='bD', vert=False)
+    axes.set_ylabel("PC")
+    axes.set_xlabel("PC Score")
+    axes.set_title("Boxplot of PC Scores")
+    return saveFigure(figure, o_target, dpi)
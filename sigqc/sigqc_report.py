@@ -1,7 +1,16 @@
 from docx import Document
 from docx.shared import Inches
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import types
+import io
 import os
+import html
+import base64
+import copy
+import time
+import logging
+import threading
+from sigqc import sigqc_instrument
 
 ################################################################################################
 # sigqc_report.py
@@ -22,8 +31,154 @@ import os
 #   report.addSection(i_title="My Header", i_description="Some Text", i_figures=fig_to_save)
 #   report.writeReport()
 #
+#   ### Figures may also be passed in memory, without writing image files ###
+#   png = sigqc_render.renderPCBoxPlots(pcscores.T)
+#   report.addSection(i_title="Boxplot", i_figures=[png, matplotlib_figure])
+#
+#   ### Prepare sections in worker processes and add them in order ###
+#   sections = [functools.partial(prepareSection, "PC Scores", None, figs),
+#               ("Screening", "Unit(s) Failed: None")]
+#   report.addSections(sections, workers=4)
+#   print(report.getTimings())
+#
+# The template document is read once per process and each new report starts from a copy of
+# it. Section timings are logged to the "sigqc.sigqc_report" logger at INFO level.
+#
+#   ### Self-contained HTML report with the same API, written as sections are added ###
+#   report = SigQCHTMLReport("Results\\PCA_Results.html")
+#   report.addSection("PC Scores", "Unit(s) Tested: ...", i_figures=figs, i_table=rows)
+#   report.writeReport()
+#
 ################################################################################################
 
+_logger = logging.getLogger(__name__)
+
+# Parsed template documents by path, copied for each new report
+_templates = {}
+_templatelock = threading.Lock()
+
+def getTemplate(i_filename):
+    '''
+    Returns a new copy of a Word template document. The template file is read and parsed once
+    per process; later calls copy the parsed document instead of reading the file again.
+    '''
+    filename = os.path.abspath(i_filename)
+    with _templatelock:
+        template = _templates.get(filename)
+        if (template is None):
+            template = Document(filename)
+            _templates[filename] = template
+        return copy.deepcopy(template)
+
+def clearTemplateCache():
+    '''
+    Discards the cached template documents, e.g. after a template file was edited.
+    '''
+    with _templatelock:
+        _templates.clear()
+
+def _isFigure(i_figure):
+    '''
+    Returns True if the object is a single figure accepted by SigQCReport.addSection() rather
+    than a list of figures.
+    '''
+    return isinstance(i_figure, (str, bytes, bytearray, memoryview)) or hasattr(i_figure, "read") or hasattr(i_figure, "savefig")
+
+def _getPictureStream(i_figure):
+    '''
+    Returns a file name or binary stream of a figure that python-docx can read.
+    '''
+    if isinstance(i_figure, str):
+        return i_figure
+    if isinstance(i_figure, (bytes, bytearray, memoryview)):
+        return io.BytesIO(i_figure)
+    if hasattr(i_figure, "savefig"):
+        from sigqc import sigqc_render
+        return io.BytesIO(sigqc_render.saveFigure(i_figure))
+    if hasattr(i_figure, "seek"):
+        i_figure.seek(0)
+    return i_figure
+
+def _getFigureBytes(i_figure):
+    '''
+    Returns the image of a figure accepted by SigQCReport.addSection() as bytes.
+    '''
+    stream = _getPictureStream(i_figure)
+    if isinstance(stream, str):
+        with open(stream, 'rb') as f:
+            return f.read()
+    return stream.read()
+
+###############################
+# SigQCReportSection Class
+###############################
+class SigQCReportSection:
+    '''
+    The SigQCReportSection class holds the prepared content of one report section: its title,
+    description, figures as PNG bytes and table. Prepared sections can be created in worker
+    processes and added to a report in order with SigQCReport.addSections().
+    '''
+    def __init__(self, i_title, i_description=None, i_figures=None, i_table=None, i_prepare_ms=0.0):
+        self._title = i_title
+        self._description = i_description
+        self._figures = [] if (i_figures is None) else list(i_figures)
+        self._table = i_table
+        self._preparems = i_prepare_ms
+
+    def getTitle(self):
+        return self._title
+
+    def getDescription(self):
+        return self._description
+
+    def getFigures(self):
+        return self._figures
+
+    def getTable(self):
+        return self._table
+
+    def getPrepareTime(self):
+        '''
+        Returns the time spent preparing the section in milliseconds.
+        '''
+        return self._preparems
+
+def prepareSection(i_title, i_description=None, i_figures=None, i_table=None):
+    '''
+    Prepares the content of a report section, rendering matplotlib figures and reading image
+    files into PNG bytes, so the section can be prepared in a worker process and added to a
+    report later (see SigQCReport.addSections()). The arguments are those of
+    SigQCReport.addSection().
+
+    Return:
+        A SigQCReportSection.
+    '''
+    start = time.perf_counter()
+    with sigqc_instrument.span("report.prepare", section=i_title):
+        figures = []
+        if (i_figures is not None):
+            if _isFigure(i_figures):
+                i_figures = [i_figures]
+            figures = [_getFigureBytes(figure) for figure in i_figures]
+        table = None if (i_table is None) else [list(row) for row in i_table]
+    return SigQCReportSection(i_title, i_description, figures, table, 1000*(time.perf_counter()-start))
+
+def _prepareSpec(i_spec):
+    '''
+    Prepares one entry of SigQCReport.addSections(): a SigQCReportSection, a tuple or
+    dictionary of addSection() arguments, or a function returning one of these.
+    '''
+    start = time.perf_counter()
+    spec = i_spec() if callable(i_spec) else i_spec
+    if isinstance(spec, dict):
+        section = prepareSection(**spec)
+    elif isinstance(spec, SigQCReportSection):
+        section = spec
+    else:
+        section = prepareSection(*spec)
+    section._preparems = 1000*(time.perf_counter()-start)
+    return section
+
 ##########################
 # SigQCReport Class
 ##########################
@@ -39,8 +194,9 @@ class SigQCReport:
         which Document template to open and which to save as an external file.
         '''
         self._fpath = None
-        self._document = Document(os.path.join(os.path.dirname(__file__),'templates\\'+template_name))
+        self._document = getTemplate(os.path.join(os.path.dirname(__file__), 'templates', template_name))
         self._docname = None
+        self._timings = []
         
         # Set narrow margins to fit larger figures
         sections = self._document.sections
@@ -49,6 +205,19 @@ class SigQCReport:
         self._section.left_margin = Inches(0.8)
         self._section.right_margin = Inches(0.8)
     
+    def openReport(self, i_filename):
+        '''
+        Replaces the document of the SigQCReport object with an existing Word document, so that
+        new sections are appended to it. The file path and name of the object are set to those
+        of the document.
+        '''
+        self._document = Document(i_filename)
+        self._section = self._document.sections[0]
+        self._fpath = os.path.dirname(i_filename)
+        if (self._fpath != ""):
+            self._fpath = self._fpath + os.sep
+        self.setDocName(os.path.basename(i_filename))
+    
     def setFilePath(self, i_filepath): 
         '''
         Takes a string specifying the location of the Word document to be created from
@@ -66,7 +235,7 @@ class SigQCReport:
         else:
             self._docname = i_filename + ".docx"
     
-    def addSection(self, i_title, i_description = None, i_figures = None):
+    def addSection(self, i_title, i_description = None, i_figures = None, i_table = None):
         '''
         Adds a section within the Word document of the SigQCReport object underneath the specified
         title.
@@ -76,18 +245,99 @@ class SigQCReport:
             i_title - String describing the heading of the section of the Word document
             i_description - (Optional) Any string-like object that can be written to a
                 document that will precede the figures.
-            i_figures - (Optional) A string or list of strings specifying the filepath and filename
-                of any figures to be added to the document.
+            i_figures - (Optional) A figure or list of figures to be added to the document. Each
+                figure may be a string specifying the filepath and filename of an image, the
+                image itself as bytes or a binary file-like object (e.g. io.BytesIO), or a
+                matplotlib Figure, which is rendered in memory (see sigqc_render).
+            i_table - (Optional) A list of rows to be added as a table after the figures. The
+                first row is the header of the table.
         '''
-        self._document.add_heading(i_title)
-        if (i_description != None):
-            self._document.add_paragraph(i_description)
-        if (i_figures != None):
-            if not isinstance(i_figures, str):
+        start = time.perf_counter()
+        with sigqc_instrument.span("report.section", section=i_title):
+            self._document.add_heading(i_title)
+            if (i_description != None):
+                self._document.add_paragraph(i_description)
+            if (i_figures != None):
+                if _isFigure(i_figures):
+                    i_figures = [i_figures]
                 for figure in i_figures:
-                    self._document.add_picture(figure)
-            else:
-                self._document.add_picture(i_figures)
+                    self._document.add_picture(_getPictureStream(figure))
+            if (i_table != None):
+                self._addTable(i_table)
+        self._logTiming(i_title, 0.0, 1000*(time.perf_counter()-start))
+
+    def _addTable(self, i_table):
+        rows = [[str(value) for value in row] for row in i_table]
+        if (len(rows) == 0):
+            return
+        table = self._document.add_table(rows=len(rows), cols=max(len(row) for row in rows))
+        try:
+            table.style = 'Table Grid'
+        except (KeyError, ValueError):
+            pass
+        for i, row in enumerate(rows):
+            cells = table.rows[i].cells
+            for j, value in enumerate(row):
+                cells[j].text = value
+        for cell in table.rows[0].cells:
+            for run in cell.paragraphs[0].runs:
+                run.bold = True
+
+    def addPreparedSection(self, i_section):
+        '''
+        Adds a section prepared by prepareSection() to the Word document.
+        '''
+        start = time.perf_counter()
+        with sigqc_instrument.span("report.section", section=i_section.getTitle()):
+            self._document.add_heading(i_section.getTitle())
+            if (i_section.getDescription() != None):
+                self._document.add_paragraph(i_section.getDescription())
+            for figure in i_section.getFigures():
+                self._document.add_picture(io.BytesIO(figure))
+            if (i_section.getTable() != None):
+                self._addTable(i_section.getTable())
+        self._logTiming(i_section.getTitle(), i_section.getPrepareTime(), 1000*(time.perf_counter()-start))
+
+    def addSections(self, i_sections, workers=1, use_processes=True):
+        '''
+        Prepares a list of sections concurrently and adds them to the Word document in order.
+
+        Inputs
+        ------
+            i_sections - List of sections. Each entry is a SigQCReportSection, a tuple or
+                dictionary of addSection() arguments, or a function returning one of these,
+                e.g. functools.partial(prepareSection, title, description, figures). Functions
+                are called in the workers, so expensive rendering happens in parallel.
+            workers - (Optional) Number of workers. Defaults to 1 (prepare in this process).
+                None uses one worker per CPU.
+            use_processes - (Optional) Boolean specifying whether the workers are processes
+                (default) or threads. With processes, the entries must be picklable.
+        '''
+        i_sections = list(i_sections)
+        if (workers is None):
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(i_sections))
+        if (workers <= 1):
+            sections = [_prepareSpec(spec) for spec in i_sections]
+        else:
+            executor = ProcessPoolExecutor if (use_processes) else ThreadPoolExecutor
+            with executor(max_workers=workers) as pool:
+                sections = list(pool.map(_prepareSpec, i_sections))
+        for section in sections:
+            self.addPreparedSection(section)
+
+    def _logTiming(self, i_title, i_prepare_ms, i_add_ms):
+        self._timings.append({"section": i_title, "prepare_ms": i_prepare_ms, "add_ms": i_add_ms})
+        _logger.info("Report section '%s': prepared in %.1f ms, added in %.1f ms", i_title, i_prepare_ms, i_add_ms)
+
+    def getTimings(self):
+        '''
+        Returns a list with a dictionary for each section added to the report, holding the
+        section title, the time spent preparing its content and the time spent adding it to
+        the document in milliseconds. A final entry "(write)" holds the time spent saving the
+        document once writeReport() has been called.
+        '''
+        return list(self._timings)
     
     def writeReport(self, o_filepath = None, o_docname = None):
         '''
@@ -113,4 +363,201 @@ class SigQCReport:
             self.setDocName(o_docname)
         elif (self._docname == None):
             self.setDocName("SigQCReportDoc.docx")
-        self._document.save(self._fpath+self._docname)
+        start = time.perf_counter()
+        with sigqc_instrument.span("report.write", file=self._docname, format="docx"):
+            self._document.save(self._fpath+self._docname)
+        writems = 1000*(time.perf_counter()-start)
+        self._timings.append({"section": "(write)", "prepare_ms": 0.0, "add_ms": writems})
+        _logger.info("Report '%s' written in %.1f ms", self._fpath+self._docname, writems)
+
+
+# Style sheet and closing tags of SigQCHTMLReport documents
+_HTMLSTYLE = """body{font-family:Calibri,Arial,sans-serif;margin:2em auto;max-width:60em;color:#222}
+h1{border-bottom:2px solid #369}h2{color:#369;margin-top:1.6em}p{white-space:pre-wrap}
+img{max-width:100%;display:block;margin:0.5em 0}
+table{border-collapse:collapse;font-size:0.85em;margin:0.5em 0}
+th,td{border:1px solid #bbb;padding:2px 6px;text-align:right}th{background:#e8eef4}
+td:first-child,th:first-child{text-align:left}"""
+_HTMLFOOTER = "</main>\n</body>\n</html>\n"
+
+def _getImageURI(i_image):
+    '''
+    Returns a data URI embedding image bytes, with the type detected from the content.
+    '''
+    head = i_image[:256].lstrip()
+    if head.startswith(b"<?xml") or head.startswith(b"<svg") or (b"<svg" in head):
+        mime = "image/svg+xml"
+    elif i_image[:2] == b"\xff\xd8":
+        mime = "image/jpeg"
+    elif i_image[:3] == b"GIF":
+        mime = "image/gif"
+    else:
+        mime = "image/png"
+    return "data:{};base64,{}".format(mime, base64.b64encode(i_image).decode("ascii"))
+
+##############################
+# SigQCHTMLReport Class
+##############################
+class SigQCHTMLReport(SigQCReport):
+    '''
+    The SigQCHTMLReport class writes SigQC results as a single self-contained HTML file. It has
+    the same interface as SigQCReport, but each section is written to the file as soon as it
+    is added, so large reports do not accumulate in memory and the file can be read while it
+    is being built. Figures are embedded as data URIs and tables as HTML tables.
+    '''
+    def __init__(self, o_filename=None, title="SigQC Report", figure_format="png", dpi=None):
+        '''
+        Constructor of the SigQCHTMLReport class.
+
+        Input:
+            o_filename - (Optional) Path of the HTML file. May also be given with setFilePath()
+                         and setDocName() or writeReport() before the first section is added.
+            title - (Optional) Title shown at the top of the report.
+            figure_format - (Optional) Format matplotlib Figures are rendered in, "png"
+                            (default) or "svg". Images given as bytes or files are embedded
+                            as they are.
+            dpi - (Optional) Resolution of rendered PNG figures.
+        '''
+        self._fpath = None
+        self._docname = None
+        self._title = title
+        self._figureformat = figure_format
+        self._dpi = dpi
+        self._stream = None
+        self._streamname = None
+        self._append = False
+        self._timings = []
+        if (o_filename != None):
+            self.openReport(o_filename, i_append=False)
+
+    def openReport(self, i_filename, i_append=True):
+        '''
+        Sets the file of the report. If i_append is True (default) and the file is an existing
+        SigQCHTMLReport document, new sections are appended to it.
+        '''
+        self._fpath = os.path.dirname(i_filename)
+        if (self._fpath != ""):
+            self._fpath = self._fpath + os.sep
+        self.setDocName(os.path.basename(i_filename))
+        self._append = i_append and os.path.exists(i_filename)
+
+    def setDocName(self, i_filename):
+        '''
+        Takes a string specifying the name of the HTML file to be saved by the SigQCHTMLReport
+        object.
+        '''
+        if (".htm" in i_filename):
+            self._docname = i_filename
+        else:
+            self._docname = i_filename + ".html"
+
+    def _getFilename(self):
+        return ("" if (self._fpath == None) else self._fpath) + ("SigQCReportDoc.html" if (self._docname == None) else self._docname)
+
+    def _getStream(self):
+        '''
+        Returns the open HTML file, creating it with the document header (or reopening an
+        existing report before its closing tags) on first use.
+        '''
+        if (self._stream is None):
+            filename = self._getFilename() if (self._streamname is None) else self._streamname
+            if (self._append) and os.path.exists(filename):
+                # Remove the closing tags and continue writing sections
+                with open(filename, 'rb+') as f:
+                    end = f.seek(0, os.SEEK_END)
+                    start = f.seek(max(0, end-4096))
+                    position = f.read().rfind(b"</main>")
+                    if (position >= 0):
+                        f.truncate(start+position)
+                self._stream = open(filename, 'a', encoding="utf-8", newline="\n")
+            else:
+                self._stream = open(filename, 'w', encoding="utf-8", newline="\n")
+                title = html.escape(self._title)
+                self._stream.write("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n<title>{}</title>\n"
+                                   "<style>\n{}\n</style>\n</head>\n<body>\n<main>\n<h1>{}</h1>\n".format(title, _HTMLSTYLE, title))
+            self._streamname = filename
+            self._append = False
+        return self._stream
+
+    def _getFigureHTML(self, i_figure):
+        if hasattr(i_figure, "savefig"):
+            from sigqc import sigqc_render
+            dpi = sigqc_render.DEFAULT_DPI if (self._dpi is None) else self._dpi
+            image = sigqc_render.saveFigure(i_figure, o_format=self._figureformat, dpi=dpi)
+        else:
+            image = _getFigureBytes(i_figure)
+        return "<img src=\"{}\">\n".format(_getImageURI(bytes(image)))
+
+    def _writeSection(self, i_title, i_description, i_figures, i_table):
+        stream = self._getStream()
+        stream.write("<section>\n<h2>{}</h2>\n".format(html.escape(str(i_title))))
+        if (i_description != None):
+            stream.write("<p>{}</p>\n".format(html.escape(str(i_description))))
+        if (i_figures != None):
+            if _isFigure(i_figures):
+                i_figures = [i_figures]
+            for figure in i_figures:
+                stream.write(self._getFigureHTML(figure))
+        if (i_table != None):
+            self._addTable(i_table)
+        stream.write("</section>\n")
+        stream.flush()
+
+    def _addTable(self, i_table):
+        stream = self._getStream()
+        rows = iter(i_table)
+        header = next(rows, None)
+        if (header is None):
+            return
+        stream.write("<table>\n<thead><tr>"+"".join("<th>"+html.escape(str(value))+"</th>" for value in header)+"</tr></thead>\n<tbody>\n")
+        lines = []
+        for row in rows:
+            lines.append("<tr>"+"".join("<td>"+html.escape(str(value))+"</td>" for value in row)+"</tr>\n")
+            if (len(lines) >= 1000):
+                stream.write("".join(lines))
+                lines = []
+        stream.write("".join(lines)+"</tbody>\n</table>\n")
+
+    def addSection(self, i_title, i_description = None, i_figures = None, i_table = None):
+        '''
+        Writes a section to the HTML file. The arguments are those of SigQCReport.addSection();
+        i_table may also be an iterable of rows, which is written as it is consumed.
+        '''
+        start = time.perf_counter()
+        with sigqc_instrument.span("report.section", section=i_title):
+            self._writeSection(i_title, i_description, i_figures, i_table)
+        self._logTiming(i_title, 0.0, 1000*(time.perf_counter()-start))
+
+    def addPreparedSection(self, i_section):
+        '''
+        Writes a section prepared by prepareSection() to the HTML file.
+        '''
+        start = time.perf_counter()
+        with sigqc_instrument.span("report.section", section=i_section.getTitle()):
+            self._writeSection(i_section.getTitle(), i_section.getDescription(), i_section.getFigures(), i_section.getTable())
+        self._logTiming(i_section.getTitle(), i_section.getPrepareTime(), 1000*(time.perf_counter()-start))
+
+    def writeReport(self, o_filepath = None, o_docname = None):
+        '''
+        Completes the HTML file and closes it. If a different file path or name is given than
+        the one the sections were written to, the file is moved there.
+        '''
+        if (o_filepath != None):
+            self.setFilePath(o_filepath)
+        if (o_docname != None):
+            self.setDocName(o_docname)
+        start = time.perf_counter()
+        with sigqc_instrument.span("report.write", file=self._docname, format="html"):
+            stream = self._getStream()
+            stream.write(_HTMLFOOTER)
+            stream.close()
+            self._stream = None
+            filename = self._getFilename()
+            if (os.path.abspath(filename) != os.path.abspath(self._streamname)):
+                os.replace(self._streamname, filename)
+        self._streamname = filename
+        # Sections added after writing are appended to the completed file
+        self._append = True
+        writems = 1000*(time.perf_counter()-start)
+        self._timings.append({"section": "(write)", "prepare_ms": 0.0, "add_ms": writems})
+        _logger.info("Report '%s' written in %.1f ms", filename, writems)
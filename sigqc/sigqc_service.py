@@ -0,0 +1,445 @@
+import numpy as np
+import os
+import json
+import time
+import queue
+import stat
+import socket
+import threading
+import http.client
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from sigqc import sigqc_referencemodel
+from sigqc import sigqc_spc
+
+#########################################################################################################################
+# sigqc_service.py
+#
+# Long-running local scoring service that keeps reference models loaded in memory and answers
+# score requests over localhost HTTP or a Unix domain socket (standard library only). A request
+# names a SigQC export file or carries an inline matrix of units, and the service returns the
+# PC scores and Hotelling's T-squared statistic of each unit. Requests that arrive within a
+# short batching window are stacked and scored with a single matrix multiply per model.
+#
+# Requests are JSON objects POSTed to /score:
+#  {"model": "X15", "file": "C:\\exports\\X15_today.csv", "input_type": "ascii", "n_pcs": 5}
+#  {"model": "X15", "data": [[...], [...]], "featurekeys": [...], "serials": [...]}
+#
+# and are answered with:
+#  {"model": "X15", "serials": [...], "pcscores": [[...]], "t2": [...], "n_pcs": 5,
+#   "latency_ms": 3.1, "queue_ms": 1.2, "batch_requests": 4, "batch_units": 52}
+#
+# GET /health, /models and /stats return the service status, the loaded models and the
+# request latency statistics.
+#
+# Example Usage:
+#  service = SigQCScoringService({"X15": "[full path here]\\ReferenceData.csv"})
+#  service.serve(port=8765)                          # blocks, or
+#  service.serve(socket_path="/tmp/sigqc.sock")
+#
+#  ### From a station tool ###
+#  result = scoreRemote({"model": "X15", "data": units.tolist()}, port=8765)
+#
+#########################################################################################################################
+
+# Default TCP port of the scoring service
+DEFAULT_PORT = 8765
+
+# Default number of principal components returned per unit
+DEFAULT_PCS = 10
+
+class _PendingRequest:
+    '''
+    A parsed score request waiting in the batching queue.
+    '''
+    def __init__(self, i_model, i_name, i_dataset, n_pcs):
+        self.model = i_model
+        self.name = i_name
+        self.dataset = i_dataset
+        self.n_pcs = n_pcs
+        self.queued = time.perf_counter()
+        self.started = None
+        self.batchrequests = 0
+        self.batchunits = 0
+        self.pcscores = None
+        self.t2 = None
+        self.error = None
+        self.done = threading.Event()
+
+###################################
+# SigQCScoringService class
+###################################
+class SigQCScoringService:
+    '''
+    The SigQCScoringService class holds a set of named reference models and scores units against
+    them. submit() may be called from many threads at once; concurrent requests for the same
+    model and number of PCs are scored together by a single batching thread.
+    '''
+    def __init__(self, i_models=None, batch_window=0.002, max_batch_units=65536, mmap=False):
+        '''
+        Constructor for an instance of the SigQCScoringService class.
+
+        Input:
+            i_models - (Optional) Dictionary mapping model names to SigQCReferenceModel
+                       instances or paths to reference data files.
+            batch_window - (Optional) Time in seconds the batching thread waits for further
+                           requests after the first one arrives. Defaults to 2 ms.
+            max_batch_units - (Optional) Maximum number of units scored in one batch.
+            mmap - (Optional) Boolean specifying whether binary reference data files given by
+                   path are memory-mapped. Defaults to False.
+        '''
+        self._models = {}
+        self._batchwindow = batch_window
+        self._maxbatchunits = max_batch_units
+        self._mmap = mmap
+        self._queue = queue.Queue()
+        self._thread = None
+        self._server = None
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._batches = 0
+        self._latencies = []
+        if (i_models is not None):
+            for name, model in i_models.items():
+                self.addModel(name, model)
+
+    def addModel(self, i_name, i_model):
+        '''
+        Loads a reference model under a name, replacing any model of the same name.
+
+        Input:
+            i_name - Name used by requests to select the model.
+            i_model - SigQCReferenceModel instance or path to a reference data file.
+        '''
+        if not isinstance(i_model, sigqc_referencemodel.SigQCReferenceModel):
+            i_model = sigqc_referencemodel.SigQCReferenceModel(i_model, mmap=self._mmap)
+        with self._lock:
+            self._models[i_name] = i_model
+
+    def removeModel(self, i_name):
+        '''
+        Unloads the reference model of the given name.
+        '''
+        with self._lock:
+            del self._models[i_name]
+
+    def getModel(self, i_name):
+        '''
+        Returns the SigQCReferenceModel loaded under the given name.
+        '''
+        with self._lock:
+            if (i_name not in self._models):
+                raise KeyError("Error: No reference model named '{}' is loaded".format(i_name))
+            return self._models[i_name]
+
+    def getModelNames(self):
+        '''
+        Returns a sorted list of the names of the loaded reference models.
+        '''
+        with self._lock:
+            return sorted(self._models)
+
+    def start(self):
+        '''
+        Starts the batching thread. Called automatically by submit() and serve().
+        '''
+        with self._lock:
+            if (self._thread is None) or (not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._runBatches, name="sigqc-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, i_request):
+        '''
+        Scores a request and waits for the result.
+
+        Input:
+            i_request - Dictionary with the keys:
+                model - Name of the reference model.
+                file - (Optional) Path to a SigQC export file whose units are scored.
+                input_type - (Optional) "ascii" (default) or "unit" for file requests.
+                data - (Optional) Inline 2D list of units in rows, used if no file is given.
+                featurekeys - (Optional) Feature keys of the inline data columns.
+                serials - (Optional) Serial numbers of the inline units.
+                n_pcs - (Optional) Number of PCs returned. Defaults to DEFAULT_PCS.
+
+        Return:
+            A dictionary with the model name, serial numbers, PC scores and T-squared statistic
+            of the units, and the latency of the request in milliseconds.
+        '''
+        received = time.perf_counter()
+        try:
+            name = i_request["model"]
+            model = self.getModel(name)
+            if (i_request.get("file") is not None):
+                serials, headers, dataset, keys = sigqc_referencemodel.readDataset(i_request["file"], i_request.get("input_type", "ascii"), use_cache=True, return_keys=True)
+            elif (i_request.get("data") is not None):
+                dataset = np.array(i_request["data"], dtype=float, ndmin=2)
+                keys = i_request.get("featurekeys")
+                serials = i_request.get("serials")
+            else:
+                raise Exception("Error: A score request needs either a 'file' or a 'data' entry")
+            dataset = model.alignDataset(dataset, keys)
+            if (np.shape(dataset)[1] != model.getFeatureCount()):
+                raise Exception("Error: The request has {} features but model '{}' has {}".format(np.shape(dataset)[1], name, model.getFeatureCount()))
+            n_pcs = self._getPCCount(model, i_request.get("n_pcs"))
+
+            pending = _PendingRequest(model, name, dataset, n_pcs)
+            self.start()
+            self._queue.put(pending)
+            pending.done.wait()
+            if (pending.error is not None):
+                raise pending.error
+        except Exception:
+            with self._lock:
+                self._requests += 1
+                self._errors += 1
+            raise
+
+        finished = time.perf_counter()
+        latency = 1000*(finished-received)
+        with self._lock:
+            self._requests += 1
+            self._latencies.append(latency)
+            if (len(self._latencies) > 10000):
+                del self._latencies[:5000]
+        return {"model": name, "serials": None if (serials is None) else list(serials),
+                "pcscores": pending.pcscores.tolist(), "t2": pending.t2.tolist(), "n_pcs": n_pcs,
+                "latency_ms": latency, "queue_ms": 1000*(pending.started-pending.queued),
+                "batch_requests": pending.batchrequests, "batch_units": pending.batchunits}
+
+    def _getPCCount(self, i_model, n_pcs):
+        '''
+        Limits the number of PCs to those with a positive eigenvalue, so T-squared is defined.
+        '''
+        positive = int(np.count_nonzero(np.asarray(i_model.getEigenvalues()) > 0))
+        if (n_pcs is None):
+            return min(DEFAULT_PCS, positive)
+        if (n_pcs < 1) or (n_pcs > positive):
+            raise Exception("Error: n_pcs must be between 1 and {}".format(positive))
+        return int(n_pcs)
+
+    def _runBatches(self):
+        '''
+        Takes requests from the queue, gathers those arriving within the batching window and
+        scores each group of requests for the same model and number of PCs together.
+        '''
+        while True:
+            pending = [self._queue.get()]
+            units = len(pending[0].dataset)
+            deadline = time.perf_counter() + self._batchwindow
+            while (units < self._maxbatchunits):
+                timeout = deadline - time.perf_counter()
+                if (timeout <= 0):
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                units += len(item.dataset)
+
+            groups = {}
+            for item in pending:
+                groups.setdefault((id(item.model), item.n_pcs), []).append(item)
+            for group in groups.values():
+                self._scoreBatch(group)
+
+    def _scoreBatch(self, i_group):
+        started = time.perf_counter()
+        model = i_group[0].model
+        n_pcs = i_group[0].n_pcs
+        try:
+            batch = i_group[0].dataset if (len(i_group) == 1) else np.vstack([item.dataset for item in i_group])
+            pcscores = model.score(batch, n_pcs)
+            t2 = sigqc_spc.getHotellingT2(pcscores, model.getEigenvalues(), n_pcs)
+            error = None
+        except Exception as e:
+            error = e
+        with self._lock:
+            self._batches += 1
+
+        start = 0
+        for item in i_group:
+            stop = start + len(item.dataset)
+            item.started = started
+            item.batchrequests = len(i_group)
+            item.batchunits = len(batch) if (error is None) else 0
+            if (error is None):
+                item.pcscores = pcscores[start:stop]
+                item.t2 = t2[start:stop]
+            item.error = error
+            item.done.set()
+            start = stop
+
+    def getStats(self):
+        '''
+        Returns a dictionary with the number of requests, errors and batches handled and the
+        median, 95th percentile and maximum request latency in milliseconds.
+        '''
+        with self._lock:
+            latencies = np.array(self._latencies)
+            stats = {"requests": self._requests, "errors": self._errors, "batches": self._batches,
+                     "models": sorted(self._models)}
+        if (len(latencies) > 0):
+            stats["latency_ms"] = {"median": float(np.median(latencies)), "p95": float(np.percentile(latencies, 95)),
+                                   "max": float(np.max(latencies))}
+        return stats
+
+    def serve(self, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None, background=False):
+        '''
+        Answers score requests over HTTP until shutdown() is called.
+
+        Input:
+            host - (Optional) Interface to listen on. Defaults to localhost only.
+            port - (Optional) TCP port to listen on. Defaults to DEFAULT_PORT.
+            socket_path - (Optional) Path of a Unix domain socket to listen on instead of TCP.
+                          A stale socket at the path is replaced; any other file raises.
+            background - (Optional) Boolean specifying whether the server runs in a background
+                         thread and serve() returns immediately. Defaults to False.
+
+        Return:
+            The address the server listens on: a (host, port) tuple or the socket path.
+        '''
+        if (socket_path is not None):
+            # Remove the socket left by an earlier server, but never another kind of file
+            if os.path.lexists(socket_path):
+                if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                    raise Exception("Error: {} exists and is not a socket".format(socket_path))
+                os.remove(socket_path)
+            server = _UnixHTTPServer(socket_path, _ScoringHandler)
+        else:
+            server = _ThreadingHTTPServer((host, port), _ScoringHandler)
+        server.service = self
+        self._server = server
+        self.start()
+
+        address = server.server_address
+        if (background):
+            threading.Thread(target=server.serve_forever, name="sigqc-server", daemon=True).start()
+        else:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.shutdown()
+        return address
+
+    def shutdown(self):
+        '''
+        Stops a server started with serve() and removes its Unix domain socket.
+        '''
+        server = self._server
+        self._server = None
+        if (server is None):
+            return
+        server.shutdown()
+        server.server_close()
+        if isinstance(server, _UnixHTTPServer) and os.path.exists(server.server_address):
+            os.remove(server.server_address)
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+class _ScoringHandler(BaseHTTPRequestHandler):
+    '''
+    Translates HTTP requests into calls of the SigQCScoringService of the server.
+    '''
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        service = self.server.service
+        if (self.path == "/health"):
+            self._reply(200, {"status": "ok"})
+        elif (self.path == "/models"):
+            models = {}
+            for name in service.getModelNames():
+                model = service.getModel(name)
+                models[name] = {"features": model.getFeatureCount(), "pcs": model.getPCCount(),
+                                "units": model.getUnitCount(), "filename": model.getFilename()}
+            self._reply(200, models)
+        elif (self.path == "/stats"):
+            self._reply(200, service.getStats())
+        else:
+            self._reply(404, {"error": "Error: Unknown path '{}'".format(self.path)})
+
+    def do_POST(self):
+        if (self.path != "/score"):
+            self._reply(404, {"error": "Error: Unknown path '{}'".format(self.path)})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            self._reply(200, self.server.service.submit(request))
+        except KeyError as e:
+            self._reply(404, {"error": str(e.args[0]) if e.args else str(e)})
+        except Exception as e:
+            self._reply(400, {"error": str(e)})
+
+    def _reply(self, i_status, i_body):
+        body = json.dumps(i_body).encode("utf-8")
+        self.send_response(i_status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix domain socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    '''
+    HTTP connection over a Unix domain socket.
+    '''
+    def __init__(self, i_socketpath, timeout=None):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self._socketpath = i_socketpath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if (self.timeout is not None):
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socketpath)
+
+def scoreRemote(i_request, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None, timeout=30, path="/score"):
+    '''
+    Sends a request to a running scoring service and returns its JSON answer.
+
+    Inputs
+    ------
+        i_request - Dictionary of the request (see SigQCScoringService.submit()), or None to GET path.
+        host, port - (Optional) Address of a service listening on TCP.
+        socket_path - (Optional) Path of the Unix domain socket of the service, used instead of TCP.
+        timeout - (Optional) Timeout in seconds. Defaults to 30.
+        path - (Optional) Request path. Defaults to "/score".
+
+    Outputs
+    -------
+        Returns the decoded JSON answer as a dictionary. Raises an exception with the error
+        message of the service if the request failed.
+    '''
+    if (socket_path is not None):
+        connection = _UnixHTTPConnection(socket_path, timeout=timeout)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        if (i_request is None):
+            connection.request("GET", path)
+        else:
+            body = json.dumps(i_request)
+            connection.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        answer = json.loads(response.read().decode("utf-8"))
+    finally:
+        connection.close()
+    if (response.status != 200):
+        raise Exception(answer.get("error", "Error: Request failed with status {}".format(response.status)))
+    return answer
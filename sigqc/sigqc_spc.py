@@ -0,0 +1,261 @@
+import numpy as np
+from scipy import stats
+from sigqc import sigqc_pca
+
+#########################################################################################################################
+# sigqc_spc.py
+#
+# Multivariate statistical process control statistics for screening production units
+# against a reference (good unit) PCA model. Hotelling's T-squared measures how far a unit
+# lies from the reference mean within the retained principal component subspace, and the
+# squared prediction error (SPE, or Q statistic) measures how far it lies outside of that
+# subspace. Both statistics are computed for every unit in a single batched matrix pass.
+#
+# Example Usage:
+#  evals, evecs = sigqc_pca.getEigenFromData(refdata)
+#  avgvec = np.mean(refdata, axis=0)
+#  t2, spe = getT2AndSPE(testdata, avgvec, evals, evecs, n_pcs=5)
+#  t2_limit = getT2Limit(len(refdata[:,0]), n_pcs=5, alpha=0.01)
+#  spe_limit = getSPELimit(evals, n_pcs=5, alpha=0.01)
+#  failed = (t2 > t2_limit) | (spe > spe_limit)
+#
+#########################################################################################################################
+
+# Smallest h0 of the Jackson-Mudholkar SPE limit used before falling back to Box's approximation
+JACKSON_MIN_H0 = 0.1
+
+def centerData(i_dataset, i_avgvec, i_stddev=None):
+    '''
+    Centers (and optionally scales) a dataset with the average vector and standard deviations
+    of a reference dataset.
+
+    Inputs
+    ------
+        i_dataset - 2D array-like with units in rows and features in columns
+        i_avgvec - 1D array-like holding the reference mean of each feature
+        i_stddev - (Optional) 1D array-like holding the reference standard deviation of each
+            feature. Should be given when the reference eigensystem was computed from the
+            correlation matrix.
+
+    Outputs
+    -------
+        Returns the centered dataset as a 2D numpy array.
+    '''
+    centered = np.asarray(i_dataset, dtype=float) - i_avgvec
+    if (i_stddev is not None):
+        centered /= i_stddev
+    return centered
+
+def _checkPCs(i_evals, n_pcs, n_columns=None):
+    '''
+    Validates the number of retained principal components against the eigenvalues and, if
+    given, the number of eigenvector (or PC score) columns, which a model stored with fewer
+    PCs than eigenvalues limits.
+    '''
+    available = len(i_evals) if (n_columns is None) else min(len(i_evals), n_columns)
+    if (n_pcs == None):
+        n_pcs = available
+    if (n_pcs > available):
+        raise Exception("Error: n_pcs ({}) exceeds the {} PCs available in the reference eigensystem".format(n_pcs, available))
+    if (n_pcs < 1) or (np.any(np.asarray(i_evals[:n_pcs]) <= 0)):
+        raise Exception("Error: n_pcs must select between one PC and the number of PCs with a positive eigenvalue")
+    return n_pcs
+
+def getHotellingT2(i_pcscores, i_evals, n_pcs=None):
+    '''
+    Calculates Hotelling's T-squared statistic of each unit from its principal component scores.
+
+    Inputs
+    ------
+        i_pcscores - 2D array-like of PC scores with units in rows (see sigqc_pca.getPCScores())
+        i_evals - Eigenvalues of the reference eigensystem in descending order
+        n_pcs - (Optional) Number of retained principal components. Defaults to all PCs.
+
+    Outputs
+    -------
+        Returns the T-squared statistic of each unit as a 1D numpy array.
+    '''
+    scores = np.asarray(i_pcscores)
+    n_pcs = _checkPCs(i_evals, n_pcs, np.shape(scores)[1])
+    scores = scores[:,:n_pcs]
+    return np.einsum('ij,ij->i', scores, scores/i_evals[:n_pcs])
+
+def getSPE(i_centered, i_evects, n_pcs=None, i_pcscores=None):
+    '''
+    Calculates the squared prediction error (Q statistic) of each unit, which is the squared
+    distance of the unit from the subspace spanned by the retained principal components.
+
+    Inputs
+    ------
+        i_centered - 2D array-like of the centered (and scaled, if the correlation matrix
+            was used) units in rows (see centerData())
+        i_evects - Eigenvectors of the reference eigensystem as columns
+        n_pcs - (Optional) Number of retained principal components. Defaults to all PCs.
+        i_pcscores - (Optional) The PC scores of the units if already calculated.
+
+    Outputs
+    -------
+        Returns the squared prediction error of each unit as a 1D numpy array.
+    '''
+    if (n_pcs == None):
+        n_pcs = len(i_evects[0,:])
+    centered = np.asarray(i_centered)
+    if (i_pcscores is None):
+        scores = np.dot(centered, i_evects[:,:n_pcs])
+    else:
+        scores = np.asarray(i_pcscores)[:,:n_pcs]
+
+    # Eigenvectors are orthonormal, so the residual norm is the total norm less the
+    # norm of the projection.
+    spe = np.einsum('ij,ij->i', centered, centered) - np.einsum('ij,ij->i', scores, scores)
+    return np.clip(spe, 0, None)
+
+def getT2AndSPE(i_dataset, i_avgvec, i_evals, i_evects, n_pcs=None, i_stddev=None, chunk_rows=sigqc_pca.CHUNK_ROWS, dtype=None):
+    '''
+    Calculates Hotelling's T-squared statistic and the squared prediction error of every unit
+    in the dataset against a reference eigensystem. The dataset is centered and projected in
+    blocks of rows (see sigqc_pca.getCenteredChunks()), so no centered copy of it is made.
+
+    Inputs
+    ------
+        i_dataset - 2D array-like with units in rows and features in columns
+        i_avgvec - 1D array-like holding the reference mean of each feature
+        i_evals - Eigenvalues of the reference eigensystem in descending order
+        i_evects - Eigenvectors of the reference eigensystem as columns
+        n_pcs - (Optional) Number of retained principal components. Defaults to all PCs.
+        i_stddev - (Optional) Reference standard deviations when the correlation matrix was used.
+        chunk_rows - (Optional) Number of units processed at a time.
+        dtype - (Optional) Floating point type to compute with (see sigqc_pca.getComputeType()).
+
+    Outputs
+    -------
+        Returns a tuple containing the T-squared statistics and squared prediction errors of
+        the units as 1D numpy arrays.
+    '''
+    n_pcs = _checkPCs(i_evals, n_pcs, np.shape(i_evects)[1])
+    dtype = sigqc_pca.getComputeType(i_dataset, dtype)
+    evecs = np.ascontiguousarray(np.asarray(i_evects)[:,:n_pcs], dtype=dtype)
+    n_rows = np.shape(i_dataset)[0]
+    t2 = np.empty(n_rows, dtype=dtype)
+    spe = np.empty(n_rows, dtype=dtype)
+    for start, stop, block in sigqc_pca.getCenteredChunks(i_dataset, i_avgvec, i_stddev, chunk_rows, dtype):
+        scores = np.dot(block, evecs)
+        t2[start:stop] = getHotellingT2(scores, i_evals, n_pcs)
+        spe[start:stop] = getSPE(block, evecs, n_pcs, i_pcscores=scores)
+    return t2, spe
+
+def getT2Contributions(i_centered, i_evals, i_evects, n_pcs=None):
+    '''
+    Calculates the contribution of each feature to the T-squared statistic of each unit. The
+    contributions of a unit sum to its T-squared statistic.
+
+    Inputs
+    ------
+        i_centered - 2D array-like of the centered units in rows (see centerData())
+        i_evals - Eigenvalues of the reference eigensystem in descending order
+        i_evects - Eigenvectors of the reference eigensystem as columns
+        n_pcs - (Optional) Number of retained principal components. Defaults to all PCs.
+
+    Outputs
+    -------
+        Returns a 2D numpy array with units in rows and the contributions of each feature in columns.
+    '''
+    n_pcs = _checkPCs(i_evals, n_pcs, np.shape(i_evects)[1])
+    centered = np.asarray(i_centered)
+    evecs = i_evects[:,:n_pcs]
+    weighted = np.dot(centered, evecs)/i_evals[:n_pcs]
+    return centered*np.dot(weighted, evecs.T)
+
+def getSPEContributions(i_centered, i_evects, n_pcs=None):
+    '''
+    Calculates the contribution of each feature to the squared prediction error of each unit,
+    which is the squared residual of the feature. The contributions of a unit sum to its SPE.
+
+    Inputs
+    ------
+        i_centered - 2D array-like of the centered units in rows (see centerData())
+        i_evects - Eigenvectors of the reference eigensystem as columns
+        n_pcs - (Optional) Number of retained principal components. Defaults to all PCs.
+
+    Outputs
+    -------
+        Returns a 2D numpy array with units in rows and the contributions of each feature in columns.
+    '''
+    if (n_pcs == None):
+        n_pcs = len(i_evects[0,:])
+    centered = np.asarray(i_centered)
+    evecs = i_evects[:,:n_pcs]
+    residuals = centered - np.dot(np.dot(centered, evecs), evecs.T)
+    return residuals**2
+
+def getT2Limit(n_units, n_pcs, alpha=0.05, method="f"):
+    '''
+    Calculates the upper control limit of Hotelling's T-squared statistic for new units scored
+    against a reference model.
+
+    Inputs
+    ------
+        n_units - Number of units in the reference dataset
+        n_pcs - Number of retained principal components
+        alpha - (Optional) Significance level (false alarm rate). Defaults to 0.05.
+        method - (Optional) "f" uses the F distribution, which accounts for the mean and
+            covariance being estimated from n_units reference units. "chi2" uses the large
+            sample chi-square approximation. Defaults to "f".
+
+    Outputs
+    -------
+        Returns the control limit as a float.
+    '''
+    if (method.lower() == "f"):
+        if (n_units <= n_pcs):
+            raise Exception("Error: The F based T-squared limit needs more reference units than retained PCs")
+        scale = n_pcs*(n_units-1)*(n_units+1)/(n_units*(n_units-n_pcs))
+        return scale*stats.f.ppf(1-alpha, n_pcs, n_units-n_pcs)
+    elif (method.lower() == "chi2"):
+        return stats.chi2.ppf(1-alpha, n_pcs)
+    else:
+        raise Exception("Error: Please provide a valid method. Valid options include 'f' and 'chi2'")
+
+def getSPELimit(i_evals, n_pcs, alpha=0.05, method="jackson"):
+    '''
+    Calculates the upper control limit of the squared prediction error from the eigenvalues of
+    the principal components that were not retained.
+
+    Inputs
+    ------
+        i_evals - All nonzero eigenvalues of the reference eigensystem in descending order
+        n_pcs - Number of retained principal components
+        alpha - (Optional) Significance level (false alarm rate). Defaults to 0.05.
+        method - (Optional) "jackson" uses the Jackson-Mudholkar normal approximation and
+            "chi2" uses Box's scaled chi-square approximation. Defaults to "jackson", which
+            falls back to "chi2" when the residual eigenvalues are too uneven for it.
+
+    Outputs
+    -------
+        Returns the control limit as a float. Returns 0.0 if no residual variance remains.
+    '''
+    residual = np.asarray(i_evals[n_pcs:], dtype=float)
+    residual = residual[residual > 0]
+    theta1 = np.sum(residual)
+    theta2 = np.sum(residual**2)
+    theta3 = np.sum(residual**3)
+    if (theta1 == 0):
+        return 0.0
+
+    if (method.lower() == "jackson"):
+        h0 = 1 - (2*theta1*theta3)/(3*theta2**2)
+        z = stats.norm.ppf(1-alpha)
+        term = z*np.sqrt(2*theta2*h0**2)/theta1 + 1 + theta2*h0*(h0-1)/theta1**2
+        # The approximation breaks down when one residual eigenvalue dominates (h0 at or near
+        # zero) and can then fall below the mean SPE theta1. Use Box's approximation instead.
+        if (h0 > JACKSON_MIN_H0) and (term > 0):
+            limit = theta1*term**(1/h0)
+            if (np.isfinite(limit)) and (limit > theta1):
+                return limit
+        method = "chi2"
+    if (method.lower() == "chi2"):
+        g = theta2/theta1
+        h = theta1**2/theta2
+        return g*stats.chi2.ppf(1-alpha, h)
+    else:
+        raise Exception("Error: Please provide a valid method. Valid options include 'jackson' and 'chi2'")
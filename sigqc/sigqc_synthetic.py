@@ -0,0 +1,224 @@
+import numpy as np
+import os
+from datetime import datetime, timedelta
+
+#########################################################################################################################
+# sigqc_synthetic.py
+#
+# Generator of synthetic SigQC exports for benchmarks and examples. A SigQCSyntheticProduct
+# describes a product with a number of test cases, each measured at a number of domain points
+# (e.g. frequencies). Every unit is the product's mean curve plus a small number of smooth
+# latent factors shared by all units plus measurement noise, so PCA of the generated data has
+# a realistic, decaying eigenvalue spectrum. A fraction of units can be made defective by
+# shifting them along a factor the reference units do not vary in.
+#
+# The product can be written as a SigQC ASCII test case file (BEGINHEADER/BEGINDATA/BEGINLIMITS
+# sections for each test case) or as a SigQC unit data file (one column per test case), with a
+# configurable rate of missing values ("--------") in unit data files. The same seed always
+# produces the same files.
+#
+# Example Usage:
+#  product = SigQCSyntheticProduct(n_cases=20, n_points=100, seed=1)
+#  product.writeAsciiTestCaseFile("Reference.csv", n_units=500)
+#  product.writeAsciiTestCaseFile("Production.csv", n_units=20000, first_unit=500, defect_rate=0.01)
+#  product.writeUnitDataFile("UnitData.csv", n_units=5000, missing_rate=0.02)
+#
+#########################################################################################################################
+
+# Marker of a missing value in SigQC unit data files
+MISSING_VALUE = "--------"
+# Number of units generated and written at a time
+CHUNK_UNITS = 2000
+
+###################################
+# SigQCSyntheticProduct class
+###################################
+class SigQCSyntheticProduct:
+    '''
+    The SigQCSyntheticProduct class generates synthetic measurements of production units and
+    writes them in the SigQC export formats.
+    '''
+    def __init__(self, n_cases=10, n_points=50, n_tests=1, n_factors=5, noise=0.2, product="X15", seed=0):
+        '''
+        Constructor for an instance of the SigQCSyntheticProduct class.
+
+        Input:
+            n_cases - (Optional) Number of test cases per acceptance test.
+            n_points - (Optional) Number of domain points of each test case in ASCII test case
+                       files. Unit data files hold one value per test case.
+            n_tests - (Optional) Number of acceptance tests. Test cases are split evenly
+                      between them.
+            n_factors - (Optional) Number of latent factors shared by the units.
+            noise - (Optional) Standard deviation of the measurement noise in the units of the
+                    curves (dB).
+            product - (Optional) Product name written to the headers.
+            seed - (Optional) Seed of the random number generator.
+        '''
+        if (n_cases < 1) or (n_points < 1) or (n_tests < 1):
+            raise Exception("Error: A synthetic product needs at least one test, test case and domain point")
+        self._ncases = n_cases
+        self._npoints = n_points
+        self._ntests = min(n_tests, n_cases)
+        self._nfactors = n_factors
+        self._noise = noise
+        self._product = product
+        self._seed = seed
+
+        rng = np.random.default_rng(seed)
+        self._domain = np.round(np.geomspace(20.0, 20000.0, n_points), 1) if (n_points > 1) else np.array([1000.0])
+        # Mean curves: a resonance peak per test case over a sloped baseline (dB-like levels)
+        position = np.linspace(0.0, 1.0, n_points)
+        peaks = rng.uniform(0.1, 0.9, n_cases)
+        widths = rng.uniform(0.03, 0.15, n_cases)
+        levels = rng.uniform(60.0, 90.0, n_cases)
+        self._mean = (levels[:,None] - 10.0*position[None,:]
+                      + 12.0*np.exp(-0.5*((position[None,:]-peaks[:,None])/widths[:,None])**2)).reshape(-1)
+        # Smooth latent factor loadings with decaying strength
+        n_features = n_cases*n_points
+        knots = rng.normal(size=(n_factors, n_cases, 4))
+        grid = np.linspace(0.0, 1.0, 4)
+        loadings = np.array([[np.interp(position, grid, knots[f,c]) for c in range(n_cases)] for f in range(n_factors)])
+        self._loadings = loadings.reshape(n_factors, n_features) * (2.0/np.arange(1, n_factors+1))[:,None]
+        # Defects shift units along a direction the reference units do not vary in
+        self._defect = rng.normal(size=n_features)
+        self._defect *= 3.0*noise*np.sqrt(n_features)/np.linalg.norm(self._defect)
+
+    def getFeatureCount(self):
+        '''
+        Returns the number of features of a unit in ASCII test case files.
+        '''
+        return self._ncases*self._npoints
+
+    def getTestName(self, i_case):
+        '''
+        Returns the acceptance test name of a test case.
+        '''
+        return "Test{}".format(1 + i_case*self._ntests//self._ncases)
+
+    def getCaseName(self, i_case):
+        '''
+        Returns the name of a test case.
+        '''
+        return "Case{:03d}".format(i_case+1)
+
+    def getDomain(self):
+        '''
+        Returns the domain values of the test cases.
+        '''
+        return self._domain
+
+    def getUnits(self, n_units, first_unit=0, defect_rate=0.0):
+        '''
+        Generates the measurements of units. Units are generated from their own random streams,
+        so unit i is the same whichever chunk it is generated in.
+
+        Inputs
+        ------
+            n_units - Number of units.
+            first_unit - (Optional) Index of the first unit, used for serial numbers and
+                timestamps.
+            defect_rate - (Optional) Fraction of units that are defective.
+
+        Outputs
+        -------
+            Returns a tuple of a list of serial numbers, a list of timestamps and a 2D float
+            array with units in rows and the test case values (test case by test case) in
+            columns.
+        '''
+        n_features = self.getFeatureCount()
+        data = np.empty((n_units, n_features))
+        start = datetime(2019, 3, 14, 8, 0, 0)
+        serials, stamps = [], []
+        for i in range(n_units):
+            unit = first_unit+i
+            rng = np.random.default_rng((self._seed, unit))
+            factors = rng.normal(size=self._nfactors)
+            data[i] = self._mean + factors @ self._loadings + rng.normal(scale=self._noise, size=n_features)
+            if (defect_rate > 0) and (rng.random() < defect_rate):
+                data[i] += self._defect
+            serials.append("SN{:07d}".format(unit))
+            stamps.append(_formatTimestamp(start + timedelta(seconds=37*unit)))
+        return serials, stamps, data
+
+    def writeAsciiTestCaseFile(self, o_filename, n_units, first_unit=0, defect_rate=0.0, limits=True, precision=6):
+        '''
+        Writes the units as a SigQC ASCII test case file with a header, data section and
+        (optionally) limits section for each test case.
+
+        Inputs
+        ------
+            o_filename - Path of the file to write.
+            n_units - Number of units.
+            first_unit, defect_rate - (Optional) See getUnits().
+            limits - (Optional) Boolean specifying whether limits sections are written.
+            precision - (Optional) Number of significant digits of the values.
+
+        Outputs
+        -------
+            Returns the size of the written file in bytes.
+        '''
+        # Units are generated once in chunks and kept as formatted text per test case, since
+        # the file is written test case by test case
+        rowformat = ",".join(["%.{}g".format(precision)]*self._npoints)
+        cases = [[] for c in range(self._ncases)]
+        for chunk in range(0, n_units, CHUNK_UNITS):
+            serials, stamps, data = self.getUnits(min(CHUNK_UNITS, n_units-chunk), first_unit+chunk, defect_rate)
+            for c in range(self._ncases):
+                values = data[:, c*self._npoints:(c+1)*self._npoints]
+                cases[c].append("".join("{},{},{}\n".format(serial, stamp, rowformat % tuple(row)) for serial, stamp, row in zip(serials, stamps, values)))
+        domain = ",".join("{:g}".format(x) for x in self._domain)
+        with open(o_filename, 'w', newline='') as f:
+            for c in range(self._ncases):
+                f.write("BEGINHEADER\n{}\n{}\n{}\nMic 1\nFRF\n{}\n0\nHz\ndB\nENDHEADER\n".format(
+                        self._product, self.getTestName(c), self.getCaseName(c), self._npoints))
+                f.write("BEGINDATA\nSerial Number,Time,{}\n".format(domain))
+                f.writelines(cases[c])
+                f.write("ENDDATA\n\n")
+                if (limits):
+                    mean = self._mean[c*self._npoints:(c+1)*self._npoints]
+                    f.write("BEGINLIMITS\n{}\n{}\n{}\nENDLIMITS\n\n".format(domain, rowformat % tuple(mean-6.0),
+                                                                           rowformat % tuple(mean+6.0)))
+                cases[c] = None
+        return os.path.getsize(o_filename)
+
+    def writeUnitDataFile(self, o_filename, n_units, first_unit=0, defect_rate=0.0, missing_rate=0.0, precision=6):
+        '''
+        Writes the units as a SigQC unit data file with one column per test case, holding the
+        value of the test case at its middle domain point.
+
+        Inputs
+        ------
+            o_filename - Path of the file to write.
+            n_units - Number of units.
+            first_unit, defect_rate - (Optional) See getUnits().
+            missing_rate - (Optional) Fraction of values written as missing ("--------").
+            precision - (Optional) Number of significant digits of the values.
+
+        Outputs
+        -------
+            Returns the size of the written file in bytes.
+        '''
+        middle = self._npoints//2
+        columns = np.arange(self._ncases)*self._npoints + middle
+        rng = np.random.default_rng((self._seed, 1 << 40))
+        valueformat = "%.{}g".format(precision)
+        with open(o_filename, 'w', newline='') as f:
+            f.write("Serial Number,Date,Time,"+",".join(self.getTestName(c) for c in range(self._ncases))+"\n")
+            f.write(",,,"+",".join(self.getCaseName(c) for c in range(self._ncases))+"\n")
+            for chunk in range(0, n_units, CHUNK_UNITS):
+                serials, stamps, data = self.getUnits(min(CHUNK_UNITS, n_units-chunk), first_unit+chunk, defect_rate)
+                values = np.char.mod(valueformat, data[:,columns]).astype(object)
+                if (missing_rate > 0):
+                    values[rng.random(values.shape) < missing_rate] = MISSING_VALUE
+                for serial, stamp, row in zip(serials, stamps, values):
+                    date, clock = stamp.split(" ", 1)
+                    f.write("{},{},{},{}\n".format(serial, date, clock, ",".join(row)))
+        return os.path.getsize(o_filename)
+
+def _formatTimestamp(i_time):
+    '''
+    Formats a datetime the way SigQC exports timestamps, e.g. "3/14/2019 1:05:22 PM".
+    '''
+    hour = i_time.hour % 12
+    return "{}/{}/{} {}:{:02d}:{:02d} {}".format(i_time.month, i_time.day, i_time.year, 12 if (hour == 0) else hour,
+                                               i_time.minute, i_time.second, "AM" if (i_time.hour < 12) else "PM")
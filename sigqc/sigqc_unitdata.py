@@ -1,7 +1,8 @@
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
+import os
 from sigqc import sigqc_primitives
+from sigqc import sigqc_instrument
+from sigqc import sigqc_memory
 
 ##################################################################################
 # sigqc_unitdata.py
@@ -52,7 +53,7 @@ class SigQCUnitDataFile:
         x.Read()
     
     '''      
-    def __init__(self,i_filename=None,i_delimiter=","):
+    def __init__(self,i_filename=None,i_delimiter=",",i_rowfilter=None):
         '''
         Constructor for a SigQCUnitDataFile class to open and read the content of
         a specified unit data file.  If a filename is specified, then the file is
@@ -66,6 +67,11 @@ class SigQCUnitDataFile:
             i_delimiter- String that contains the delimiter character.  By default,
                          the delimiter is a comma.
                          
+            i_rowfilter- Optionally specify a function called as i_rowfilter(serialnumber,
+                         timestamp) for each unit, where the timestamp is the date and time
+                         columns joined by a space.  Only units for which it returns True
+                         are kept (see SetRowFilter()).
+                         
         Example:
             x = SigQCUnitDataFile("D:\MyData\MyUnitDataFile.csv", "\t")
             y = x.GetArray("1-GOPEN", "[GO] RL Start Click")
@@ -85,6 +91,7 @@ class SigQCUnitDataFile:
         self._times = None
         self._casenames = None
         self._testnames = None
+        self._rowfilter = i_rowfilter
         self._dataread = False
         if (self._filename is not None):
             self.Read()
@@ -114,6 +121,15 @@ class SigQCUnitDataFile:
         '''
         self._delimiter = i_delimiter
         
+    def SetRowFilter(self,i_rowfilter):
+        '''
+        Set a function that selects the units to be read.  It is called as
+        i_rowfilter(serialnumber, timestamp) for each data row, where the timestamp is the
+        date and time columns joined by a space.  Rows for which it returns False are dropped
+        before their values are converted.  None reads all units.
+        '''
+        self._rowfilter = i_rowfilter
+        
     def Read(self):
         '''
         Read the content of the targeted unit data file.
@@ -127,6 +143,17 @@ class SigQCUnitDataFile:
         # Indicate that an attempt has been made to read the unit data file...
         self._dataread = True
 
+        with sigqc_instrument.span("unitdata.read", file=os.path.basename(self._filename)) as span:
+            self._read()
+            if (sigqc_instrument.isEnabled()) and (self._casedata is not None):
+                rows, cols = np.shape(self._casedata)
+                size = os.path.getsize(self._filename)
+                span.set(rows=rows, bytes=size, features=cols)
+                sigqc_instrument.count("rows", rows)
+                sigqc_instrument.count("bytes", size)
+                sigqc_instrument.count("features", cols)
+
+    def _read(self):
         # Read the unit data file as text...
         textdata = np.genfromtxt(self._filename, dtype=str, comments=None, delimiter=self._delimiter, skip_header=0)
         if (textdata is None):
@@ -139,13 +166,22 @@ class SigQCUnitDataFile:
         # Split the serial numbers, date, time, test labels, case labels, and data columns...
         textlist = np.hsplit(textdata,(1,2,3,cols))
         self._serialnumbers = np.delete(textlist[0],(0,1) )
+        self._dates = np.delete(textlist[1],(0,1) )
+        self._times = np.delete(textlist[2],(0,1) )
         valuestext = np.vsplit(textlist[3], (1,2,rows))
         self._testnames = valuestext[0].flatten()
         self._casenames = valuestext[1].flatten()
         self._casedata = valuestext[2]
+        
+        # Drop the units rejected by the row filter before converting values...
+        if (self._rowfilter is not None):
+            keep = np.array([bool(self._rowfilter(self._serialnumbers[i], self._dates[i]+" "+self._times[i])) for i in range(len(self._serialnumbers))], dtype=bool)
+            self._serialnumbers = self._serialnumbers[keep]
+            self._dates = self._dates[keep]
+            self._times = self._times[keep]
+            self._casedata = self._casedata[keep]
 
-        cols = len(self._casedata[0,:])
-        rows = len(self._casedata[:,0])
+        rows, cols = np.shape(self._casedata)
         for i in range(0,rows):
             for j in range(0,cols):
                 if (self._casedata[i,j] == "--------"):
@@ -161,6 +197,13 @@ class SigQCUnitDataFile:
         '''
         return self._serialnumbers
     
+    def GetTimestamps(self):
+        '''
+        Get an array of the timestamps of the units, which are the date and time columns
+        joined by a space, in the same order as the serial numbers.
+        '''
+        return np.char.add(np.char.add(self._dates, " "), self._times)
+    
     def GetCaseDataTable(self):
         '''
         Get a 2D array of all test case values within the targeted unit data
@@ -171,6 +214,14 @@ class SigQCUnitDataFile:
         
         '''
         return self._casedata
+
+    def GetMemoryUsage(self):
+        '''
+        Get the memory held by the unit data file, broken down into numeric arrays, strings
+        (serial numbers, dates, times and names) and other metadata.  See
+        sigqc_memory.getMemoryUsage() for the keys of the dictionary returned.
+        '''
+        return sigqc_memory.getMemoryUsage(self)
     
     def GetCaseNames(self):
         '''
@@ -197,6 +248,21 @@ class SigQCUnitDataFile:
             group.AppendByNames("", self._testnames[i], self._casenames[i], True)
         return group
     
+    def GetFeatureKeys(self):
+        '''
+        Get the feature keys of the columns of the data table.  Unit data files do not name
+        the product, so each key is the "*.test.case" string returned by
+        SigQCTestCaseID.GetFeatureKey() for the acceptance test and test case of the column.
+        
+        Return:
+            A list of strings with one key per column of the data table.
+        '''
+        keys = []
+        count = len(self._testnames)
+        for i in range(0,count):
+            keys.append(sigqc_primitives.SigQCTestCaseID("", self._testnames[i], self._casenames[i]).GetFeatureKey())
+        return keys
+    
     def GetIndexOfCase(self, i_testname, i_casename):
         '''
         Get the column index relative to the start of the data table at which the
@@ -423,6 +489,13 @@ class SigQCUnitDataFiles:
             if ( self._files[i].HasBeenRead() == False ):
                 self._files[i].Read()
     
+    def GetMemoryUsage(self):
+        '''
+        Get the memory held by all managed unit data files (see
+        SigQCUnitDataFile.GetMemoryUsage()).
+        '''
+        return sigqc_memory.getMemoryUsage(self)
+
     def GetArrays(self, i_testname, i_casename):
         '''
         Get the all of the column data of the targeted test case found in all managed
@@ -0,0 +1,312 @@
+import numpy as np
+import os
+import time
+import fnmatch
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from sigqc import sigqc_referencemodel
+
+#########################################################################################################################
+# sigqc_watcher.py
+#
+# Watch-folder ingestion of SigQC exports. A SigQCFolderWatcher polls one or more folders that
+# stations drop ASCII test case or unit data exports into. A file counts as complete once its
+# size and modification time stay the same over consecutive polls. Complete files are handed
+# to a bounded pool of worker processes, which parse them and score them against a reference
+# model (or pass them to a custom handler). At most max_pending files are in flight at a time,
+# and ready files beyond that wait in the folder for a later poll (backpressure).
+#
+# Every processed file is recorded in a small SQLite state store with the size and
+# modification time it had when processed, so a restarted watcher skips files it has already
+# handled and only picks up new or changed ones. The PC score files the watcher writes (and
+# any other files matching the exclude patterns) are never picked up, even when they are
+# written into a watched folder.
+#
+# Example Usage:
+#  model = sigqc_referencemodel.SigQCReferenceModel("[full path here]\\ReferenceData.csv")
+#  watcher = SigQCFolderWatcher(["\\\\station1\\exports", "\\\\station2\\exports"], i_model=model,
+#                               o_path="[results path]", state_file="[results path]\\watcher.sqlite")
+#  watcher.run()                      # polls until stop() is called or Ctrl+C
+#
+#  ### Or from a scheduled task ###
+#  watcher.poll(); watcher.drain(); print(watcher.getMetrics())
+#
+#########################################################################################################################
+
+# Shell patterns of the files written by the watcher (see sigqc_referencemodel.writePCScores()),
+# which are not processed even when they match the watched pattern
+OUTPUT_PATTERNS = ("*_PCScores.csv", "*_PCScores.npy", "*_PCScores_Serials.csv")
+
+def detectInputType(i_filename):
+    '''
+    Returns "ascii" if the file is a SigQC ASCII test case export (its first non-blank line
+    contains BEGINHEADER) and "unit" otherwise.
+    '''
+    with open(i_filename, 'r') as f:
+        for line in f:
+            if (line.strip() != ""):
+                return "ascii" if ("BEGINHEADER" in line) else "unit"
+    return "unit"
+
+# Reference model held by each worker process of a SigQCFolderWatcher
+_workermodel = None
+
+def _initWorker(i_model):
+    global _workermodel
+    _workermodel = i_model
+
+def _processFile(i_handler, i_filename, input_type, n_pcs, o_path):
+    '''
+    Processes one file in a worker process and returns the number of units and the worker
+    time in milliseconds.
+    '''
+    start = time.perf_counter()
+    if (input_type == "auto"):
+        input_type = detectInputType(i_filename)
+    if (i_handler is None):
+        serials, headers, pcscores = _workermodel.scoreFile(i_filename, input_type, n_pcs)
+        name = os.path.splitext(os.path.basename(i_filename))[0]
+        sigqc_referencemodel.writePCScores(os.path.join(o_path, name+"_PCScores.csv"), serials, pcscores)
+        units = len(serials)
+    else:
+        result = i_handler(i_filename, input_type)
+        units = len(result) if hasattr(result, '__len__') else 0
+    return units, 1000*(time.perf_counter()-start)
+
+###################################
+# SigQCFolderWatcher class
+###################################
+class SigQCFolderWatcher:
+    '''
+    The SigQCFolderWatcher class detects new or changed SigQC export files in a set of folders
+    and processes each of them once.
+    '''
+    def __init__(self, i_folders, i_model=None, i_handler=None, pattern="*.csv", input_type="auto",
+                 o_path=None, n_pcs=None, state_file="SigQCWatcher.sqlite", poll_interval=2.0,
+                 stable_polls=2, workers=None, max_pending=None, exclude=OUTPUT_PATTERNS):
+        '''
+        Constructor for an instance of the SigQCFolderWatcher class.
+
+        Input:
+            i_folders - Folder path or list of folder paths to watch (not recursive).
+            i_model - (Optional) SigQCReferenceModel (or path to a reference data file) that
+                      files are scored against. The PC scores of each file are written to
+                      o_path as [file name]_PCScores.csv.
+            i_handler - (Optional) Picklable function called as i_handler(filename, input_type)
+                        in a worker process instead of scoring against i_model.
+            pattern - (Optional) Shell pattern of the file names to process. Defaults to "*.csv".
+            input_type - (Optional) "ascii", "unit" or "auto" to detect the type from the
+                         file content. Defaults to "auto".
+            o_path - (Optional) Directory for the PC score files. Defaults to the folder of
+                     each file.
+            n_pcs - (Optional) Number of PCs scored. Defaults to all PCs.
+            state_file - (Optional) Path of the SQLite state store.
+            poll_interval - (Optional) Seconds between polls. Defaults to 2.
+            stable_polls - (Optional) Number of consecutive polls over which a file's size and
+                           modification time must not change before it is processed.
+            workers - (Optional) Number of worker processes. Defaults to the number of CPUs.
+            max_pending - (Optional) Maximum number of files submitted to the pool and not yet
+                          finished. Defaults to twice the number of workers.
+            exclude - (Optional) Shell patterns of file names that are never processed.
+                      Defaults to the PC score files written by the watcher (OUTPUT_PATTERNS).
+        '''
+        if (i_model is None) and (i_handler is None):
+            raise Exception("Error: Please provide either a reference model or a handler")
+        if isinstance(i_folders, str):
+            i_folders = [i_folders]
+        if (i_model is not None) and not isinstance(i_model, sigqc_referencemodel.SigQCReferenceModel):
+            i_model = sigqc_referencemodel.SigQCReferenceModel(i_model)
+        self._folders = list(i_folders)
+        self._model = i_model
+        self._handler = i_handler
+        self._pattern = pattern
+        self._exclude = list(exclude or [])
+        self._inputtype = input_type
+        self._opath = o_path
+        self._npcs = n_pcs
+        self._pollinterval = poll_interval
+        self._stablepolls = stable_polls
+        self._workers = workers if (workers is not None) else (os.cpu_count() or 1)
+        self._maxpending = max_pending if (max_pending is not None) else 2*self._workers
+        self._candidates = {}
+        self._settled = {}
+        self._ready = {}
+        self._inflight = {}
+        self._executor = None
+        self._running = False
+        self._processed = 0
+        self._failed = 0
+        self._latencies = []
+
+        self._db = sqlite3.connect(state_file)
+        self._db.execute("CREATE TABLE IF NOT EXISTS processed (path TEXT PRIMARY KEY, size INTEGER, "
+                         "mtime_ns INTEGER, status TEXT, units INTEGER, latency_ms REAL, worker_ms REAL, "
+                         "processed_at REAL, error TEXT)")
+        self._db.commit()
+
+    def _getExecutor(self):
+        if (self._executor is None):
+            if (self._handler is None):
+                self._executor = ProcessPoolExecutor(max_workers=self._workers, initializer=_initWorker, initargs=(self._model,))
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        return self._executor
+
+    def isProcessed(self, i_filename, i_size, i_mtime_ns):
+        '''
+        Returns True if the state store holds a record of the file with the given size and
+        modification time.
+        '''
+        row = self._db.execute("SELECT size, mtime_ns FROM processed WHERE path = ?", (os.path.abspath(i_filename),)).fetchone()
+        return (row is not None) and (row[0] == i_size) and (row[1] == i_mtime_ns)
+
+    def isWatched(self, i_name):
+        '''
+        Returns True if a file name matches the watched pattern and none of the exclude patterns.
+        '''
+        return fnmatch.fnmatch(i_name, self._pattern) and not any(fnmatch.fnmatch(i_name, p) for p in self._exclude)
+
+    def _scan(self):
+        '''
+        Returns a dictionary mapping the absolute paths of the matching files in the watched
+        folders to their (size, modification time) signatures.
+        '''
+        found = {}
+        for folder in self._folders:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_file() and self.isWatched(entry.name):
+                    status = entry.stat()
+                    found[os.path.abspath(entry.path)] = (status.st_size, status.st_mtime_ns)
+        return found
+
+    def poll(self):
+        '''
+        Runs one polling pass: collects finished files, scans the folders, marks files whose
+        signature has been stable for stable_polls polls as ready, and submits ready files to
+        the worker pool while fewer than max_pending are in flight.
+
+        Return:
+            The number of files submitted during this pass.
+        '''
+        self._collect()
+        now = time.perf_counter()
+        found = self._scan()
+        for path, signature in found.items():
+            if (path in self._inflight) or (self._settled.get(path) == signature):
+                continue
+            previous = self._candidates.get(path)
+            count = previous[1]+1 if (previous is not None) and (previous[0] == signature) else 1
+            self._candidates[path] = (signature, count)
+            if (count >= self._stablepolls):
+                del self._candidates[path]
+                self._settled[path] = signature
+                self._ready.pop(path, None)
+                if not self.isProcessed(path, signature[0], signature[1]):
+                    self._ready[path] = (signature, now)
+        for table in (self._candidates, self._settled, self._ready):
+            for path in [p for p in table if p not in found]:
+                del table[path]
+
+        submitted = 0
+        while (len(self._ready) > 0) and (len(self._inflight) < self._maxpending):
+            path = next(iter(self._ready))
+            signature, readytime = self._ready.pop(path)
+            o_path = self._opath if (self._opath is not None) else os.path.dirname(path)
+            future = self._getExecutor().submit(_processFile, self._handler, path, self._inputtype, self._npcs, o_path)
+            self._inflight[path] = (future, signature, readytime)
+            submitted += 1
+        return submitted
+
+    def _collect(self):
+        '''
+        Records the files whose processing has finished in the state store.
+        '''
+        for path in [p for p, item in self._inflight.items() if item[0].done()]:
+            future, signature, readytime = self._inflight.pop(path)
+            latency = 1000*(time.perf_counter()-readytime)
+            try:
+                units, workerms = future.result()
+                status, error = "ok", None
+                self._processed += 1
+            except Exception as e:
+                units, workerms, status, error = 0, None, "failed", str(e)
+                self._failed += 1
+            self._latencies.append(latency)
+            if (len(self._latencies) > 10000):
+                del self._latencies[:5000]
+            self._db.execute("INSERT OR REPLACE INTO processed VALUES (?,?,?,?,?,?,?,?,?)",
+                             (path, signature[0], signature[1], status, units, latency, workerms, time.time(), error))
+        self._db.commit()
+
+    def drain(self, timeout=None):
+        '''
+        Polls until no files are ready or in flight, or the timeout in seconds expires.
+        '''
+        start = time.perf_counter()
+        self.poll()
+        while (len(self._ready) > 0) or (len(self._inflight) > 0) or (len(self._candidates) > 0):
+            if (timeout is not None) and (time.perf_counter()-start > timeout):
+                break
+            time.sleep(min(self._pollinterval, 0.05))
+            self.poll()
+        self._collect()
+
+    def run(self):
+        '''
+        Polls the folders every poll_interval seconds until stop() is called or the process
+        is interrupted.
+        '''
+        self._running = True
+        try:
+            while (self._running):
+                self.poll()
+                time.sleep(self._pollinterval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def stop(self):
+        '''
+        Makes run() return after the current poll.
+        '''
+        self._running = False
+
+    def close(self):
+        '''
+        Waits for the files in flight, records them and shuts down the worker pool.
+        '''
+        if (self._executor is not None):
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._collect()
+
+    def getMetrics(self):
+        '''
+        Returns a dictionary with the queue depth (files ready but not submitted), the number
+        of files in flight, the number of files processed and failed since start up, and the
+        median, 95th percentile and maximum latency in milliseconds from a file becoming ready
+        to its result being recorded.
+        '''
+        metrics = {"queue_depth": len(self._ready), "in_flight": len(self._inflight),
+                   "waiting_to_settle": len(self._candidates), "processed": self._processed,
+                   "failed": self._failed}
+        if (len(self._latencies) > 0):
+            latencies = np.array(self._latencies)
+            metrics["latency_ms"] = {"median": float(np.median(latencies)), "p95": float(np.percentile(latencies, 95)),
+                                     "max": float(np.max(latencies))}
+        return metrics
+
+    def getHistory(self, status=None):
+        '''
+        Returns the records of the state store as a list of tuples (path, size, mtime_ns,
+        status, units, latency_ms, worker_ms, processed_at, error), optionally only those of one status
+        ("ok" or "failed").
+        '''
+        if (status is None):
+            return self._db.execute("SELECT * FROM processed ORDER BY processed_at").fetchall()
+        return self._db.execute("SELECT * FROM processed WHERE status = ? ORDER BY processed_at", (status,)).fetchall()